@@ -0,0 +1,204 @@
+import sys
+import time
+from typing import Callable, List, Tuple
+
+from cache import Cache, EVICTION_POLICY_LRU, EVICTION_POLICY_SLRU,\
+    EVICTION_POLICY_TINY_LFU
+from commands import Command
+from command_executor import execute_command
+from command_parser import parse_command
+from config import STORAGE_ENGINE, EXPIRATION_INDEX
+
+
+_DEFAULT_CACHE_SIZES = [1000, 100 * 1000]
+_TTL_SHARES = (0.0, 0.5)
+# long enough for the items not to expire during the measurement
+_TTL = 3600
+_VALUE = b'x' * 100
+# the best of the repeats is reported, like timeit does
+_REPEATS = 3
+
+
+class _Workload:
+    """
+    Keys of the cache and the TTLs they are stored with
+    """
+
+    def __init__(self, size: int, ttl_share: float) -> None:
+        self.size = size
+        self.keys = [f'key_{index}' for index in range(size)]
+        # spread evenly, every ten keys have the same share of TTLs
+        self.ttls = [
+            _TTL if index % 10 < ttl_share * 10 else 0
+            for index in range(size)
+        ]
+        self.new_keys = [f'new_key_{index}' for index in range(size)]
+        self.missing_keys = [f'missing_key_{index}' for index in range(size)]
+
+    def create_cache(
+            self, eviction_policy: str = EVICTION_POLICY_LRU) -> Cache:
+        cache = Cache(
+            max_number_of_items=self.size, eviction_policy=eviction_policy)
+        for key, ttl in zip(self.keys, self.ttls):
+            cache.set_item(key, _VALUE, ttl)
+        return cache
+
+
+# Runs the action on a fresh state several times,
+# returns the best duration per operation in nanoseconds
+def _measure(
+        prepare: Callable[[], Callable[[], None]], operations: int
+) -> float:
+    best = None
+    for _ in range(_REPEATS):
+        action = prepare()
+        start = time.perf_counter_ns()
+        action()
+        duration = time.perf_counter_ns() - start
+        best = duration if best is None else min(best, duration)
+    assert best is not None
+    return best / operations
+
+
+def _benchmark_cache(workload: _Workload) -> List[Tuple[str, float]]:
+    keys = workload.keys
+    ttls = workload.ttls
+
+    def set_new() -> Callable[[], None]:
+        cache = Cache(max_number_of_items=workload.size)
+
+        def run() -> None:
+            for key, ttl in zip(keys, ttls):
+                cache.set_item(key, _VALUE, ttl)
+        return run
+
+    def set_existing() -> Callable[[], None]:
+        cache = workload.create_cache()
+
+        def run() -> None:
+            for key, ttl in zip(keys, ttls):
+                cache.set_item(key, _VALUE, ttl)
+        return run
+
+    def get_hit() -> Callable[[], None]:
+        cache = workload.create_cache()
+
+        def run() -> None:
+            for key in keys:
+                cache.get_item(key)
+        return run
+
+    def get_miss() -> Callable[[], None]:
+        cache = workload.create_cache()
+
+        def run() -> None:
+            for key in workload.missing_keys:
+                cache.get_item(key)
+        return run
+
+    def delete() -> Callable[[], None]:
+        cache = workload.create_cache()
+
+        def run() -> None:
+            for key in keys:
+                cache.delete_item(key)
+        return run
+
+    results = [
+        ('set new', _measure(set_new, workload.size)),
+        ('set existing', _measure(set_existing, workload.size)),
+        ('get hit', _measure(get_hit, workload.size)),
+        ('get miss', _measure(get_miss, workload.size)),
+        ('delete', _measure(delete, workload.size)),
+    ]
+
+    # the cache is full, so every insertion evicts an item
+    for policy in (
+            EVICTION_POLICY_LRU, EVICTION_POLICY_SLRU,
+            EVICTION_POLICY_TINY_LFU
+    ):
+        def set_evicting() -> Callable[[], None]:
+            cache = workload.create_cache(policy)
+
+            def run() -> None:
+                for key, ttl in zip(workload.new_keys, ttls):
+                    cache.set_item(key, _VALUE, ttl)
+            return run
+
+        results.append(
+            (f'set evicting ({policy})',
+             _measure(set_evicting, workload.size)))
+    return results
+
+
+def _benchmark_commands(workload: _Workload) -> List[Tuple[str, float]]:
+    keys = workload.keys
+    get_messages = [f'get {key}' for key in keys]
+    set_messages = [f'set {key} 0 {len(_VALUE)}' for key in keys]
+    multi_get_messages = [
+        'mget ' + ' '.join(keys[index:index + 10])
+        for index in range(0, len(keys), 10)
+    ]
+
+    def parse(messages: List[str]) -> Callable[[], Callable[[], None]]:
+        def prepare() -> Callable[[], None]:
+            def run() -> None:
+                for message in messages:
+                    parse_command(message)
+            return run
+        return prepare
+
+    def parse_all(messages: List[str]) -> List[Command]:
+        commands = []
+        for message in messages:
+            command = parse_command(message).command
+            assert command is not None
+            commands.append(command)
+        return commands
+
+    get_commands = parse_all(get_messages)
+    set_commands = parse_all(set_messages)
+    for command in set_commands:
+        command.set_bytes_attachment(_VALUE)
+
+    def execute(commands: List[Command]) -> Callable[[], Callable[[], None]]:
+        def prepare() -> Callable[[], None]:
+            cache = workload.create_cache()
+
+            def run() -> None:
+                for command in commands:
+                    execute_command(command, cache)
+            return run
+        return prepare
+
+    return [
+        ('parse get', _measure(parse(get_messages), len(get_messages))),
+        ('parse set', _measure(parse(set_messages), len(set_messages))),
+        ('parse mget (10 keys)',
+         _measure(parse(multi_get_messages), len(multi_get_messages))),
+        ('execute get', _measure(execute(get_commands), len(get_commands))),
+        ('execute set', _measure(execute(set_commands), len(set_commands))),
+    ]
+
+
+# Measures the cache operations, the command parser and executor
+# called directly, at the given cache sizes:
+# python3 src/bench_cache.py [CACHE_SIZE ...]
+def main() -> None:
+    sizes = [int(size) for size in sys.argv[1:]] or _DEFAULT_CACHE_SIZES
+    print(f'Storage engine: {STORAGE_ENGINE}, '
+          f'expiration index: {EXPIRATION_INDEX}')
+    for size in sizes:
+        for ttl_share in _TTL_SHARES:
+            workload = _Workload(size, ttl_share)
+            print(f'{size} items, {ttl_share:.0%} with TTL:')
+            results = _benchmark_cache(workload)
+            if ttl_share == _TTL_SHARES[0]:
+                # TTLs don't affect the commands beyond the cache itself
+                results += _benchmark_commands(workload)
+            for name, duration in results:
+                print(f'  {name}: {duration:.0f} ns')
+
+
+if __name__ == '__main__':
+    main()
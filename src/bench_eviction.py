@@ -0,0 +1,74 @@
+import random
+import sys
+from typing import Iterator, List
+
+from cache import Cache, EVICTION_POLICY_LRU, EVICTION_POLICY_SLRU,\
+    EVICTION_POLICY_TINY_LFU
+
+
+_POLICIES = (
+    EVICTION_POLICY_LRU, EVICTION_POLICY_SLRU, EVICTION_POLICY_TINY_LFU
+)
+_DEFAULT_CAPACITY = 1000
+_VALUE = b'x'
+
+# parameters of the synthetic trace used when no trace file is given:
+# a Zipf-distributed hot set interleaved with scans of unique keys
+_SYNTHETIC_TRACE_LENGTH = 200 * 1000
+_SYNTHETIC_HOT_KEYS = 5000
+_SYNTHETIC_SCAN_SHARE = 0.3
+
+
+def _read_trace(path: str) -> Iterator[str]:
+    with open(path) as trace:
+        for line in trace:
+            fields = line.split()
+            if fields:
+                yield fields[0]
+
+
+def _generate_trace() -> List[str]:
+    random.seed(0)
+    weights = [1 / rank for rank in range(1, _SYNTHETIC_HOT_KEYS + 1)]
+    hot_keys = random.choices(
+        range(_SYNTHETIC_HOT_KEYS), weights, k=_SYNTHETIC_TRACE_LENGTH)
+    trace: List[str] = []
+    for index, hot_key in enumerate(hot_keys):
+        if random.random() < _SYNTHETIC_SCAN_SHARE:
+            trace.append(f'scan_{index}')
+        else:
+            trace.append(f'hot_{hot_key}')
+    return trace
+
+
+# Replays the trace as a read-through cache:
+# every miss is followed by storing the item
+def _replay(trace: List[str], policy: str, capacity: int) -> float:
+    cache = Cache(max_number_of_items=capacity, eviction_policy=policy)
+    hits = 0
+    for key in trace:
+        if cache.get_item(key) is not None:
+            hits += 1
+        else:
+            cache.set_item(key, _VALUE)
+    return hits / len(trace) if trace else 0.0
+
+
+# Reports hit ratio of each eviction policy on a recorded key stream,
+# one key per line (the first field of the line is used):
+# python3 src/bench_eviction.py [TRACE_FILE] [CAPACITY]
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] != '-':
+        trace = list(_read_trace(sys.argv[1]))
+        print(f'Trace {sys.argv[1]}: {len(trace)} requests')
+    else:
+        trace = _generate_trace()
+        print(f'Synthetic trace: {len(trace)} requests')
+    capacity = int(sys.argv[2]) if len(sys.argv) > 2 else _DEFAULT_CAPACITY
+    print(f'Capacity: {capacity} items')
+    for policy in _POLICIES:
+        print(f'{policy}: hit ratio {_replay(trace, policy, capacity):.4f}')
+
+
+if __name__ == '__main__':
+    main()
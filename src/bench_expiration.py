@@ -0,0 +1,74 @@
+import random
+import sys
+import time
+from typing import Callable, List, Tuple
+
+from expiration_index import ExpirationIndex, create_expiration_index,\
+    EXPIRATION_INDEX_HEAP, EXPIRATION_INDEX_TIMING_WHEEL
+
+
+_DEFAULT_NUMBER_OF_KEYS = 1000 * 1000
+_MAX_TTL_SECONDS = 3600
+_NANOSECONDS_IN_SECOND = 1000 * 1000 * 1000
+_POP_BATCH_SIZE = 1000
+
+
+def _measure(action: Callable[[], None]) -> float:
+    start = time.perf_counter()
+    action()
+    return time.perf_counter() - start
+
+
+def _benchmark(name: str, keys: List[str], ttls: List[int]) -> None:
+    index: ExpirationIndex = create_expiration_index(name)
+    now = time.time_ns()
+    expirations = [now + ttl for ttl in ttls]
+
+    def add() -> None:
+        for key, expiration in zip(keys, expirations):
+            index.add(key, expiration)
+
+    # every key gets a new expiration, the old one is cancelled
+    def replace() -> None:
+        for key, expiration in zip(keys, reversed(expirations)):
+            index.remove(key)
+            index.add(key, expiration)
+
+    def expire() -> None:
+        deadline = now + (_MAX_TTL_SECONDS + 1) * _NANOSECONDS_IN_SECOND
+        expired = 0
+        while True:
+            batch = index.pop_expired(deadline, _POP_BATCH_SIZE)
+            expired += len(batch)
+            if len(batch) < _POP_BATCH_SIZE:
+                break
+        assert expired == len(keys)
+
+    results: List[Tuple[str, float]] = [
+        ('add', _measure(add)),
+        ('replace', _measure(replace)),
+        ('expire', _measure(expire)),
+    ]
+    summary = ', '.join(
+        f'{action} {duration:.2f}s' for action, duration in results)
+    print(f'{name}: {summary}')
+
+
+# Compares the expiration indexes on the given number of keys:
+# python3 src/bench_expiration.py [NUMBER_OF_KEYS]
+def main() -> None:
+    number_of_keys = int(sys.argv[1]) if len(sys.argv) > 1\
+        else _DEFAULT_NUMBER_OF_KEYS
+    random.seed(0)
+    keys = [f'key_{index}' for index in range(number_of_keys)]
+    ttls = [
+        random.randint(1, _MAX_TTL_SECONDS * _NANOSECONDS_IN_SECOND)
+        for _ in range(number_of_keys)
+    ]
+    print(f'{number_of_keys} keys with TTL up to {_MAX_TTL_SECONDS}s')
+    for name in (EXPIRATION_INDEX_HEAP, EXPIRATION_INDEX_TIMING_WHEEL):
+        _benchmark(name, keys, ttls)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from array import array
+from itertools import accumulate
+from multiprocessing import Process
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from binary_protocol import REQUEST_HEADER, RESPONSE_HEADER, REQUEST_MAGIC,\
+    OPCODE_GET, OPCODE_SET, STATUS_SUCCESS, STATUS_NOT_FOUND
+from config import HOST, PORT
+from protocol import SEPARATOR_BINARY
+
+
+PROTOCOL_TEXT = 'text'
+PROTOCOL_BINARY = 'binary'
+KEY_DISTRIBUTION_UNIFORM = 'uniform'
+KEY_DISTRIBUTION_ZIPF = 'zipf'
+SERVER_EXTERNAL = 'external'
+SERVER_SPAWN = 'spawn'
+
+_TEXT_NOT_FOUND = b'NOT_FOUND\r\n'
+_TEXT_SUCCESS = b'SUCCESS\r\n'
+_TEXT_PIPELINE = b'pipeline\r\n'
+_PRELOAD_BATCH_SIZE = 1000
+_SERVER_START_TIMEOUT = 10
+_SERVER_START_POLL_INTERVAL = 0.05
+_NANOSECONDS_IN_MICROSECOND = 1000
+_NANOSECONDS_IN_SECOND = 1000 * 1000 * 1000
+_PERCENTILES = (('p50', 50), ('p99', 99), ('p999', 99.9))
+
+
+class Operation(NamedTuple):
+    is_read: bool
+    # the request as it is sent to the server
+    data: bytes
+
+
+class ClientResult(NamedTuple):
+    # durations from sending the batch to receiving each response, in ns
+    latencies: 'array[int]'
+    hits: int
+    misses: int
+    errors: int
+
+
+# Parses "SIZE" or "MIN-MAX" into the range of the value sizes
+def _parse_size_range(text: str) -> Tuple[int, int]:
+    low, _, high = text.partition('-')
+    return int(low), int(high or low)
+
+
+# Parses "TTL:WEIGHT,TTL:WEIGHT,..." into the TTLs and their weights,
+# a TTL without weight gets the weight of 1
+def _parse_ttl_mix(text: str) -> Tuple[List[int], List[float]]:
+    ttls = []
+    weights = []
+    for part in text.split(','):
+        ttl, _, weight = part.partition(':')
+        ttls.append(int(ttl))
+        weights.append(float(weight or 1))
+    return ttls, weights
+
+
+def _get_key_weights(args: argparse.Namespace) -> List[float]:
+    if args.key_distribution == KEY_DISTRIBUTION_ZIPF:
+        return [
+            1 / rank ** args.zipf_exponent
+            for rank in range(1, args.keys + 1)
+        ]
+    return [1.0] * args.keys
+
+
+def _encode_set(protocol: str, key: str, value: bytes, ttl: int) -> bytes:
+    encoded_key = key.encode()
+    if protocol == PROTOCOL_BINARY:
+        return REQUEST_HEADER.pack(
+            REQUEST_MAGIC, OPCODE_SET, len(encoded_key), ttl, len(value), 0
+        ) + encoded_key + value
+    return b'set %s %d %d\r\n%s\r\n' % (encoded_key, ttl, len(value), value)
+
+
+def _encode_get(protocol: str, key: str) -> bytes:
+    encoded_key = key.encode()
+    if protocol == PROTOCOL_BINARY:
+        return REQUEST_HEADER.pack(
+            REQUEST_MAGIC, OPCODE_GET, len(encoded_key), 0, 0, 0
+        ) + encoded_key
+    return b'get %s\r\n' % encoded_key
+
+
+# Generates the requests of a client before the measurement starts,
+# so that the load generation doesn't compete with the server for CPU.
+# The same seed always gives the same requests.
+def _generate_operations(
+        args: argparse.Namespace,
+        key_cum_weights: List[float],
+        client_index: int,
+        count: int
+) -> List[Operation]:
+    rng = random.Random(args.seed * 1000 * 1000 + client_index)
+    min_size, max_size = _parse_size_range(args.value_size)
+    ttls, ttl_weights = _parse_ttl_mix(args.ttl)
+    value_source = bytes(rng.getrandbits(8) for _ in range(max_size))
+
+    key_indexes = rng.choices(
+        range(args.keys), cum_weights=key_cum_weights, k=count)
+    operations = []
+    for key_index in key_indexes:
+        key = f'key_{key_index}'
+        if rng.random() < args.read_ratio:
+            operations.append(Operation(True, _encode_get(args.protocol, key)))
+        else:
+            value = value_source[:rng.randint(min_size, max_size)]
+            ttl = rng.choices(ttls, ttl_weights)[0]
+            operations.append(Operation(
+                False, _encode_set(args.protocol, key, value, ttl)))
+    return operations
+
+
+async def _open_connection(
+        args: argparse.Namespace
+) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    if args.protocol == PROTOCOL_TEXT:
+        # the values are sent right after the headers, without prompts
+        writer.write(_TEXT_PIPELINE)
+        await reader.readuntil(SEPARATOR_BINARY)
+    return reader, writer
+
+
+# Reads a response, returns whether it's a hit, a miss or an error
+# as 1, 0 or -1 respectively (a successful set counts as a hit)
+async def _read_response(reader: asyncio.StreamReader, protocol: str) -> int:
+    if protocol == PROTOCOL_BINARY:
+        header = await reader.readexactly(RESPONSE_HEADER.size)
+        _, _, status, value_length, _ = RESPONSE_HEADER.unpack(header)
+        if value_length:
+            await reader.readexactly(value_length)
+        if status == STATUS_SUCCESS:
+            return 1
+        return 0 if status == STATUS_NOT_FOUND else -1
+
+    line = await reader.readuntil(SEPARATOR_BINARY)
+    if line == _TEXT_SUCCESS:
+        return 1
+    if line == _TEXT_NOT_FOUND:
+        return 0
+    if line[:1].isdigit():
+        await reader.readexactly(int(line) + len(SEPARATOR_BINARY))
+        return 1
+    return -1
+
+
+async def _run_client(
+        args: argparse.Namespace,
+        connection: Tuple[asyncio.StreamReader, asyncio.StreamWriter],
+        operations: List[Operation]
+) -> ClientResult:
+    reader, writer = connection
+    latencies = array('Q')
+    hits = misses = errors = 0
+
+    depth = args.pipeline
+    for position in range(0, len(operations), depth):
+        batch = operations[position:position + depth]
+        sent = time.perf_counter_ns()
+        writer.write(b''.join(operation.data for operation in batch))
+        for operation in batch:
+            outcome = await _read_response(reader, args.protocol)
+            latencies.append(time.perf_counter_ns() - sent)
+            if outcome < 0:
+                errors += 1
+            elif operation.is_read:
+                if outcome:
+                    hits += 1
+                else:
+                    misses += 1
+
+    writer.close()
+    await writer.wait_closed()
+    return ClientResult(latencies, hits, misses, errors)
+
+
+# Stores every key of the keyspace once, so that the reads can hit
+async def _preload(args: argparse.Namespace) -> None:
+    reader, writer = await _open_connection(args)
+    min_size, max_size = _parse_size_range(args.value_size)
+    value = b'x' * ((min_size + max_size) // 2)
+    for position in range(0, args.keys, _PRELOAD_BATCH_SIZE):
+        keys = range(position, min(position + _PRELOAD_BATCH_SIZE, args.keys))
+        writer.write(b''.join(
+            _encode_set(args.protocol, f'key_{index}', value, 0)
+            for index in keys))
+        for _ in keys:
+            await _read_response(reader, args.protocol)
+    writer.close()
+    await writer.wait_closed()
+
+
+def _get_percentile(ordered: 'array[int]', percentile: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+    return ordered[index] / _NANOSECONDS_IN_MICROSECOND
+
+
+async def _run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.preload:
+        await _preload(args)
+
+    key_cum_weights = list(accumulate(_get_key_weights(args)))
+    per_client, extra = divmod(args.requests, args.clients)
+    workloads = [
+        _generate_operations(
+            args, key_cum_weights, index, per_client + (index < extra))
+        for index in range(args.clients)
+    ]
+
+    # all connections are established before the measurement
+    connections = await asyncio.gather(
+        *(_open_connection(args) for _ in workloads))
+    started = time.perf_counter_ns()
+    results: List[ClientResult] = await asyncio.gather(*(
+        _run_client(args, connection, operations)
+        for connection, operations in zip(connections, workloads)
+    ))
+    duration = (time.perf_counter_ns() - started) / _NANOSECONDS_IN_SECOND
+
+    latencies = array('Q', sorted(
+        latency for result in results for latency in result.latencies))
+    latency_report = {
+        name: _get_percentile(latencies, percentile)
+        for name, percentile in _PERCENTILES
+    }
+    latency_report['max'] = _get_percentile(latencies, 100)
+    latency_report['mean'] = sum(latencies) / max(len(latencies), 1) /\
+        _NANOSECONDS_IN_MICROSECOND
+    return {
+        'requests': len(latencies),
+        'duration_s': duration,
+        'throughput_rps': len(latencies) / duration,
+        'latency_us': latency_report,
+        'hits': sum(result.hits for result in results),
+        'misses': sum(result.misses for result in results),
+        'errors': sum(result.errors for result in results),
+    }
+
+
+def _run_server() -> None:
+    from server import Server
+    Server().run()
+
+
+# Starts the server in a separate process and waits until it accepts
+# connections, so that it doesn't share the event loop with the clients
+def _spawn_server(args: argparse.Namespace) -> Process:
+    process = Process(target=_run_server, daemon=True)
+    process.start()
+    deadline = time.monotonic() + _SERVER_START_TIMEOUT
+    while True:
+        try:
+            asyncio.run(_check_connection(args))
+            return process
+        except OSError:
+            if time.monotonic() > deadline or not process.is_alive():
+                process.terminate()
+                raise
+            time.sleep(_SERVER_START_POLL_INTERVAL)
+
+
+async def _check_connection(args: argparse.Namespace) -> None:
+    _, writer = await asyncio.open_connection(args.host, args.port)
+    writer.close()
+    await writer.wait_closed()
+
+
+def _print_report(
+        report: Dict[str, Any], baseline: Optional[Dict[str, Any]]
+) -> None:
+    results = report['results']
+    base = baseline['results'] if baseline is not None else None
+
+    def show(name: str, value: float, old_value: Optional[float]) -> None:
+        line = f'{name:>16}: {value:12.1f}'
+        if old_value:
+            line += f'  ({(value - old_value) / old_value:+.1%})'
+        print(line)
+
+    print(f'{"requests":>16}: {results["requests"]:12d}')
+    show('throughput rps', results['throughput_rps'],
+         base['throughput_rps'] if base else None)
+    for name, value in results['latency_us'].items():
+        show(f'{name} us', value, base['latency_us'][name] if base else None)
+    print(f'{"hits":>16}: {results["hits"]:12d}')
+    print(f'{"misses":>16}: {results["misses"]:12d}')
+    print(f'{"errors":>16}: {results["errors"]:12d}')
+
+
+def _parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Drives the server with concurrent clients and reports '
+                    'the throughput and the latency percentiles.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument(
+        '--server', choices=(SERVER_EXTERNAL, SERVER_SPAWN),
+        default=SERVER_EXTERNAL,
+        help='use a running server or start one with the current config')
+    parser.add_argument(
+        '--protocol', choices=(PROTOCOL_TEXT, PROTOCOL_BINARY),
+        default=PROTOCOL_TEXT)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=100 * 1000,
+                        help='total number of requests of all clients')
+    parser.add_argument('--pipeline', type=int, default=1,
+                        help='number of requests sent at once by a client')
+    parser.add_argument('--keys', type=int, default=10 * 1000,
+                        help='size of the keyspace')
+    parser.add_argument(
+        '--key-distribution',
+        choices=(KEY_DISTRIBUTION_UNIFORM, KEY_DISTRIBUTION_ZIPF),
+        default=KEY_DISTRIBUTION_ZIPF)
+    parser.add_argument('--zipf-exponent', type=float, default=1.0)
+    parser.add_argument('--value-size', default='100',
+                        help='SIZE or MIN-MAX in bytes, uniformly')
+    parser.add_argument('--read-ratio', type=float, default=0.9,
+                        help='share of gets, the rest are sets')
+    parser.add_argument('--ttl', default='0',
+                        help='TTL:WEIGHT,... mix of the TTLs of the sets')
+    parser.add_argument('--preload', action=argparse.BooleanOptionalAction,
+                        default=True, help='store all keys before the run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='JSON file of a previous run to compare with')
+    return parser.parse_args()
+
+
+# Benchmarks the server under load from concurrent clients,
+# see python3 src/bench_load.py --help for the workload parameters
+def main() -> None:
+    args = _parse_arguments()
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    server = _spawn_server(args) if args.server == SERVER_SPAWN else None
+    try:
+        results = asyncio.run(_run_benchmark(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+
+    parameters = {
+        name: value for name, value in vars(args).items()
+        if name not in ('output', 'compare')
+    }
+    report = {'parameters': parameters, 'results': results}
+    if baseline is not None and baseline['parameters'] != parameters:
+        print('Warning: the baseline was run with other parameters',
+              file=sys.stderr)
+    _print_report(report, baseline)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
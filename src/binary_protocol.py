@@ -0,0 +1,120 @@
+import struct
+from typing import List, NamedTuple, Optional, Union
+
+from compression import StoredValue
+from config import MAX_MESSAGE_SIZE
+from responses import Buffer, Response
+from server_utils import MalformedMessageException
+
+
+# The binary protocol is chosen by the first byte of the connection:
+# text commands never start with the request magic byte
+REQUEST_MAGIC = 0x80
+RESPONSE_MAGIC = 0x81
+
+OPCODE_GET = 0x00
+OPCODE_SET = 0x01
+OPCODE_DELETE = 0x04
+# does nothing, lets the client wait for the responses sent before
+OPCODE_NOOP = 0x0a
+
+# names of the operations in the statistics
+OPCODE_NAMES = {
+    OPCODE_GET: 'binary_get',
+    OPCODE_SET: 'binary_set',
+    OPCODE_DELETE: 'binary_del',
+    OPCODE_NOOP: 'binary_noop',
+}
+
+STATUS_SUCCESS = 0x00
+STATUS_NOT_FOUND = 0x01
+STATUS_INVALID_ARGUMENTS = 0x04
+STATUS_NOT_STORED = 0x05
+# the key belongs to another shard, the value is its "host:port"
+STATUS_MOVED = 0x07
+# the server is a replica, the items are changed only by the primary
+STATUS_READ_ONLY = 0x08
+STATUS_UNKNOWN_COMMAND = 0x81
+
+# magic, opcode, key length, TTL, value length, opaque;
+# the header is followed by the key and the value
+REQUEST_HEADER = struct.Struct('>BBHIII')
+# magic, opcode, status, value length, opaque;
+# the header is followed by the value
+RESPONSE_HEADER = struct.Struct('>BBHII')
+
+
+class BinaryRequest(NamedTuple):
+    opcode: int
+    key: str
+    ttl: int
+    value: bytes
+    # set by the client, returned in the response as is
+    opaque: int
+    # the value compressed for storing, if it's done in advance
+    prepared: Optional[StoredValue] = None
+
+
+class BinaryResponse(Response):
+    def __init__(
+            self, opcode: int, status: int, opaque: int, value: bytes = b''
+    ):
+        self.opcode = opcode
+        self.status = status
+        self.opaque = opaque
+        self.value = value
+
+    def get_buffers(self) -> List[Buffer]:
+        header = RESPONSE_HEADER.pack(
+            RESPONSE_MAGIC, self.opcode, self.status, len(self.value),
+            self.opaque
+        )
+        if not self.value:
+            return [header]
+        return [header, self.value]
+
+
+class BinaryRequestBuffer:
+    """
+    Accumulates raw bytes received in the binary protocol
+    and splits them into complete requests.
+    Requests are framed by their fixed-size headers,
+    the data is never scanned for terminators.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+
+    def feed(self, data: Union[bytes, memoryview]) -> None:
+        self._buffer += data
+
+    # Returns all requests that can be completely parsed
+    # from the received data, the incomplete tail is kept for later
+    def pop_requests(self) -> List[BinaryRequest]:
+        buffer = self._buffer
+        header_size = REQUEST_HEADER.size
+        result: List[BinaryRequest] = []
+        position = 0
+
+        with memoryview(buffer) as view:
+            while len(buffer) - position >= header_size:
+                magic, opcode, key_length, ttl, value_length, opaque =\
+                    REQUEST_HEADER.unpack_from(view, position)
+                if magic != REQUEST_MAGIC or\
+                        key_length + value_length > MAX_MESSAGE_SIZE:
+                    raise MalformedMessageException()
+                key_start = position + header_size
+                value_start = key_start + key_length
+                end = value_start + value_length
+                if len(buffer) < end:
+                    break
+                try:
+                    key = str(view[key_start:value_start], 'utf-8')
+                except ValueError:
+                    raise MalformedMessageException()
+                result.append(BinaryRequest(
+                    opcode, key, ttl, bytes(view[value_start:end]), opaque))
+                position = end
+
+        del buffer[:position]
+        return result
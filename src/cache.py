@@ -1,50 +1,367 @@
+import sys
 import time
-from typing import Optional, Dict, List, Tuple, Set
+from array import array
+from typing import Optional, Dict, FrozenSet, Iterator, List, Sequence,\
+    Tuple
 from collections import OrderedDict
-import heapq
-from dataclasses import dataclass
 
-from config import MAX_NUMBER_OF_ITEMS
+from config import MAX_NUMBER_OF_ITEMS, MAX_MEMORY_BYTES, STORAGE_ENGINE,\
+    EXPIRATION_INDEX, EVICTION_POLICY, STALE_TIME, COMPRESSION, PREFIX_INDEX,\
+    MAX_MESSAGE_SIZE
+from compression import StoredValue, PreparedUpdate, create_compressor
+from disk_tier import DiskTier
+from key_index import PrefixIndex, TagIndex
+from value_store import ItemHandle, create_value_store, MAX_COUNTER
+from expiration_index import create_expiration_index
 
 
 _UNEXPIRING_ITEM_TIMESTAMP = 0
+_NANOSECONDS_IN_SECOND = 1000 * 1000 * 1000
+# expirations are stored as signed 64-bit integers,
+# the ones further in the future are clamped
+MAX_EXPIRATION_TIMESTAMP = (1 << 63) - 1
 
+EVICTION_POLICY_LRU = 'lru'
+EVICTION_POLICY_SLRU = 'slru'
+EVICTION_POLICY_TINY_LFU = 'tinylfu'
 
-@dataclass
-class CachedValue:
-    value: bytes
-    # timestamp in nanoseconds, guaranteed to be unique for each item
-    expiration: int
 
+# Estimated memory held by each item besides its key and the record
+# in the value store: the hash table slot with the OrderedDict link node
+_ITEM_OVERHEAD_BYTES = 100
+# Estimated memory held by each expiring item in addition to the above:
+# the expiration index entry with its timestamp
+_EXPIRATION_OVERHEAD_BYTES = sys.getsizeof((0, '')) +\
+    sys.getsizeof(time.time_ns()) + 100
 
-class Cache:
+# how many expired items are reclaimed between checks of the time limit
+_RECLAIM_BATCH_SIZE = 32
+
+# counters wrap around to 0 past the max value
+_COUNTER_LIMIT = MAX_COUNTER + 1
+_MAX_COUNTER_DIGITS = len(str(MAX_COUNTER))
+
+
+# Returns the expiration timestamp of an item stored now with the TTL
+def get_expiration_timestamp(ttl: int) -> int:
+    if ttl <= 0:
+        return _UNEXPIRING_ITEM_TIMESTAMP
+    return min(time.time_ns() + ttl * _NANOSECONDS_IN_SECOND,
+               MAX_EXPIRATION_TIMESTAMP)
+
+
+class EvictionPolicy:
     """
-    The cache
-    1. Uses LRU eviction strategy.
-    2. Supports TTL for items.
+    Decides which item is evicted when the cache is full.
+    The cache reports every change of its items to the policy.
     """
 
-    def __init__(self) -> None:
-        # Items are stored in a hash table
-        self._cache: Dict[str, CachedValue] = OrderedDict()
-        # In this queue item keys that expire earlier go first
-        self._expiration_queue: List[Tuple[int, str]] = []
-        # Keep a set of all existing timestamps of the expiration queue above
-        self._expiration_times: Set[int] = set()
+    # A new item is stored
+    def on_insert(self, key: str) -> None:
+        raise NotImplementedError
 
-    def set_item(self, key: str, value: bytes, ttl: int = 0) -> bool:
-        self._evict_expired_items()
+    # An existing item is read or replaced
+    def on_access(self, key: str) -> None:
+        raise NotImplementedError
 
-        # Calculate expiration timestamp and store item in the cache
-        expiration = self._get_unique_expiration_ts(ttl) if ttl > 0\
-            else _UNEXPIRING_ITEM_TIMESTAMP
-        cached_value = CachedValue(value, expiration)
-        self._cache[key] = cached_value
+    # An item is deleted, expired or evicted
+    def on_remove(self, key: str) -> None:
+        raise NotImplementedError
 
-        if expiration != _UNEXPIRING_ITEM_TIMESTAMP:
-            # Make the item be tracked by the expiration queue
-            heapq.heappush(self._expiration_queue, (expiration, key))
-            self._expiration_times.add(expiration)
+    # Returns the key of the item to evict, the cache must not be empty
+    def select_victim(self) -> str:
+        raise NotImplementedError
+
+
+class LruPolicy(EvictionPolicy):
+    """
+    Evicts the least recently used item.
+    The order of items is kept by the OrderedDict of the cache itself.
+    """
+
+    def __init__(self, items: 'OrderedDict[str, ItemHandle]'):
+        self._items = items
+
+    def on_insert(self, key: str) -> None:
+        # new keys are added to the end of the OrderedDict
+        pass
+
+    def on_access(self, key: str) -> None:
+        self._items.move_to_end(key)
+
+    def on_remove(self, key: str) -> None:
+        pass
+
+    def select_victim(self) -> str:
+        # with the help of OrderedDict, it's not a problem to
+        # quickly get the least recently used item
+        return next(iter(self._items))
+
+
+class SlruPolicy(EvictionPolicy):
+    """
+    Segmented LRU: new items go to the probation segment, and are
+    promoted to the protected segment when accessed again. Items that
+    are used only once are evicted from probation first, so they don't
+    flush the frequently used ones.
+    """
+
+    # share of the capacity reserved for the protected segment
+    _PROTECTED_SHARE = 0.8
+
+    def __init__(self, capacity: int):
+        self._protected_capacity =\
+            max(1, int(capacity * self._PROTECTED_SHARE))
+        self._probation: 'OrderedDict[str, None]' = OrderedDict()
+        self._protected: 'OrderedDict[str, None]' = OrderedDict()
+
+    def on_insert(self, key: str) -> None:
+        self._probation[key] = None
+
+    def on_access(self, key: str) -> None:
+        if key in self._protected:
+            self._protected.move_to_end(key)
+            return
+        del self._probation[key]
+        self._protected[key] = None
+        if len(self._protected) > self._protected_capacity:
+            # demote the least recently used protected item
+            demoted, _ = self._protected.popitem(last=False)
+            self._probation[demoted] = None
+
+    def on_remove(self, key: str) -> None:
+        if key in self._probation:
+            del self._probation[key]
+        else:
+            del self._protected[key]
+
+    def select_victim(self) -> str:
+        if self._probation:
+            return next(iter(self._probation))
+        return next(iter(self._protected))
+
+    def __len__(self) -> int:
+        return len(self._probation) + len(self._protected)
+
+    def get_probation_victim(self) -> Optional[str]:
+        return next(iter(self._probation), None)
+
+
+# translation table halving every byte value
+_HALVED_COUNTS = bytes(count >> 1 for count in range(256))
+
+
+class _FrequencySketch:
+    """
+    Count-min sketch estimating how often keys were seen recently.
+    Counters are capped at 15 and halved periodically,
+    so the estimates follow changes in popularity.
+    """
+
+    _DEPTH = 4
+    _MAX_COUNT = 15
+    _SEEDS = (
+        0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F,
+        0x165667B19E3779F9, 0x27D4EB2F165667C5,
+    )
+    # the counters are halved after this many increments per cache slot
+    _SAMPLE_FACTOR = 10
+
+    def __init__(self, capacity: int):
+        self._width_bits = max(4, (capacity - 1).bit_length())
+        width = 1 << self._width_bits
+        self._rows = [array('B', bytes(width)) for _ in range(self._DEPTH)]
+        self._sample_size = self._SAMPLE_FACTOR * max(capacity, 1)
+        self._additions = 0
+
+    def increment(self, key: str) -> None:
+        added = False
+        for row, index in zip(self._rows, self._indexes(key)):
+            if row[index] < self._MAX_COUNT:
+                row[index] += 1
+                added = True
+        if added:
+            self._additions += 1
+            if self._additions >= self._sample_size:
+                self._reset()
+
+    def estimate(self, key: str) -> int:
+        return min(
+            row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+    def _indexes(self, key: str) -> List[int]:
+        key_hash = hash(key)
+        shift = 64 - self._width_bits
+        return [
+            ((key_hash * seed) & 0xFFFFFFFFFFFFFFFF) >> shift
+            for seed in self._SEEDS
+        ]
+
+    def _reset(self) -> None:
+        self._rows = [
+            array('B', row.tobytes().translate(_HALVED_COUNTS))
+            for row in self._rows
+        ]
+        self._additions //= 2
+
+
+class TinyLfuPolicy(EvictionPolicy):
+    """
+    W-TinyLFU: new items enter a small LRU window. Items leaving the
+    window compete with the eviction candidate of the main SLRU segment,
+    the one that was seen less often according to the frequency sketch
+    is evicted. This keeps one-hit wonders from flushing the hot items,
+    while the window still admits bursts of new popular items.
+    """
+
+    # share of the capacity taken by the window
+    _WINDOW_SHARE = 0.01
+
+    def __init__(self, capacity: int):
+        self._window_capacity = max(1, int(capacity * self._WINDOW_SHARE))
+        self._window: 'OrderedDict[str, None]' = OrderedDict()
+        self._main = SlruPolicy(max(1, capacity - self._window_capacity))
+        self._sketch = _FrequencySketch(capacity)
+        # the item that has just left the window for the main segment
+        self._candidate: Optional[str] = None
+
+    def on_insert(self, key: str) -> None:
+        self._sketch.increment(key)
+        self._window[key] = None
+        if len(self._window) > self._window_capacity:
+            candidate, _ = self._window.popitem(last=False)
+            self._main.on_insert(candidate)
+            self._candidate = candidate
+
+    def on_access(self, key: str) -> None:
+        self._sketch.increment(key)
+        if key in self._window:
+            self._window.move_to_end(key)
+        else:
+            self._main.on_access(key)
+
+    def on_remove(self, key: str) -> None:
+        if key in self._window:
+            del self._window[key]
+        else:
+            self._main.on_remove(key)
+        if key == self._candidate:
+            self._candidate = None
+
+    def select_victim(self) -> str:
+        candidate = self._candidate
+        self._candidate = None
+        victim = self._main.get_probation_victim()
+        if candidate is not None and victim is not None and\
+                victim != candidate:
+            # admit the candidate only if it's more popular
+            if self._sketch.estimate(candidate) >\
+                    self._sketch.estimate(victim):
+                return victim
+            return candidate
+        if len(self._main) > 0:
+            return self._main.select_victim()
+        return next(iter(self._window))
+
+
+# Parses the value of an item which is used as a counter
+def _parse_counter(value: bytes) -> int:
+    if not value.isdigit() or len(value) > _MAX_COUNTER_DIGITS:
+        raise ValueError('Value is not a counter')
+    counter = int(value)
+    if counter > MAX_COUNTER:
+        raise ValueError('Value is not a counter')
+    return counter
+
+
+def _create_eviction_policy(
+        name: str,
+        items: 'OrderedDict[str, ItemHandle]',
+        capacity: int) -> EvictionPolicy:
+    if name == EVICTION_POLICY_LRU:
+        return LruPolicy(items)
+    if name == EVICTION_POLICY_SLRU:
+        return SlruPolicy(capacity)
+    if name == EVICTION_POLICY_TINY_LFU:
+        return TinyLfuPolicy(capacity)
+    raise ValueError(f'Unknown eviction policy: {name}')
+
+
+class Cache:
+    """
+    The cache
+    1. Uses LRU eviction strategy by default, SLRU and W-TinyLFU
+       can be chosen instead.
+    2. Supports TTL for items. Expired items are never returned,
+       their memory is reclaimed by the "reclaim_expired_items" calls.
+       They may be kept for "stale_time" seconds after the expiration
+       to be served as stale ones while they are regenerated.
+    3. Limits both the number of items and their estimated memory usage.
+    4. Compresses large values with the given algorithm, if any.
+    5. Demotes the evicted items to the disk tier, if it's given,
+       and promotes them back once they are requested.
+    6. Finds the keys by the tags attached to the items and by their
+       prefixes. The items on the disk tier stay in the indexes,
+       so the prefix index is always enabled along with the tier.
+    7. Updates the items in place: counters, appends and
+       compare-and-set by the version which every change of an item
+       renews. Counters are stored as integers.
+    """
+
+    def __init__(
+            self,
+            max_number_of_items: int = MAX_NUMBER_OF_ITEMS,
+            eviction_policy: str = EVICTION_POLICY,
+            stale_time: int = STALE_TIME,
+            compression: Optional[str] = COMPRESSION,
+            disk_tier: Optional[DiskTier] = None,
+            prefix_index: bool = PREFIX_INDEX
+    ) -> None:
+        self._max_number_of_items = max_number_of_items
+        self._stale_time = stale_time * _NANOSECONDS_IN_SECOND
+        # Items are stored in a hash table,
+        # values are kept by the configured storage engine
+        self._cache: 'OrderedDict[str, ItemHandle]' = OrderedDict()
+        self._store = create_value_store(STORAGE_ENGINE)
+        self._compressor = create_compressor(compression)
+        self._disk_tier = disk_tier
+        # the keys on the disk tier can't be scanned,
+        # so they are always indexed along with it
+        self._prefix_index = PrefixIndex()\
+            if prefix_index or disk_tier is not None else None
+        if disk_tier is not None:
+            disk_tier.set_drop_callback(self._remove_from_indexes)
+        self._tag_index = TagIndex()
+        self._policy = _create_eviction_policy(
+            eviction_policy, self._cache, max_number_of_items)
+        # Keys of the items with TTL by their expiration
+        self._expiration_index = create_expiration_index(EXPIRATION_INDEX)
+        # Estimated memory used by all items, in bytes
+        self._memory_usage = 0
+        # Counters since the start
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._compressed_items = 0
+        self._promotions = 0
+        # version of the last stored item
+        self._version = 0
+
+    # The value may be prepared for storing beforehand with
+    # "prepare_value", otherwise it's prepared right away.
+    # The tags replace the ones of the previous item with the key,
+    # unless they are None.
+    def set_item(
+            self,
+            key: str,
+            value: bytes,
+            ttl: int = 0,
+            prepared: Optional[StoredValue] = None,
+            tags: Optional[Sequence[str]] = ()
+    ) -> bool:
+        self._store_item(
+            key, value, get_expiration_timestamp(ttl), prepared, tags)
 
         # Ensure the number of items is within the specified limit
         self._evict_extra_items()
@@ -52,57 +369,471 @@ class Cache:
         return key in self._cache
 
     def get_item(self, key: str) -> Optional[bytes]:
-        self._evict_expired_items()
+        return self._load_item(key, time.time_ns())
+
+    # Returns the value of the item along with its version
+    def get_versioned_item(self, key: str) -> Optional[Tuple[bytes, int]]:
+        handle = self._find_item(key, time.time_ns())
+        if handle is None:
+            return None
+        return self._get_value(handle), self._store.get_version(handle)
+
+    # Returns None if the item is not found
+    def get_version(self, key: str) -> Optional[int]:
+        handle = self._find_item(key, time.time_ns())
+        if handle is None:
+            return None
+        return self._store.get_version(handle)
+
+    # Returns the expiration timestamp of the item in the memory,
+    # None if there is no such item. Lookups and expiration are not
+    # taken into account, so it's meant for the item just updated.
+    def get_expiration(self, key: str) -> Optional[int]:
+        handle = self._cache.get(key)
+        if handle is None:
+            return None
+        return self._store.get_expiration(handle)
+
+    # Adds the delta to the counter, which wraps around on overflow
+    # and stays at 0 on underflow. A value set by other means is
+    # converted to a counter if it's a decimal number, ValueError is
+    # raised otherwise. A missing item is created with the initial value
+    # and the TTL, if the value is given, otherwise None is returned.
+    def increment_item(
+            self,
+            key: str,
+            delta: int,
+            initial: Optional[int] = None,
+            ttl: int = 0
+    ) -> Optional[int]:
+        handle = self._find_item(key, time.time_ns())
+        if handle is None:
+            if initial is None:
+                return None
+            self._store_counter(
+                key, initial, get_expiration_timestamp(ttl), tags=())
+            self._evict_extra_items()
+            return initial if key in self._cache else None
+
+        counter = self._store.get_counter(handle)
+        if counter is None:
+            counter = _parse_counter(self._get_value(handle))
+            counter = max(counter + delta, 0) % _COUNTER_LIMIT
+            self._store_counter(
+                key, counter, self._store.get_expiration(handle), tags=None)
+            self._evict_extra_items()
+            return counter
+
+        counter = max(counter + delta, 0) % _COUNTER_LIMIT
+        self._version += 1
+        self._memory_usage -= self._estimate_item_size(key, handle)
+        handle = self._store.set_counter(handle, counter, self._version)
+        self._cache[key] = handle
+        self._memory_usage += self._estimate_item_size(key, handle)
+        return counter
+
+    # Adds the value to the end of the item or, if "prepend" is set,
+    # to its beginning, keeping the expiration and the tags.
+    # The result may be prepared for storing beforehand, it's used
+    # if the item hasn't changed since then.
+    # Returns the new value, None if the item is not found.
+    # ValueError is raised if the value grows above the max message size.
+    def append_item(
+            self,
+            key: str,
+            value: bytes,
+            prepend: bool = False,
+            prepared: Optional[PreparedUpdate] = None
+    ) -> Optional[bytes]:
+        handle = self._find_item(key, time.time_ns())
+        if handle is None:
+            return None
+        stored: Optional[StoredValue] = None
+        if prepared is not None and\
+                prepared.version == self._store.get_version(handle):
+            value, stored = prepared.value, prepared.stored
+        else:
+            current = self._get_value(handle)
+            value = value + current if prepend else current + value
+        if len(value) > MAX_MESSAGE_SIZE:
+            raise ValueError(f'Value size must be <= {MAX_MESSAGE_SIZE}')
+        self._store_item(
+            key, value, self._store.get_expiration(handle), stored, tags=None)
+        self._evict_extra_items()
+        return value
+
+    # Returns the item in the form it's stored along with its version,
+    # None if the item isn't in the memory. The lookup isn't counted
+    # and doesn't change the recency of the item.
+    def get_stored_version(
+            self, key: str) -> Optional[Tuple[StoredValue, int]]:
+        handle = self._cache.get(key)
+        if handle is None or self._is_expired(handle, time.time_ns()):
+            return None
+        store = self._store
+        return StoredValue(store.get_value(handle),
+                           store.is_compressed(handle)),\
+            store.get_version(handle)
+
+    # Makes the value "append_item" stores from the item returned by
+    # "get_stored_version", so it may be called from any thread in advance
+    def prepare_update(
+            self,
+            stored: StoredValue,
+            version: int,
+            value: bytes,
+            prepend: bool = False
+    ) -> PreparedUpdate:
+        current = stored.data
+        if stored.compressed and self._compressor is not None:
+            current = self._compressor.decompress(current)
+        value = value + current if prepend else current + value
+        return PreparedUpdate(version, value, self.prepare_value(value))
 
-        cached_value = self._cache.get(key)
-        if cached_value is not None:
-            # Mark this item as recently accessed (for LRU strategy)
-            self._cache.move_to_end(key)
-        return cached_value.value if cached_value is not None else None
+    # Returns the value in the form it's stored, possibly compressed
+    def get_stored_item(self, key: str) -> Optional[StoredValue]:
+        handle = self._find_item(key, time.time_ns())
+        if handle is None:
+            return None
+        return StoredValue(
+            self._store.get_value(handle), self._store.is_compressed(handle))
+
+    # Whether storing a value of the size involves its compression
+    def is_compressible(self, size: int) -> bool:
+        return self._compressor is not None and\
+            size >= self._compressor.threshold
+
+    def get_compression(self) -> Optional[str]:
+        return self._compressor.algorithm\
+            if self._compressor is not None else None
+
+    # Compresses the value if needed, it's the heaviest part of storing
+    # large values, so it may be called from any thread in advance
+    def prepare_value(self, value: bytes) -> StoredValue:
+        if self._compressor is None:
+            return StoredValue(value, False)
+        return self._compressor.compress(value)
+
+    def prepare_values(self, values: List[bytes]) -> List[StoredValue]:
+        return [self.prepare_value(value) for value in values]
+
+    # Returns the value of the item which has expired less than
+    # "stale_time" seconds ago, None for the missing and unexpired items
+    def get_stale_item(self, key: str) -> Optional[bytes]:
+        handle = self._cache.get(key)
+        if handle is None:
+            return None
+        now = time.time_ns()
+        if not self._is_expired(handle, now) or\
+                not self._is_stale(handle, now):
+            return None
+        return self._get_value(handle)
 
     def delete_item(self, key: str) -> bool:
-        if key in self._cache:
-            del self._cache[key]
-            return True
-        return False
+        handle = self._cache.get(key)
+        if handle is None:
+            if self._disk_tier is None:
+                return False
+            self._remove_from_indexes(key)
+            item = self._disk_tier.take(key)
+            return item is not None and\
+                not self._is_timestamp_expired(item.expiration, time.time_ns())
+        # expired items are not reported as deleted
+        expired = self._is_expired(handle, time.time_ns())
+        self._remove_item(key, handle)
+        if expired:
+            self._expirations += 1
+        return not expired
 
-    def _evict_extra_items(self) -> None:
-        # Evict items if allowed limit for the number of items is exceeded.
-        while len(self._cache) > MAX_NUMBER_OF_ITEMS:
-            # with the help of OrderedDict, it's not a problem to
-            # quickly get the least recently used item
-            oldest = next(iter(self._cache))
-            self.delete_item(oldest)
-
-    # this method ensures there are no expired items in the cache
-    def _evict_expired_items(self) -> None:
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'items': len(self._cache),
+            'max_items': self._max_number_of_items,
+            'memory_bytes': self._memory_usage,
+            'max_memory_bytes': MAX_MEMORY_BYTES,
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'expirations': self._expirations,
+            'compressed_items': self._compressed_items,
+            'disk_items':
+                len(self._disk_tier) if self._disk_tier is not None else 0,
+            'disk_hits': self._promotions,
+        }
+
+    # Batch counterparts of the methods above
+
+    # Each item is a (key, value, ttl) tuple,
+    # the values may be prepared with "prepare_values"
+    def set_items(
+            self,
+            items: List[Tuple[str, bytes, int]],
+            prepared: Optional[List[StoredValue]] = None
+    ) -> List[bool]:
+        for index, (key, value, ttl) in enumerate(items):
+            self._store_item(
+                key, value, get_expiration_timestamp(ttl),
+                prepared[index] if prepared is not None else None)
+        self._evict_extra_items()
+        return [key in self._cache for key, _, _ in items]
+
+    def get_items(self, keys: List[str]) -> List[Optional[bytes]]:
+        now = time.time_ns()
+        return [self._load_item(key, now) for key in keys]
+
+    # Returns the number of deleted items
+    def delete_items(self, keys: List[str]) -> int:
+        return sum(1 for key in keys if self.delete_item(key))
+
+    # Returns the keys starting with the prefix, including the ones
+    # of the expired items which are not reclaimed yet. Without
+    # the index all keys are scanned, there is no disk tier then.
+    def find_keys_by_prefix(self, prefix: str) -> List[str]:
+        if self._prefix_index is not None:
+            return self._prefix_index.find(prefix)
+        return [key for key in self._cache if key.startswith(prefix)]
+
+    def find_keys_by_tag(self, tag: str) -> List[str]:
+        return self._tag_index.find(tag)
+
+    def get_tags(self, key: str) -> FrozenSet[str]:
+        return self._tag_index.get_tags(key)
+
+    # Reclaims expired items in the order of their expiration.
+    # Stops after "max_duration" nanoseconds, so that a large number of
+    # items expiring at once doesn't delay the requests.
+    # Returns whether there are more expired items left.
+    def reclaim_expired_items(self, max_duration: int) -> bool:
+        # stale items are kept until they are too old to be served
+        now = time.time_ns() - self._stale_time
+        deadline = time.monotonic_ns() + max_duration
+        while True:
+            keys = self._expiration_index.pop_expired(now, _RECLAIM_BATCH_SIZE)
+            for key in keys:
+                self._remove_item(key, self._cache[key])
+            self._expirations += len(keys)
+            if len(keys) < _RECLAIM_BATCH_SIZE:
+                return False
+            if time.monotonic_ns() > deadline:
+                return True
+
+    # Items are persisted and restored along with their expiration
+    # timestamp, so that they expire at the same time after the restart,
+    # and their tags
+
+    # Yields (key, value, expiration, tags) of the unexpired items
+    # in the order of the hash table, which is the order of recency
+    # for the LRU policy: the least recently used item goes first
+    def iter_items(self) -> Iterator[Tuple[str, bytes, int, FrozenSet[str]]]:
         now = time.time_ns()
-        queue = self._expiration_queue
-        while len(queue) > 0:
-            expiration, key = queue[0]
-            if expiration > now:
-                # all remaning items in the queue are not expiring
-                break
-
-            should_delete = True
-            cached_value = self._cache.get(key)
-            if cached_value is None:
-                # this item has been already deleted - that's okay, skipping
-                should_delete = False
-            elif cached_value.expiration != expiration:
-                # this item has been replaced with a different one, skipping
-                should_delete = False
-            if should_delete:
-                self.delete_item(key)
-            # remove this item from the expiration queue
-            heapq.heappop(queue)
-            self._expiration_times.remove(expiration)
-
-    # Returns unique expiration timestamp in nanoseconds
-    # Based on the provided "ttl" in seconds
-    def _get_unique_expiration_ts(self, ttl: int) -> int:
-        expiration = int(time.time_ns() + ttl * 1e9)
-        while expiration in self._expiration_times:
-            # with nanosecond precision, collisions are unlikely, yet possible
-            expiration += 1
-        return expiration
+        store = self._store
+        tag_index = self._tag_index
+        for key, handle in self._cache.items():
+            if not self._is_expired(handle, now):
+                yield key, self._get_value(handle),\
+                    store.get_expiration(handle), tag_index.get_tags(key)
+
+    # Stores the item as the most recently used one, the value may be
+    # prepared with "prepare_value". Returns False if it is expired
+    # already or doesn't fit in the cache.
+    def restore_item(
+            self,
+            key: str,
+            value: bytes,
+            expiration: int,
+            tags: Sequence[str] = (),
+            prepared: Optional[StoredValue] = None
+    ) -> bool:
+        if expiration != _UNEXPIRING_ITEM_TIMESTAMP and\
+                expiration <= time.time_ns():
+            return False
+        self._store_item(key, value, expiration, prepared, tags)
+        self._evict_extra_items()
+        return key in self._cache
+
+    # The tags of the item are kept as they are if they are None
+    def _store_item(
+            self,
+            key: str,
+            value: bytes,
+            expiration: int,
+            prepared: Optional[StoredValue] = None,
+            tags: Optional[Sequence[str]] = ()
+    ) -> None:
+        if prepared is None and self._compressor is not None:
+            prepared = self._compressor.compress(value)
+        replaced = self._cache.get(key)
+        if replaced is not None:
+            self._release_item(key, replaced)
+        self._version += 1
+        if prepared is None:
+            handle = self._store.put(value, expiration, version=self._version)
+        else:
+            handle = self._store.put(
+                prepared.data, expiration, prepared.compressed, self._version)
+            if prepared.compressed:
+                self._compressed_items += 1
+        self._add_item(key, handle, expiration, replaced, tags)
+
+    def _store_counter(
+            self,
+            key: str,
+            counter: int,
+            expiration: int,
+            tags: Optional[Sequence[str]]
+    ) -> None:
+        replaced = self._cache.get(key)
+        if replaced is not None:
+            self._release_item(key, replaced)
+        self._version += 1
+        handle = self._store.put_counter(counter, expiration, self._version)
+        self._add_item(key, handle, expiration, replaced, tags)
+
+    # Registers the stored item in the hash table and the indexes,
+    # "replaced" is the released previous item with the key
+    def _add_item(
+            self,
+            key: str,
+            handle: ItemHandle,
+            expiration: int,
+            replaced: Optional[ItemHandle],
+            tags: Optional[Sequence[str]]
+    ) -> None:
+        self._cache[key] = handle
+        self._memory_usage += self._estimate_item_size(key, handle)
+        if self._prefix_index is not None:
+            self._prefix_index.add(key)
+        if tags is not None:
+            self._tag_index.set_tags(key, tags)
+
+        if expiration != _UNEXPIRING_ITEM_TIMESTAMP:
+            # Make the item be tracked by the expiration index
+            self._expiration_index.add(key, expiration)
+
+        # replacing an item counts as its access
+        if replaced is None:
+            if self._disk_tier is not None:
+                # the demoted copy is outdated now
+                self._disk_tier.remove(key)
+            self._policy.on_insert(key)
+        else:
+            self._policy.on_access(key)
+
+    def _load_item(self, key: str, now: int) -> Optional[bytes]:
+        handle = self._find_item(key, now)
+        if handle is None:
+            return None
+        return self._get_value(handle)
+
+    # Looks the item up counting the hit or the miss
+    def _find_item(self, key: str, now: int) -> Optional[ItemHandle]:
+        handle = self._cache.get(key)
+        if handle is None:
+            if self._disk_tier is not None:
+                handle = self._promote_item(key, now)
+                if handle is not None:
+                    self._hits += 1
+                    self._promotions += 1
+                    return handle
+            self._misses += 1
+            return None
+        if self._is_expired(handle, now):
+            # the item is expired, but not reclaimed yet
+            if not self._is_stale(handle, now):
+                self._remove_item(key, handle)
+                self._expirations += 1
+            self._misses += 1
+            return None
+        self._hits += 1
+        # Mark this item as recently accessed (for eviction policy)
+        self._policy.on_access(key)
+        return handle
+
+    # Moves the item from the disk tier back to the memory,
+    # which may demote another item in its place
+    def _promote_item(self, key: str, now: int) -> Optional[ItemHandle]:
+        assert self._disk_tier is not None
+        item = self._disk_tier.take(key)
+        if item is None or self._is_timestamp_expired(item.expiration, now):
+            # the item has expired on the disk
+            self._remove_from_indexes(key)
+            return None
+        self._store_item(
+            key, item.value.data, item.expiration, item.value, tags=None)
+        self._evict_extra_items()
+        return self._cache.get(key)
+
+    # Returns whether the item is stored on the disk
+    def _demote_item(self, key: str, handle: ItemHandle) -> bool:
+        assert self._disk_tier is not None
+        store = self._store
+        if self._is_expired(handle, time.time_ns()):
+            return False
+        return self._disk_tier.put(
+            key,
+            StoredValue(store.get_value(handle), store.is_compressed(handle)),
+            store.get_expiration(handle)
+        )
+
+    def _get_value(self, handle: ItemHandle) -> bytes:
+        value = self._store.get_value(handle)
+        if self._compressor is not None and self._store.is_compressed(handle):
+            return self._compressor.decompress(value)
+        return value
+
+    # The demoted items stay in the indexes,
+    # so that they are found on the disk
+    def _remove_item(
+            self, key: str, handle: ItemHandle, demoted: bool = False
+    ) -> None:
+        del self._cache[key]
+        self._release_item(key, handle)
+        self._policy.on_remove(key)
+        if not demoted:
+            self._remove_from_indexes(key)
+
+    def _remove_from_indexes(self, key: str) -> None:
+        if self._prefix_index is not None:
+            self._prefix_index.remove(key)
+        self._tag_index.remove(key)
+
+    # Releases all resources held by the item except for its hash table slot
+    def _release_item(self, key: str, handle: ItemHandle) -> None:
+        self._memory_usage -= self._estimate_item_size(key, handle)
+        if self._store.get_expiration(handle) != _UNEXPIRING_ITEM_TIMESTAMP:
+            self._expiration_index.remove(key)
+        if self._compressor is not None and self._store.is_compressed(handle):
+            self._compressed_items -= 1
+        self._store.free(handle)
+
+    def _is_expired(self, handle: ItemHandle, now: int) -> bool:
+        expiration = self._store.get_expiration(handle)
+        return expiration != _UNEXPIRING_ITEM_TIMESTAMP and expiration <= now
+
+    @staticmethod
+    def _is_timestamp_expired(expiration: int, now: int) -> bool:
+        return expiration != _UNEXPIRING_ITEM_TIMESTAMP and expiration <= now
+
+    # Whether the expired item may still be served as a stale one
+    def _is_stale(self, handle: ItemHandle, now: int) -> bool:
+        return self._store.get_expiration(handle) + self._stale_time > now
+
+    def _estimate_item_size(self, key: str, handle: ItemHandle) -> int:
+        size = sys.getsizeof(key) + self._store.get_footprint(handle) +\
+            _ITEM_OVERHEAD_BYTES
+        if self._store.get_expiration(handle) != _UNEXPIRING_ITEM_TIMESTAMP:
+            size += _EXPIRATION_OVERHEAD_BYTES
+        return size
+
+    def _evict_extra_items(self) -> None:
+        # Evict items if allowed limit for the number of items
+        # or for the memory usage is exceeded.
+        while len(self._cache) > self._max_number_of_items or (
+                self._memory_usage > MAX_MEMORY_BYTES and
+                len(self._cache) > 0):
+            victim = self._policy.select_victim()
+            handle = self._cache[victim]
+            demoted = self._disk_tier is not None and\
+                self._demote_item(victim, handle)
+            self._remove_item(victim, handle, demoted)
+            self._evictions += 1
@@ -0,0 +1,676 @@
+import asyncio
+from collections import deque
+from itertools import groupby
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List,\
+    Optional, Sequence, Tuple, TypeVar
+
+from commands import CommandId, TAG_SEPARATOR
+from config import MAX_MESSAGE_SIZE
+from protocol import SEPARATOR_BINARY
+from sharding import HashRing
+
+
+# max number of connections to each server
+POOL_SIZE = 4
+
+_SUCCESS = 'SUCCESS'
+_NOT_FOUND = 'NOT_FOUND'
+_FAILURE = 'COMMAND_FAILED'
+_MOVED = 'MOVED'
+_VALUES = 'VALUES'
+_DELETED = 'DELETED'
+_SHARD = 'SHARD'
+_STAT = 'STAT'
+_END = 'END'
+_COUNTER = 'COUNTER'
+_VERSION = 'VERSION'
+_EXISTS = 'EXISTS'
+_MISSING_VALUE_SIZE = -1
+# upper estimate of the header bytes each item adds to a batch command,
+# besides its key and value: the separators, TTL and size
+_BATCH_ITEM_OVERHEAD = 32
+
+_Result = TypeVar('_Result')
+_Entry = TypeVar('_Entry')
+Address = Tuple[str, int]
+# Reads the rest of the response, given its first line
+_ResponseReader = Callable[[asyncio.StreamReader, str], Awaitable[Any]]
+
+
+class CacheError(Exception):
+    """
+    Error response of the server
+    """
+
+
+class MovedError(CacheError):
+    """
+    The key belongs to another shard, which is at the given address
+    """
+
+    def __init__(self, message: str, address: Address):
+        super().__init__(message)
+        self.address = address
+
+
+class _Connection:
+    """
+    Connection in the pipelined mode. Requests are sent without waiting
+    for the responses of the previous ones: the requests made during
+    one iteration of the event loop are written at once, and each
+    response is matched to its request by the order.
+    """
+
+    def __init__(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter
+    ) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._outgoing: List[bytes] = []
+        # readers of the responses to the sent requests with their waiters
+        self._pending: Deque[Tuple[_ResponseReader, asyncio.Future]] =\
+            deque()
+        self.closed = False
+        self._receiving = asyncio.ensure_future(self._receive())
+
+    def get_pending_count(self) -> int:
+        return len(self._pending)
+
+    async def request(
+            self, buffers: List[bytes], read_response: _ResponseReader
+    ) -> Any:
+        # waits while the server doesn't keep up with the requests
+        await self._writer.drain()
+        if self.closed:
+            raise ConnectionError('Connection is closed')
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending.append((read_response, waiter))
+        if not self._outgoing:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._outgoing.extend(buffers)
+        return await waiter
+
+    async def close(self) -> None:
+        self._receiving.cancel()
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except OSError:
+            pass
+
+    def _flush(self) -> None:
+        if not self.closed:
+            self._writer.writelines(self._outgoing)
+        self._outgoing = []
+
+    # The responses are read even if their requests have been cancelled,
+    # otherwise the following ones would be mismatched
+    async def _receive(self) -> None:
+        error: Exception = ConnectionError('Connection is closed')
+        try:
+            while True:
+                line = await self._reader.readuntil(SEPARATOR_BINARY)
+                if not self._pending:
+                    raise ConnectionError(f'Unexpected response: {line!r}')
+                read_response, waiter = self._pending.popleft()
+                try:
+                    result = await read_response(
+                        self._reader, line[:-len(SEPARATOR_BINARY)].decode())
+                except CacheError as e:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                    continue
+                if not waiter.done():
+                    waiter.set_result(result)
+        except asyncio.IncompleteReadError:
+            pass
+        except (OSError, ValueError, asyncio.LimitOverrunError) as e:
+            error = e
+        finally:
+            self.closed = True
+            self._writer.close()
+            for _, waiter in self._pending:
+                if not waiter.done():
+                    waiter.set_exception(error)
+            self._pending.clear()
+
+
+async def _open_connection(host: str, port: int) -> _Connection:
+    reader, writer = await asyncio.open_connection(
+        host, port, limit=MAX_MESSAGE_SIZE + len(SEPARATOR_BINARY))
+    writer.write(CommandId.PIPELINE.value.encode() + SEPARATOR_BINARY)
+    response = await reader.readuntil(SEPARATOR_BINARY)
+    if response != _SUCCESS.encode() + SEPARATOR_BINARY:
+        writer.close()
+        raise CacheError(response.decode().strip())
+    return _Connection(reader, writer)
+
+
+class ConnectionPool:
+    """
+    Up to "size" connections to a single server. A request goes to
+    a connection without pending requests, or to a new one while
+    there is room for it, or else it's pipelined on the least busy one.
+    """
+
+    def __init__(self, host: str, port: int, size: int = POOL_SIZE):
+        self.host = host
+        self.port = port
+        self._size = size
+        # the connections being opened are included, so that
+        # simultaneous requests don't open more than "size" of them
+        self._connections: List['asyncio.Task[_Connection]'] = []
+
+    async def request(
+            self, buffers: List[bytes], read_response: _ResponseReader
+    ) -> Any:
+        connection = await self._get_connection()
+        return await connection.request(buffers, read_response)
+
+    async def close(self) -> None:
+        connections, self._connections = self._connections, []
+        for task in connections:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None:
+                await task.result().close()
+
+    async def _get_connection(self) -> _Connection:
+        self._connections = [
+            task for task in self._connections
+            if not task.done() or _is_open(task)
+        ]
+        opened = [task.result() for task in self._connections if task.done()]
+        least_busy = min(
+            opened, key=_Connection.get_pending_count, default=None)
+        if least_busy is not None and (
+                least_busy.get_pending_count() == 0 or
+                len(self._connections) >= self._size):
+            return least_busy
+
+        if len(self._connections) < self._size:
+            task = asyncio.ensure_future(
+                _open_connection(self.host, self.port))
+            self._connections.append(task)
+        else:
+            # all connections are being opened
+            task = self._connections[0]
+        # the connection is kept even if the request is cancelled
+        return await asyncio.shield(task)
+
+
+def _is_open(task: 'asyncio.Task[_Connection]') -> bool:
+    return not task.cancelled() and task.exception() is None and\
+        not task.result().closed
+
+
+class Client:
+    """
+    Asyncio client of the cache, possibly sharded over several servers.
+    Keys are routed to the servers by consistent hashing, the same way
+    the servers distribute them (see "sharding.py"). When a server
+    reports that a key has moved, the shards are fetched again
+    and the request is retried once.
+    Each server gets its own pool of pipelined connections,
+    batch operations send one multi-key command per server.
+    """
+
+    def __init__(
+            self, addresses: List[Address], pool_size: int = POOL_SIZE):
+        self._pool_size = pool_size
+        self._pools: Dict[Address, ConnectionPool] = {}
+        self._ring = HashRing([])
+        self._addresses: List[Address] = []
+        self._set_addresses(addresses)
+        self._refreshing: Optional['asyncio.Task[None]'] = None
+
+    # Creates a client of all shards of the server at the given address
+    @classmethod
+    async def discover(
+            cls, host: str, port: int, pool_size: int = POOL_SIZE
+    ) -> 'Client':
+        client = cls([(host, port)], pool_size)
+        await client.refresh_shards()
+        return client
+
+    async def __aenter__(self) -> 'Client':
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
+
+    def get_addresses(self) -> List[Address]:
+        return list(self._addresses)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        _validate_key(key)
+        return await self._run_routed(
+            key, [_build_line(CommandId.GET, key)], _read_value)
+
+    # The tags allow to delete the item with the others sharing them
+    async def set(
+            self,
+            key: str,
+            value: bytes,
+            ttl: int = 0,
+            tags: Sequence[str] = ()
+    ) -> None:
+        _validate_item(key, value, ttl)
+        args = [key, str(ttl), str(len(value))]
+        if tags:
+            for tag in tags:
+                _validate_tag(tag)
+            args.append(TAG_SEPARATOR.join(tags))
+        await self._run_routed(key, [
+            _build_line(CommandId.SET, *args),
+            value,
+            SEPARATOR_BINARY,
+        ], _read_status)
+
+    # Returns False if the item is not found
+    async def delete(self, key: str) -> bool:
+        _validate_key(key)
+        return await self._run_routed(
+            key, [_build_line(CommandId.DELETE, key)], _read_deleted)
+
+    # Adds the delta to the counter and returns its new value.
+    # A missing item is created with the initial value and the TTL,
+    # if the value is given, otherwise None is returned.
+    async def increment(
+            self,
+            key: str,
+            delta: int = 1,
+            initial: Optional[int] = None,
+            ttl: int = 0
+    ) -> Optional[int]:
+        return await self._update_counter(
+            CommandId.INCREMENT, key, delta, initial, ttl)
+
+    # The counter stays at 0 instead of going below it
+    async def decrement(
+            self,
+            key: str,
+            delta: int = 1,
+            initial: Optional[int] = None,
+            ttl: int = 0
+    ) -> Optional[int]:
+        return await self._update_counter(
+            CommandId.DECREMENT, key, delta, initial, ttl)
+
+    # Returns False if the item is not found
+    async def append(self, key: str, value: bytes) -> bool:
+        return await self._append(CommandId.APPEND, key, value)
+
+    async def prepend(self, key: str, value: bytes) -> bool:
+        return await self._append(CommandId.PREPEND, key, value)
+
+    # Returns the value along with its version for "compare_and_set"
+    async def get_versioned(self, key: str) -> Optional[Tuple[bytes, int]]:
+        _validate_key(key)
+        return await self._run_routed(
+            key, [_build_line(CommandId.VERSIONED_GET, key)],
+            _read_versioned_value)
+
+    # Replaces the item unless it has changed since its version was read,
+    # returns False if it has changed or is not found
+    async def compare_and_set(
+            self, key: str, value: bytes, version: int, ttl: int = 0
+    ) -> bool:
+        _validate_item(key, value, ttl)
+        return await self._run_routed(key, [
+            _build_line(CommandId.COMPARE_AND_SET,
+                        key, str(ttl), str(len(value)), str(version)),
+            value,
+            SEPARATOR_BINARY,
+        ], _read_stored)
+
+    # Returns the values in the order of the keys,
+    # None for the items that are not found
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        for key in keys:
+            _validate_key(key)
+        return await self._run_with_refresh(lambda: self._get_many(keys))
+
+    # Takes (key, value, ttl) for every item
+    async def set_many(self, items: Sequence[Tuple[str, bytes, int]]) -> None:
+        for key, value, ttl in items:
+            _validate_item(key, value, ttl)
+        await self._run_with_refresh(lambda: self._set_many(items))
+
+    # Returns the number of deleted items
+    async def delete_many(self, keys: Sequence[str]) -> int:
+        for key in keys:
+            _validate_key(key)
+        return await self._run_with_refresh(lambda: self._delete_many(keys))
+
+    # Deletes the items which keys start with the prefix from all servers,
+    # returns the number of deleted items
+    async def delete_prefix(self, prefix: str) -> int:
+        _validate_key(prefix)
+        return await self._broadcast_count(CommandId.DELETE_PREFIX, prefix)
+
+    # Deletes the items with the tag from all servers,
+    # returns the number of deleted items
+    async def delete_tag(self, tag: str) -> int:
+        _validate_tag(tag)
+        return await self._broadcast_count(CommandId.DELETE_TAG, tag)
+
+    # Returns the statistics of each server by its "HOST:PORT"
+    async def get_stats(self) -> Dict[str, Dict[str, int]]:
+        addresses = list(self._addresses)
+        stats = await asyncio.gather(*(
+            self._pools[address].request(
+                [_build_line(CommandId.STATS)], _read_list)
+            for address in addresses
+        ))
+        return {
+            f'{host}:{port}': {
+                name: int(value)
+                for _, name, value in (line.split() for line in lines)
+            }
+            for (host, port), lines in zip(addresses, stats)
+        }
+
+    # Fetches the shards from the servers and routes the keys by them,
+    # simultaneous calls share the same request
+    async def refresh_shards(self) -> None:
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._refresh_shards())
+            self._refreshing.add_done_callback(self._on_refreshed)
+        await asyncio.shield(self._refreshing)
+
+    async def close(self) -> None:
+        pools = list(self._pools.values())
+        self._pools.clear()
+        for pool in pools:
+            await pool.close()
+
+    def _on_refreshed(self, _: 'asyncio.Task[None]') -> None:
+        self._refreshing = None
+
+    async def _refresh_shards(self) -> None:
+        error: Exception = CacheError('No servers')
+        for address in list(self._addresses):
+            try:
+                lines = await self._pools[address].request(
+                    [_build_line(CommandId.SHARDS)], _read_list)
+            except (CacheError, OSError) as e:
+                # try the other servers
+                error = e
+                continue
+            shards = []
+            for line in lines:
+                _, _, host, port = line.split()
+                shards.append((host, int(port)))
+            await self._close_pools([
+                address for address in self._pools if address not in shards
+            ])
+            self._set_addresses(shards)
+            return
+        raise error
+
+    def _set_addresses(self, addresses: List[Address]) -> None:
+        self._addresses = list(addresses)
+        for host, port in addresses:
+            if (host, port) not in self._pools:
+                self._pools[(host, port)] = ConnectionPool(
+                    host, port, self._pool_size)
+        self._ring = HashRing([f'{host}:{port}' for host, port in addresses])
+
+    async def _close_pools(self, addresses: List[Address]) -> None:
+        for address in addresses:
+            await self._pools.pop(address).close()
+
+    def _get_pool(self, key: str) -> ConnectionPool:
+        return self._pools[self._addresses[self._ring.get_node_index(key)]]
+
+    async def _run_routed(
+            self,
+            key: str,
+            buffers: List[bytes],
+            read_response: _ResponseReader
+    ) -> Any:
+        return await self._run_with_refresh(
+            lambda: self._get_pool(key).request(buffers, read_response))
+
+    async def _run_with_refresh(
+            self, operation: Callable[[], Awaitable[_Result]]
+    ) -> _Result:
+        try:
+            return await operation()
+        except MovedError:
+            # the shards have changed, the keys are routed by the new ones
+            await self.refresh_shards()
+            return await operation()
+
+    async def _update_counter(
+            self,
+            command_id: CommandId,
+            key: str,
+            delta: int,
+            initial: Optional[int],
+            ttl: int
+    ) -> Optional[int]:
+        _validate_key(key)
+        if delta < 0 or (initial is not None and initial < 0) or ttl < 0:
+            raise ValueError('Delta, initial value and TTL must be >= 0')
+        args = [key, str(delta)]
+        if initial is not None:
+            args += [str(initial), str(ttl)]
+        return await self._run_routed(
+            key, [_build_line(command_id, *args)], _read_counter)
+
+    async def _append(
+            self, command_id: CommandId, key: str, value: bytes) -> bool:
+        _validate_item(key, value, 0)
+        return await self._run_routed(key, [
+            _build_line(command_id, key, str(len(value))),
+            value,
+            SEPARATOR_BINARY,
+        ], _read_stored)
+
+    async def _broadcast_count(self, command_id: CommandId, arg: str) -> int:
+        counts = await asyncio.gather(*(
+            self._pools[address].request(
+                [_build_line(command_id, arg)], _read_count)
+            for address in list(self._addresses)
+        ))
+        return sum(counts)
+
+    async def _get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        batches = list(self._split_batches(
+            list(range(len(keys))), lambda index: len(keys[index]),
+            lambda index: keys[index]
+        ))
+        responses = await asyncio.gather(*(
+            pool.request([_build_line(
+                CommandId.MULTI_GET, *(keys[index] for index in indexes))
+            ], _read_values)
+            for pool, indexes in batches
+        ))
+        values: List[Optional[bytes]] = [None] * len(keys)
+        for (_, indexes), batch_values in zip(batches, responses):
+            for index, value in zip(indexes, batch_values):
+                values[index] = value
+        return values
+
+    async def _set_many(self, items: Sequence[Tuple[str, bytes, int]]) -> None:
+        requests = []
+        for pool, batch in self._split_batches(
+                items, lambda item: len(item[0]) + len(item[1]),
+                lambda item: item[0]):
+            header = [
+                argument
+                for key, value, ttl in batch
+                for argument in (key, str(ttl), str(len(value)))
+            ]
+            buffers = [_build_line(CommandId.MULTI_SET, *header)]
+            for _, value, _ in batch:
+                buffers.append(value)
+                buffers.append(SEPARATOR_BINARY)
+            requests.append(pool.request(buffers, _read_status))
+        await asyncio.gather(*requests)
+
+    async def _delete_many(self, keys: Sequence[str]) -> int:
+        counts = await asyncio.gather(*(
+            pool.request(
+                [_build_line(CommandId.MULTI_DELETE, *batch)], _read_count)
+            for pool, batch in self._split_batches(keys, len, lambda key: key)
+        ))
+        return sum(counts)
+
+    # Groups the entries by the servers owning their keys and splits
+    # the groups into batches which fit in a single message
+    def _split_batches(
+            self,
+            entries: Sequence[_Entry],
+            get_size: Callable[[_Entry], int],
+            get_key: Callable[[_Entry], str]
+    ) -> Iterator[Tuple[ConnectionPool, List[_Entry]]]:
+        def get_node_index(entry: _Entry) -> int:
+            return self._ring.get_node_index(get_key(entry))
+
+        for node_index, group in groupby(
+                sorted(entries, key=get_node_index), key=get_node_index):
+            pool = self._pools[self._addresses[node_index]]
+            batch: List[_Entry] = []
+            batch_size = 0
+            for entry in group:
+                size = get_size(entry) + _BATCH_ITEM_OVERHEAD
+                if batch and batch_size + size > MAX_MESSAGE_SIZE:
+                    yield pool, batch
+                    batch = []
+                    batch_size = 0
+                batch.append(entry)
+                batch_size += size
+            yield pool, batch
+
+
+def _build_line(command_id: CommandId, *args: str) -> bytes:
+    return ' '.join((command_id.value,) + args).encode() + SEPARATOR_BINARY
+
+
+# Invalid arguments are rejected before sending: the server would
+# take the value that follows a rejected header for a command
+def _validate_key(key: str) -> None:
+    if not key or len(key.split()) != 1 or key.strip() != key:
+        raise ValueError(f'Invalid key: {key!r}')
+
+
+def _validate_tag(tag: str) -> None:
+    _validate_key(tag)
+    if TAG_SEPARATOR in tag:
+        raise ValueError(f'Invalid tag: {tag!r}')
+
+
+def _validate_item(key: str, value: bytes, ttl: int) -> None:
+    _validate_key(key)
+    if len(value) > MAX_MESSAGE_SIZE:
+        raise ValueError(f'Value size must be <= {MAX_MESSAGE_SIZE}')
+    if ttl < 0:
+        raise ValueError('TTL must be >= 0')
+
+
+def _build_error(line: str) -> CacheError:
+    if line.startswith(_MOVED + ' '):
+        host, _, port = line[len(_MOVED) + 1:].rpartition(':')
+        return MovedError(line, (host, int(port)))
+    return CacheError(line)
+
+
+async def _read_value(
+        reader: asyncio.StreamReader, line: str) -> Optional[bytes]:
+    if line == _NOT_FOUND:
+        return None
+    if not line.isdigit():
+        raise _build_error(line)
+    data = await reader.readexactly(int(line) + len(SEPARATOR_BINARY))
+    return data[:-len(SEPARATOR_BINARY)]
+
+
+async def _read_status(reader: asyncio.StreamReader, line: str) -> None:
+    if line != _SUCCESS:
+        raise _build_error(line)
+
+
+async def _read_versioned_value(
+        reader: asyncio.StreamReader, line: str
+) -> Optional[Tuple[bytes, int]]:
+    if line == _NOT_FOUND:
+        return None
+    marker, *numbers = line.split()
+    if marker != _VERSION or len(numbers) != 2:
+        raise _build_error(line)
+    version, size = map(int, numbers)
+    data = await reader.readexactly(size + len(SEPARATOR_BINARY))
+    return data[:-len(SEPARATOR_BINARY)], version
+
+
+async def _read_counter(
+        reader: asyncio.StreamReader, line: str) -> Optional[int]:
+    if line == _NOT_FOUND:
+        return None
+    marker, _, counter = line.partition(' ')
+    if marker != _COUNTER:
+        raise _build_error(line)
+    return int(counter)
+
+
+# Conditional changes fail if the item is not found or has changed
+async def _read_stored(reader: asyncio.StreamReader, line: str) -> bool:
+    if line == _SUCCESS:
+        return True
+    if line in (_NOT_FOUND, _EXISTS):
+        return False
+    raise _build_error(line)
+
+
+# The deletion fails if the item is not found
+async def _read_deleted(reader: asyncio.StreamReader, line: str) -> bool:
+    if line == _SUCCESS:
+        return True
+    if line == _FAILURE:
+        return False
+    raise _build_error(line)
+
+
+# All values are read at once, knowing their sizes from the header
+async def _read_values(
+        reader: asyncio.StreamReader, line: str) -> List[Optional[bytes]]:
+    marker, *sizes = line.split()
+    if marker != _VALUES:
+        raise _build_error(line)
+    separator_length = len(SEPARATOR_BINARY)
+    data = await reader.readexactly(sum(
+        int(size) + separator_length
+        for size in sizes if int(size) != _MISSING_VALUE_SIZE
+    ))
+    values: List[Optional[bytes]] = []
+    position = 0
+    for size in map(int, sizes):
+        if size == _MISSING_VALUE_SIZE:
+            values.append(None)
+            continue
+        values.append(data[position:position + size])
+        position += size + separator_length
+    return values
+
+
+async def _read_count(reader: asyncio.StreamReader, line: str) -> int:
+    marker, _, count = line.partition(' ')
+    if marker != _DELETED:
+        raise _build_error(line)
+    return int(count)
+
+
+# Lines of a list terminated with the end marker
+async def _read_list(reader: asyncio.StreamReader, line: str) -> List[str]:
+    if not line.startswith((_SHARD, _STAT, _END)):
+        raise _build_error(line)
+    lines = []
+    while line != _END:
+        lines.append(line)
+        line = (await reader.readuntil(SEPARATOR_BINARY)).decode().strip()
+    return lines
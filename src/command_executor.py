@@ -1,43 +1,282 @@
-from typing import Union
+from typing import Dict, List, Optional
 
 from cache import Cache
-from commands import Command, CommandSet, CommandGet, CommandDelete
+from commands import Command, CommandSet, CommandGet, CommandDelete,\
+    CommandPipeline, CommandMultiGet, CommandMultiSet, CommandMultiDelete,\
+    CommandStats, CommandLeaseGet, CommandLeaseSet, CommandCompressedGet,\
+    CommandInvalidate, CommandDeletePrefix, CommandDeleteTag,\
+    CommandIncrement, CommandAppend, CommandPrepend, CommandVersionedGet,\
+    CommandCompareAndSet
 
-from protocol import SEPARATOR, SEPARATOR_BINARY
+from binary_protocol import BinaryRequest, BinaryResponse, OPCODE_GET,\
+    OPCODE_SET, OPCODE_DELETE, OPCODE_NOOP, STATUS_SUCCESS,\
+    STATUS_NOT_FOUND, STATUS_INVALID_ARGUMENTS, STATUS_NOT_STORED,\
+    STATUS_UNKNOWN_COMMAND
+from leases import LeaseTable
+from protocol import SEPARATOR
+from persistence import ChangeLog
+from responses import Response, TextResponse, ValueResponse,\
+    StaleValueResponse, CompressedValueResponse, MultiValueResponse,\
+    VersionedValueResponse
 
-_NOT_EXECUTED = 'NOT_EXECUTED'
-_SUCCESS = 'SUCCESS'
-_FAILURE = 'COMMAND_FAILED'
-_NOT_FOUND = 'NOT_FOUND'
+_NOT_EXECUTED = TextResponse('NOT_EXECUTED')
+_SUCCESS = TextResponse('SUCCESS')
+_FAILURE = TextResponse('COMMAND_FAILED')
+_NOT_FOUND = TextResponse('NOT_FOUND')
+_WAIT = TextResponse('WAIT')
+_INVALID_LEASE = TextResponse('INVALID_LEASE')
+_NOT_A_NUMBER = TextResponse('NOT_A_NUMBER')
+# the item has changed since the client read its version
+_EXISTS = TextResponse('EXISTS')
+_LEASE = 'LEASE'
+_COUNTER = 'COUNTER'
 
+# commands which invalidate the leases on their items
+_MODIFYING_COMMANDS = (
+    CommandSet, CommandDelete, CommandMultiSet, CommandMultiDelete,
+    CommandIncrement, CommandAppend, CommandCompareAndSet
+)
+_DELETED = 'DELETED'
+_STAT = 'STAT'
+_END = 'END'
 
-# Executes the provided command on the cache
-def execute_command(command: Command, cache: Cache) -> Union[str, bytes]:
+
+# Executes the provided command on the cache,
+# the changes of the items are recorded to the log if it is provided
+# and invalidate the leases on the items if the lease table is provided
+def execute_command(
+        command: Command,
+        cache: Cache,
+        log: Optional[ChangeLog] = None,
+        leases: Optional[LeaseTable] = None
+) -> Response:
     args = command.args
-    result: Union[str, bytes] = _NOT_EXECUTED
+    result: Response = _NOT_EXECUTED
+    if leases is not None and isinstance(command, _MODIFYING_COMMANDS):
+        for key in command.get_keys():
+            leases.invalidate(key)
+
     if isinstance(command, CommandSet):
-        if cache.set_item(
-            args[0],
-            command.get_bytes_attachment(),
-            int(args[1])
-        ):
+        value = command.get_bytes_attachment()
+        ttl = int(args[1])
+        if cache.set_item(args[0], value, ttl, command.prepared_attachment,
+                          command.get_tags()):
             result = _SUCCESS
         else:
             result = _FAILURE
+        if log is not None:
+            _record_set(args[0], value, cache, log)
     elif isinstance(command, CommandGet):
         item = cache.get_item(args[0])
         if item is None:
             result = _NOT_FOUND
         else:
-            result = str(len(item)).encode() + SEPARATOR_BINARY + item
+            result = ValueResponse(item)
+    elif isinstance(command, CommandCompressedGet):
+        stored = cache.get_stored_item(args[0])
+        compression = cache.get_compression()
+        if stored is None:
+            result = _NOT_FOUND
+        elif stored.compressed and compression is not None:
+            result = CompressedValueResponse(stored.data, compression)
+        else:
+            result = ValueResponse(stored.data)
     elif isinstance(command, CommandDelete):
+        if log is not None:
+            log.record_delete(args[0])
         if cache.delete_item(args[0]):
             result = _SUCCESS
         else:
             result = _FAILURE
+    elif isinstance(command, CommandMultiGet):
+        result = MultiValueResponse(cache.get_items(args))
+    elif isinstance(command, CommandMultiSet):
+        items = command.get_items()
+        if all(cache.set_items(items, command.prepared_values)):
+            result = _SUCCESS
+        else:
+            result = _FAILURE
+        if log is not None:
+            for key, value, _ in items:
+                _record_set(key, value, cache, log)
+    elif isinstance(command, CommandMultiDelete):
+        if log is not None:
+            for key in args:
+                log.record_delete(key)
+        result = TextResponse(f'{_DELETED} {cache.delete_items(args)}')
+    elif isinstance(command, CommandInvalidate):
+        # the items matched since the server started the deletion
+        # are deleted at once
+        deleted = delete_items(
+            find_invalidated_keys(command, cache), cache, log, leases)
+        result = TextResponse(f'{_DELETED} {command.deleted + deleted}')
+    elif isinstance(command, CommandLeaseGet) and leases is not None:
+        result = _execute_lease_get(args[0], cache, leases)
+    elif isinstance(command, CommandLeaseSet) and leases is not None:
+        if not leases.release(args[0], command.get_token()):
+            result = _INVALID_LEASE
+        else:
+            value = command.get_bytes_attachment()
+            ttl = int(args[2])
+            if cache.set_item(
+                    args[0], value, ttl, command.prepared_attachment):
+                result = _SUCCESS
+            else:
+                result = _FAILURE
+            if log is not None:
+                _record_set(args[0], value, cache, log)
+    elif isinstance(command, CommandIncrement):
+        try:
+            counter = cache.increment_item(
+                args[0], command.get_delta(), command.get_initial(),
+                command.get_ttl())
+        except ValueError:
+            result = _NOT_A_NUMBER
+        else:
+            if counter is None:
+                result = _NOT_FOUND
+            else:
+                if log is not None:
+                    _record_set(args[0], b'%d' % counter, cache, log)
+                result = TextResponse(f'{_COUNTER} {counter}')
+    elif isinstance(command, CommandAppend):
+        try:
+            value = cache.append_item(
+                args[0], command.get_bytes_attachment(),
+                prepend=isinstance(command, CommandPrepend),
+                prepared=command.prepared_update)
+        except ValueError:
+            result = _FAILURE
+        else:
+            if value is None:
+                result = _NOT_FOUND
+            else:
+                if log is not None:
+                    _record_set(args[0], value, cache, log)
+                result = _SUCCESS
+    elif isinstance(command, CommandVersionedGet):
+        versioned_item = cache.get_versioned_item(args[0])
+        if versioned_item is None:
+            result = _NOT_FOUND
+        else:
+            result = VersionedValueResponse(*versioned_item)
+    elif isinstance(command, CommandCompareAndSet):
+        version = cache.get_version(args[0])
+        if version is None:
+            result = _NOT_FOUND
+        elif version != command.get_version():
+            result = _EXISTS
+        else:
+            value = command.get_bytes_attachment()
+            ttl = int(args[1])
+            # the item keeps its tags
+            if cache.set_item(args[0], value, ttl,
+                              command.prepared_attachment, tags=None):
+                result = _SUCCESS
+            else:
+                result = _FAILURE
+            if log is not None:
+                _record_set(args[0], value, cache, log)
+    elif isinstance(command, CommandStats):
+        result = build_stats_response(cache.get_stats())
+    elif isinstance(command, CommandPipeline):
+        # the connection mode is switched by the server
+        result = _SUCCESS
 
-    if isinstance(result, str):
-        result += SEPARATOR
-    else:
-        result += SEPARATOR_BINARY
     return result
+
+
+# Executes the request of the binary protocol on the cache,
+# the opcode is mapped to the cache method directly
+def execute_binary_request(
+        request: BinaryRequest,
+        cache: Cache,
+        log: Optional[ChangeLog] = None,
+        leases: Optional[LeaseTable] = None
+) -> BinaryResponse:
+    opcode = request.opcode
+    key = request.key
+    status = STATUS_SUCCESS
+    if leases is not None and opcode in (OPCODE_SET, OPCODE_DELETE):
+        leases.invalidate(key)
+    if opcode == OPCODE_GET:
+        value = cache.get_item(key)
+        if value is None:
+            status = STATUS_NOT_FOUND
+        else:
+            return BinaryResponse(opcode, status, request.opaque, value)
+    elif opcode == OPCODE_SET:
+        if not key:
+            status = STATUS_INVALID_ARGUMENTS
+        else:
+            if not cache.set_item(
+                    key, request.value, request.ttl, request.prepared):
+                status = STATUS_NOT_STORED
+            if log is not None:
+                _record_set(key, request.value, cache, log)
+    elif opcode == OPCODE_DELETE:
+        if log is not None:
+            log.record_delete(key)
+        if not cache.delete_item(key):
+            status = STATUS_NOT_FOUND
+    elif opcode != OPCODE_NOOP:
+        status = STATUS_UNKNOWN_COMMAND
+    return BinaryResponse(opcode, status, request.opaque)
+
+
+# Returns the keys of the items matched by the invalidation command
+def find_invalidated_keys(
+        command: CommandInvalidate, cache: Cache) -> List[str]:
+    if isinstance(command, CommandDeletePrefix):
+        return cache.find_keys_by_prefix(command.get_prefix())
+    assert isinstance(command, CommandDeleteTag)
+    return cache.find_keys_by_tag(command.get_tag())
+
+
+# Deletes the items as "mdel" does, returns the number of deleted ones
+def delete_items(
+        keys: List[str],
+        cache: Cache,
+        log: Optional[ChangeLog] = None,
+        leases: Optional[LeaseTable] = None
+) -> int:
+    for key in keys:
+        if log is not None:
+            log.record_delete(key)
+        if leases is not None:
+            leases.invalidate(key)
+    return cache.delete_items(keys)
+
+
+# Records the stored item with its expiration and tags,
+# or its deletion if it's evicted right away
+def _record_set(
+        key: str, value: bytes, cache: Cache, log: ChangeLog) -> None:
+    expiration = cache.get_expiration(key)
+    if expiration is None:
+        log.record_delete(key)
+    else:
+        log.record_set(key, value, expiration, cache.get_tags(key))
+
+
+# The item is returned if it's found. Otherwise the first client
+# gets a lease to fill the item, and the others get its stale value
+# if there is one, or are told to wait and retry
+def _execute_lease_get(key: str, cache: Cache, leases: LeaseTable) -> Response:
+    item = cache.get_item(key)
+    if item is not None:
+        return ValueResponse(item)
+    token = leases.acquire(key)
+    if token is not None:
+        return TextResponse(f'{_LEASE} {token}')
+    stale_item = cache.get_stale_item(key)
+    if stale_item is not None:
+        return StaleValueResponse(stale_item)
+    return _WAIT
+
+
+# Each statistic is reported on a separate line, the list is terminated
+# with the end marker
+def build_stats_response(stats: Dict[str, int]) -> Response:
+    lines = [f'{_STAT} {name} {value}' for name, value in stats.items()]
+    return TextResponse(SEPARATOR.join(lines + [_END]))
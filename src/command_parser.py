@@ -1,9 +1,15 @@
 from typing import Optional, Type, List
 
 from commands import Command, CommandSet, CommandGet, CommandDelete,\
-    CommandId
+    CommandPipeline, CommandMultiGet, CommandMultiSet, CommandMultiDelete,\
+    CommandStats, CommandShards, CommandProfile, CommandLeaseGet,\
+    CommandLeaseSet, CommandCompressedGet, CommandDeletePrefix,\
+    CommandDeleteTag, CommandIncrement, CommandDecrement, CommandAppend,\
+    CommandPrepend, CommandVersionedGet, CommandCompareAndSet, CommandId
 from config import MAX_MESSAGE_SIZE
+from profiling import PROFILE_CPU, PROFILE_MEMORY
 from protocol import SEPARATOR
+from value_store import MAX_COUNTER
 
 
 class InvalidCommandArgument(Exception):
@@ -11,10 +17,27 @@ class InvalidCommandArgument(Exception):
 
 
 class CommandDefinition:
-    def __init__(self, class_: Type[Command], args_number: int, usage: str):
+    def __init__(
+            self,
+            class_: Type[Command],
+            args_number: int,
+            usage: str,
+            repeated: bool = False,
+            optional_args_number: int = 0
+    ):
         self.class_ = class_
         self.args_number = args_number
         self.usage = usage
+        # repeated commands accept one or more groups of "args_number" args
+        self.repeated = repeated
+        # number of the args which may follow the required ones
+        self.optional_args_number = optional_args_number
+
+    def is_args_number_valid(self, args_number: int) -> bool:
+        if self.repeated:
+            return args_number > 0 and args_number % self.args_number == 0
+        return self.args_number <= args_number <=\
+            self.args_number + self.optional_args_number
 
 
 class CommandOrError:
@@ -28,11 +51,49 @@ class CommandOrError:
 
 
 _COMMAND_DEFINITIONS = {
-    CommandId.SET.value: CommandDefinition(CommandSet, 3, '[key] [ttl] [size]'),
+    CommandId.SET.value: CommandDefinition(
+        CommandSet, 3, '[key] [ttl] [size] [tags]', optional_args_number=1),
     CommandId.GET.value: CommandDefinition(CommandGet, 1, '[key]'),
+    CommandId.COMPRESSED_GET.value: CommandDefinition(
+        CommandCompressedGet, 1, '[key]'),
     CommandId.DELETE.value: CommandDefinition(CommandDelete, 1, '[key]'),
+    CommandId.DELETE_PREFIX.value: CommandDefinition(
+        CommandDeletePrefix, 1, '[prefix]'),
+    CommandId.DELETE_TAG.value: CommandDefinition(
+        CommandDeleteTag, 1, '[tag]'),
+    CommandId.PIPELINE.value: CommandDefinition(CommandPipeline, 0, ''),
+    CommandId.MULTI_GET.value: CommandDefinition(
+        CommandMultiGet, 1, '[key] ...', repeated=True),
+    CommandId.MULTI_SET.value: CommandDefinition(
+        CommandMultiSet, 3, '[key] [ttl] [size] ...', repeated=True),
+    CommandId.MULTI_DELETE.value: CommandDefinition(
+        CommandMultiDelete, 1, '[key] ...', repeated=True),
+    CommandId.STATS.value: CommandDefinition(CommandStats, 0, ''),
+    CommandId.SHARDS.value: CommandDefinition(CommandShards, 0, ''),
+    CommandId.PROFILE.value: CommandDefinition(
+        CommandProfile, 2, '[cpu|memory] [start|stop]'),
+    CommandId.LEASE_GET.value: CommandDefinition(CommandLeaseGet, 1, '[key]'),
+    CommandId.LEASE_SET.value: CommandDefinition(
+        CommandLeaseSet, 4, '[key] [token] [ttl] [size]'),
+    CommandId.INCREMENT.value: CommandDefinition(
+        CommandIncrement, 2, '[key] [delta] [initial] [ttl]',
+        optional_args_number=2),
+    CommandId.DECREMENT.value: CommandDefinition(
+        CommandDecrement, 2, '[key] [delta] [initial] [ttl]',
+        optional_args_number=2),
+    CommandId.APPEND.value: CommandDefinition(
+        CommandAppend, 2, '[key] [size]'),
+    CommandId.PREPEND.value: CommandDefinition(
+        CommandPrepend, 2, '[key] [size]'),
+    CommandId.VERSIONED_GET.value: CommandDefinition(
+        CommandVersionedGet, 1, '[key]'),
+    CommandId.COMPARE_AND_SET.value: CommandDefinition(
+        CommandCompareAndSet, 4, '[key] [ttl] [size] [version]'),
 }
 
+_PROFILE_KINDS = (PROFILE_CPU, PROFILE_MEMORY)
+_PROFILE_ACTIONS = ('start', 'stop')
+
 
 # Tries to parse a command from the given message,
 # returns either the parsed command or an error
@@ -48,25 +109,98 @@ def parse_command(message: str) -> CommandOrError:
             f'Supported commands are: {supported}.{SEPARATOR}')
 
     definition = _COMMAND_DEFINITIONS[command_id]
-    if len(command_args) != definition.args_number:
+    if not definition.is_args_number_valid(len(command_args)):
         return CommandOrError(
             error=f'Usage: {command_id} {definition.usage}{SEPARATOR}')
 
-    if command_id == CommandId.SET.value:
-        try:
+    try:
+        if command_id == CommandId.SET.value:
             _validate_set_command_args(command_args)
-        except InvalidCommandArgument as e:
-            return CommandOrError(error=f'Bad argument: {str(e)}{SEPARATOR}')
+        elif command_id == CommandId.MULTI_SET.value:
+            _validate_multi_set_command_args(command_args)
+        elif command_id == CommandId.LEASE_SET.value:
+            _validate_lease_set_command_args(command_args)
+        elif command_id == CommandId.PROFILE.value:
+            _validate_profile_command_args(command_args)
+        elif command_id in (
+                CommandId.INCREMENT.value, CommandId.DECREMENT.value):
+            _validate_increment_command_args(command_args)
+        elif command_id in (CommandId.APPEND.value, CommandId.PREPEND.value):
+            _parse_int(command_args[1], 'size', 0, MAX_MESSAGE_SIZE)
+        elif command_id == CommandId.COMPARE_AND_SET.value:
+            _validate_compare_and_set_command_args(command_args)
+    except InvalidCommandArgument as e:
+        return CommandOrError(error=f'Bad argument: {str(e)}{SEPARATOR}')
 
     return CommandOrError(command=definition.class_(command_args))
 
 
+# Returns the size of the attachment declared by the command header
+# even if the header is rejected, None if there is no attachment
+# or its size can't be told
+def get_declared_attachment_size(message: str) -> Optional[int]:
+    args = message.split()
+    definition = _COMMAND_DEFINITIONS.get(args[0])
+    if definition is None or\
+            not definition.is_args_number_valid(len(args) - 1):
+        return None
+    command = definition.class_(args[1:])
+    if not command.has_attachment():
+        return None
+    try:
+        size = command.get_attachment_size()
+    except ValueError:
+        return None
+    return size if size >= 0 else None
+
+
 def _validate_set_command_args(args: List[str]) -> None:
-    _, ttl, size = args
+    _, ttl, size, *_ = args
     _parse_int(ttl, 'ttl', 0, None)
     _parse_int(size, 'size', 0, MAX_MESSAGE_SIZE)
 
 
+def _validate_multi_set_command_args(args: List[str]) -> None:
+    for index in range(0, len(args), 3):
+        _validate_set_command_args(args[index:index + 3])
+    # all values are read as a single attachment
+    total_size = sum(int(size) for size in args[2::3])
+    if total_size > MAX_MESSAGE_SIZE:
+        raise InvalidCommandArgument(
+            f'total size of values must be <= {MAX_MESSAGE_SIZE}')
+
+
+def _validate_lease_set_command_args(args: List[str]) -> None:
+    key, token, ttl, size = args
+    _parse_int(token, 'token', 0, None)
+    _validate_set_command_args([key, ttl, size])
+
+
+def _validate_increment_command_args(args: List[str]) -> None:
+    _, delta, *optional_args = args
+    _parse_int(delta, 'delta', 0, MAX_COUNTER)
+    if optional_args:
+        _parse_int(optional_args[0], 'initial', 0, MAX_COUNTER)
+    if len(optional_args) > 1:
+        _parse_int(optional_args[1], 'ttl', 0, None)
+
+
+def _validate_compare_and_set_command_args(args: List[str]) -> None:
+    key, ttl, size, version = args
+    _parse_int(version, 'version', 0, None)
+    _validate_set_command_args([key, ttl, size])
+
+
+def _validate_profile_command_args(args: List[str]) -> None:
+    kind, action = args
+    if kind not in _PROFILE_KINDS:
+        raise InvalidCommandArgument(
+            f'profile must be one of: {", ".join(_PROFILE_KINDS)}')
+    if action not in _PROFILE_ACTIONS:
+        raise InvalidCommandArgument(
+            f'action must be one of: {", ".join(_PROFILE_ACTIONS)}')
+
+
 def _parse_int(
         value: str,
         name: str,
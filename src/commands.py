@@ -1,17 +1,45 @@
-from typing import List
+from typing import List, Optional, Tuple
 from enum import Enum
 
+from compression import StoredValue, PreparedUpdate
+from protocol import SEPARATOR_BINARY
+
+
+_SEPARATOR_SIZE = len(SEPARATOR_BINARY)
+# separates the tags of an item in the set command
+TAG_SEPARATOR = ','
+
 
 class CommandId(Enum):
     SET = 'set'
     GET = 'get'
     DELETE = 'del'
+    PIPELINE = 'pipeline'
+    MULTI_GET = 'mget'
+    MULTI_SET = 'mset'
+    MULTI_DELETE = 'mdel'
+    STATS = 'stats'
+    SHARDS = 'shards'
+    PROFILE = 'profile'
+    LEASE_GET = 'lget'
+    LEASE_SET = 'lset'
+    COMPRESSED_GET = 'cget'
+    DELETE_PREFIX = 'delprefix'
+    DELETE_TAG = 'deltag'
+    INCREMENT = 'incr'
+    DECREMENT = 'decr'
+    APPEND = 'append'
+    PREPEND = 'prepend'
+    VERSIONED_GET = 'gets'
+    COMPARE_AND_SET = 'cas'
 
 
 class Command:
     def __init__(self, args: List[str]):
         self.args = args
         self.bytes_attachment: bytes = b''
+        # the attachment compressed for storing, if it's done in advance
+        self.prepared_attachment: Optional[StoredValue] = None
 
     def get_id(self) -> str:
         raise NotImplementedError
@@ -19,23 +47,338 @@ class Command:
     def get_arguments(self) -> List[str]:
         return self.args
 
+    # Keys of the items affected by the command
+    def get_keys(self) -> List[str]:
+        return []
+
+    # Whether the command header is followed by a payload message
+    def has_attachment(self) -> bool:
+        return False
+
+    # Number of payload bytes (without the terminator)
+    def get_attachment_size(self) -> int:
+        return 0
+
+    def get_attachment_prompt(self) -> str:
+        size = self.get_attachment_size()
+        return f'Send {size} bytes, terminated with \\r\\n.'
+
     def get_bytes_attachment(self) -> bytes:
         return self.bytes_attachment
 
     def set_bytes_attachment(self, attachment: bytes) -> None:
         self.bytes_attachment = attachment
 
+    # Checks the structure of the received attachment
+    def is_attachment_valid(self) -> bool:
+        return True
+
 
 class CommandSet(Command):
+    """
+    Arguments are [key] [ttl] [size], optionally followed by
+    the comma-separated tags of the item
+    """
+
     def get_id(self) -> str:
         return CommandId.SET.value
 
+    def get_keys(self) -> List[str]:
+        return self.args[:1]
+
+    def has_attachment(self) -> bool:
+        return True
+
+    def get_attachment_size(self) -> int:
+        return int(self.args[2])
+
+    def get_tags(self) -> List[str]:
+        if len(self.args) < 4:
+            return []
+        return [tag for tag in self.args[3].split(TAG_SEPARATOR) if tag]
+
 
 class CommandGet(Command):
     def get_id(self) -> str:
         return CommandId.GET.value
 
+    def get_keys(self) -> List[str]:
+        return self.args[:1]
+
+
+class CommandCompressedGet(Command):
+    """
+    Get of an item in the form it's stored, possibly compressed
+    """
+
+    def get_id(self) -> str:
+        return CommandId.COMPRESSED_GET.value
+
+    def get_keys(self) -> List[str]:
+        return self.args[:1]
+
 
 class CommandDelete(Command):
     def get_id(self) -> str:
         return CommandId.DELETE.value
+
+    def get_keys(self) -> List[str]:
+        return self.args[:1]
+
+
+class CommandLeaseGet(Command):
+    """
+    Get of an item, the client which misses it gets a lease to fill it
+    """
+
+    def get_id(self) -> str:
+        return CommandId.LEASE_GET.value
+
+    def get_keys(self) -> List[str]:
+        return self.args[:1]
+
+
+class CommandLeaseSet(Command):
+    """
+    Set of an item by the holder of its lease,
+    arguments are [key] [token] [ttl] [size]
+    """
+
+    def get_id(self) -> str:
+        return CommandId.LEASE_SET.value
+
+    def get_keys(self) -> List[str]:
+        return self.args[:1]
+
+    def has_attachment(self) -> bool:
+        return True
+
+    def get_attachment_size(self) -> int:
+        return int(self.args[3])
+
+    def get_token(self) -> int:
+        return int(self.args[1])
+
+
+class CommandIncrement(Command):
+    """
+    Arguments are [key] [delta], optionally followed by
+    the [initial] value and the [ttl] of the item if it's missing
+    """
+
+    def get_id(self) -> str:
+        return CommandId.INCREMENT.value
+
+    def get_keys(self) -> List[str]:
+        return self.args[:1]
+
+    def get_delta(self) -> int:
+        return int(self.args[1])
+
+    def get_initial(self) -> Optional[int]:
+        return int(self.args[2]) if len(self.args) > 2 else None
+
+    def get_ttl(self) -> int:
+        return int(self.args[3]) if len(self.args) > 3 else 0
+
+
+class CommandDecrement(CommandIncrement):
+    def get_id(self) -> str:
+        return CommandId.DECREMENT.value
+
+    def get_delta(self) -> int:
+        return -int(self.args[1])
+
+
+class CommandAppend(Command):
+    """
+    Arguments are [key] [size] of the appended value
+    """
+
+    def __init__(self, args: List[str]):
+        super().__init__(args)
+        # the new value of the item prepared for storing in advance
+        self.prepared_update: Optional[PreparedUpdate] = None
+
+    def get_id(self) -> str:
+        return CommandId.APPEND.value
+
+    def get_keys(self) -> List[str]:
+        return self.args[:1]
+
+    def has_attachment(self) -> bool:
+        return True
+
+    def get_attachment_size(self) -> int:
+        return int(self.args[1])
+
+
+class CommandPrepend(CommandAppend):
+    def get_id(self) -> str:
+        return CommandId.PREPEND.value
+
+
+class CommandVersionedGet(Command):
+    """
+    Get of an item along with its version, see "cas"
+    """
+
+    def get_id(self) -> str:
+        return CommandId.VERSIONED_GET.value
+
+    def get_keys(self) -> List[str]:
+        return self.args[:1]
+
+
+class CommandCompareAndSet(Command):
+    """
+    Set of an item which version hasn't changed since it was read,
+    arguments are [key] [ttl] [size] [version]
+    """
+
+    def get_id(self) -> str:
+        return CommandId.COMPARE_AND_SET.value
+
+    def get_keys(self) -> List[str]:
+        return self.args[:1]
+
+    def has_attachment(self) -> bool:
+        return True
+
+    def get_attachment_size(self) -> int:
+        return int(self.args[2])
+
+    def get_version(self) -> int:
+        return int(self.args[3])
+
+
+class CommandPipeline(Command):
+    def get_id(self) -> str:
+        return CommandId.PIPELINE.value
+
+
+class CommandMultiGet(Command):
+    def get_id(self) -> str:
+        return CommandId.MULTI_GET.value
+
+    def get_keys(self) -> List[str]:
+        return self.args
+
+
+class CommandMultiSet(Command):
+    """
+    Arguments are [key] [ttl] [size] triples.
+    The attachment holds the values in the same order,
+    each one terminated with the separator.
+    """
+
+    def __init__(self, args: List[str]):
+        super().__init__(args)
+        # the values compressed for storing, if it's done in advance
+        self.prepared_values: Optional[List[StoredValue]] = None
+
+    def get_id(self) -> str:
+        return CommandId.MULTI_SET.value
+
+    def get_keys(self) -> List[str]:
+        return self.args[::3]
+
+    def has_attachment(self) -> bool:
+        return True
+
+    # Values are separated from each other inside the attachment,
+    # the last separator terminates the attachment itself
+    def get_attachment_size(self) -> int:
+        sizes = self.get_sizes()
+        return sum(sizes) + _SEPARATOR_SIZE * (len(sizes) - 1)
+
+    def get_attachment_prompt(self) -> str:
+        return f'Send {len(self.get_sizes())} values, ' +\
+            'each terminated with \\r\\n.'
+
+    def is_attachment_valid(self) -> bool:
+        attachment = self.bytes_attachment
+        position = 0
+        for size in self.get_sizes()[:-1]:
+            position += size
+            if attachment[position:position + _SEPARATOR_SIZE] !=\
+                    SEPARATOR_BINARY:
+                return False
+            position += _SEPARATOR_SIZE
+        return True
+
+    def get_sizes(self) -> List[int]:
+        return [int(size) for size in self.args[2::3]]
+
+    # Returns (key, value, ttl) for every item of the command
+    def get_items(self) -> List[Tuple[str, bytes, int]]:
+        attachment = self.bytes_attachment
+        items: List[Tuple[str, bytes, int]] = []
+        position = 0
+        for index in range(0, len(self.args), 3):
+            key, ttl, size = self.args[index:index + 3]
+            end = position + int(size)
+            items.append((key, attachment[position:end], int(ttl)))
+            position = end + _SEPARATOR_SIZE
+        return items
+
+
+class CommandMultiDelete(Command):
+    def get_id(self) -> str:
+        return CommandId.MULTI_DELETE.value
+
+    def get_keys(self) -> List[str]:
+        return self.args
+
+
+class CommandInvalidate(Command):
+    """
+    Deletion of all items matching the argument. The server may delete
+    most of them in advance, in chunks, counting them in "deleted".
+    """
+
+    def __init__(self, args: List[str]):
+        super().__init__(args)
+        self.deleted = 0
+
+
+class CommandDeletePrefix(CommandInvalidate):
+    def get_id(self) -> str:
+        return CommandId.DELETE_PREFIX.value
+
+    def get_prefix(self) -> str:
+        return self.args[0]
+
+
+class CommandDeleteTag(CommandInvalidate):
+    def get_id(self) -> str:
+        return CommandId.DELETE_TAG.value
+
+    def get_tag(self) -> str:
+        return self.args[0]
+
+
+class CommandStats(Command):
+    def get_id(self) -> str:
+        return CommandId.STATS.value
+
+
+class CommandShards(Command):
+    def get_id(self) -> str:
+        return CommandId.SHARDS.value
+
+
+class CommandProfile(Command):
+    """
+    Arguments are the kind of the profile and the action:
+    [cpu|memory] [start|stop]
+    """
+
+    def get_id(self) -> str:
+        return CommandId.PROFILE.value
+
+    def get_kind(self) -> str:
+        return self.args[0]
+
+    def is_start(self) -> bool:
+        return self.args[1] == 'start'
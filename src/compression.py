@@ -0,0 +1,64 @@
+import lzma
+import zlib
+from typing import NamedTuple, Optional
+
+from config import COMPRESSION, COMPRESSION_THRESHOLD
+
+
+COMPRESSION_ZLIB = 'zlib'
+COMPRESSION_LZMA = 'lzma'
+
+
+class StoredValue(NamedTuple):
+    """
+    Value in the form it's kept by the cache
+    """
+
+    data: bytes
+    compressed: bool
+
+
+class PreparedUpdate(NamedTuple):
+    """
+    New value of an item changed in place, made of the given version
+    of the item and prepared for storing in advance
+    """
+
+    version: int
+    value: bytes
+    stored: StoredValue
+
+
+class Compressor:
+    """
+    Compresses the values of at least "threshold" bytes,
+    the values which don't get smaller are kept as they are.
+    Both methods may be called from any thread, the compression
+    libraries release the GIL while processing large values.
+    """
+
+    def __init__(self, algorithm: str, threshold: int) -> None:
+        if algorithm not in (COMPRESSION_ZLIB, COMPRESSION_LZMA):
+            raise ValueError(f'Unknown compression: {algorithm}')
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self._module = zlib if algorithm == COMPRESSION_ZLIB else lzma
+
+    def compress(self, value: bytes) -> StoredValue:
+        if len(value) >= self.threshold:
+            data = self._module.compress(value)
+            if len(data) < len(value):
+                return StoredValue(data, True)
+        return StoredValue(value, False)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._module.decompress(data)
+
+
+def create_compressor(
+        algorithm: Optional[str] = COMPRESSION,
+        threshold: int = COMPRESSION_THRESHOLD
+) -> Optional[Compressor]:
+    if algorithm is None:
+        return None
+    return Compressor(algorithm, threshold)
@@ -4,9 +4,142 @@ HOST = '127.0.0.1'
 # server port
 PORT = 8888
 
+# number of worker processes, each of them owns a shard of the keyspace
+# and listens on its own port: PORT, PORT + 1, ..., PORT + WORKERS - 1
+WORKERS = 1
+
+# implementation of the connection handling:
+# 'streams' - coroutine per connection with asyncio streams
+# 'protocol' - asyncio protocol callbacks, no coroutine switches
+# and no waiting for the writes per command, which is faster
+SERVER_CORE = 'streams'
+
+# event loop: 'asyncio' - the standard one,
+# 'uvloop' - faster drop-in replacement, if the uvloop package is installed
+EVENT_LOOP = 'asyncio'
+
 # max message size in bytes that server can read
 # (1MB below)
 MAX_MESSAGE_SIZE = 1024 * 1024 * 1
 
 # max number of items in the cache
 MAX_NUMBER_OF_ITEMS = 50000
+
+# eviction policy applied when the cache is full:
+# 'lru' - least recently used item is evicted
+# 'slru' - segmented LRU, items used once are evicted first
+# 'tinylfu' - W-TinyLFU, new items are admitted only if they are
+# used more often than the eviction candidate
+EVICTION_POLICY = 'lru'
+
+# max estimated memory used by the cached items in bytes,
+# includes keys, values and bookkeeping overhead
+# (1GB below)
+MAX_MEMORY_BYTES = 1024 * 1024 * 1024 * 1
+
+# expired items are reclaimed in the background
+# every EXPIRATION_INTERVAL seconds, in steps taking
+# at most EXPIRATION_STEP_TIME seconds each
+EXPIRATION_INTERVAL = 0.1
+EXPIRATION_STEP_TIME = 0.001
+
+# index of the item expiration timestamps:
+# 'heap' - binary heap, O(log n) insertion
+# 'timing_wheel' - hierarchical timing wheel, O(1) insertion and removal,
+# items are reclaimed up to 10ms after their expiration
+EXPIRATION_INDEX = 'heap'
+
+# seconds the expired items are kept to be served as stale ones by "lget"
+# while their lease holder regenerates them, 0 disables stale serving.
+# Stale items take the memory of the cache until they are reclaimed.
+STALE_TIME = 0
+
+# seconds a lease granted by "lget" stays valid, another client
+# gets the lease once it expires
+LEASE_TIMEOUT = 10
+
+# storage engine for the item values:
+# 'objects' - each value is a separate bytes object
+# 'slab' - values are packed into preallocated size-class slabs,
+# which saves memory and GC work for large numbers of small items
+STORAGE_ENGINE = 'objects'
+
+# compression of the large values: 'zlib', 'lzma' (slower, smaller)
+# or None to store the values as they are. Values of at least
+# COMPRESSION_THRESHOLD bytes are compressed, unless they don't get smaller.
+COMPRESSION = None
+COMPRESSION_THRESHOLD = 16 * 1024
+
+# file of the disk tier: the items evicted from the memory are moved
+# to this memory-mapped file of DISK_TIER_SIZE bytes, and back to the memory
+# once they are requested. The oldest items on the disk are overwritten
+# by the new ones. Place the file on a local SSD, None disables the tier.
+# With several workers each of them uses its own file, like with the
+# snapshots. The file is created anew on every start.
+DISK_TIER_PATH = None
+DISK_TIER_SIZE = 1024 * 1024 * 1024
+
+# index of the keys split into segments by ':', e.g. "user:42:profile",
+# so that "delprefix" finds the matching keys without scanning the cache.
+# Without it "delprefix" scans all the keys, which blocks the server
+# for longer. It's always enabled along with the disk tier, whose keys
+# can't be scanned. Tags are indexed in any case.
+PREFIX_INDEX = False
+
+# large values are compressed by OFFLOAD_THREADS threads, so that
+# the event loop keeps serving the other requests meanwhile.
+# At most MAX_IN_FLIGHT_BYTES bytes of large values are received and
+# compressed at once, the rest wait for their turn in the order of arrival
+OFFLOAD_THREADS = 2
+MAX_IN_FLIGHT_BYTES = 64 * 1024 * 1024
+
+# file of the cache snapshot: it is loaded on startup, and written
+# every SNAPSHOT_INTERVAL seconds and on shutdown, None disables snapshots.
+# With several workers each of them uses its own file: PATH.0, PATH.1, ...
+SNAPSHOT_PATH = None
+SNAPSHOT_INTERVAL = 300
+
+# append-only log of the item changes: it is replayed on startup instead
+# of the snapshot, None disables the log. With several workers each of
+# them uses its own file, like with the snapshots.
+# The log is synced to the disk according to APPEND_LOG_FSYNC:
+# 'always' - after every group of written changes
+# 'everysec' - once a second, up to a second of changes may be lost
+# 'no' - left to the operating system
+# The log is rewritten from the cache contents in the background
+# once it doubles in size and reaches APPEND_LOG_REWRITE_MIN_SIZE bytes.
+APPEND_LOG_PATH = None
+APPEND_LOG_FSYNC = 'everysec'
+APPEND_LOG_REWRITE_MIN_SIZE = 64 * 1024 * 1024
+
+# port the primary streams the changes of the items to the replicas on,
+# None disables the replication. With several workers each of them
+# listens on its own port: REPLICATION_PORT, REPLICATION_PORT + 1, ...
+# A replica which falls more than REPLICATION_BACKLOG_SIZE bytes
+# of changes behind is disconnected, and syncs again.
+REPLICATION_PORT = None
+REPLICATION_BACKLOG_SIZE = 64 * 1024 * 1024
+# (HOST, REPLICATION_PORT) of the primary to run this server as its
+# read-only replica, None to run it as a primary. Can be overridden
+# with the --replica-of argument.
+REPLICA_OF = None
+
+# logging level: 'DEBUG', 'INFO', 'WARNING' or 'ERROR',
+# connections and received messages are logged at the DEBUG level
+LOG_LEVEL = 'INFO'
+# file the log is written to, None for the standard output
+LOG_FILE = None
+# share of the connections which messages are logged at the DEBUG level
+LOG_SAMPLE_RATE = 1.0
+# max number of bytes of each received message shown in the log
+LOG_MAX_PAYLOAD_SIZE = 100
+
+# port serving the metrics in the Prometheus text format over HTTP,
+# None disables it. With several workers each of them listens
+# on its own port: METRICS_PORT, METRICS_PORT + 1, ...
+METRICS_PORT = None
+
+# prefix of the files written by the "profile" command: PATH.cpu.prof
+# and PATH.memory.txt, None disables the command. With several workers
+# each of them uses its own prefix, like with the snapshots.
+PROFILE_PATH = None
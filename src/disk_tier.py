@@ -0,0 +1,164 @@
+import mmap
+import struct
+from typing import Callable, Dict, NamedTuple, Optional
+
+from compression import StoredValue
+
+
+# compressed flag, key size, value size, expiration timestamp
+_RECORD_HEADER = struct.Struct('<BIIq')
+_COMPRESSED_FLAG = 1
+# marks the rest of the ring skipped by a record which doesn't fit there
+_PADDING_FLAG = 2
+
+
+class DiskItem(NamedTuple):
+    value: StoredValue
+    expiration: int
+
+
+class DiskTier:
+    """
+    Second tier of the cache: the items evicted from the memory are
+    appended to a memory-mapped file of a fixed size, used as a ring.
+    Once the file is full, the writes wrap around to its start and
+    overwrite the oldest items. The index keeps only the position of
+    each item, by the hash of its key: positions grow monotonically,
+    so an item is overwritten once the writes are a full ring ahead
+    of it. The key is stored in the record to tell the hash collisions
+    and to report the items dropped once their records are about
+    to be overwritten. The file is a cache of its own and is created
+    anew on every start.
+    """
+
+    def __init__(self, path: str, size: int) -> None:
+        self._size = size
+        with open(path, 'w+b') as file:
+            file.truncate(size)
+            self._map = mmap.mmap(file.fileno(), size)
+        # the records are read by the page faults, which mostly
+        # miss the page cache, so the read ahead is of no use
+        if hasattr(self._map, 'madvise'):
+            self._map.madvise(mmap.MADV_RANDOM)
+        # position of the next record, not wrapped around the ring
+        self._position = 0
+        # position of the oldest record, which isn't overwritten yet
+        self._tail = 0
+        # positions of the records by the hashes of their keys
+        self._index: Dict[int, int] = {}
+        self._on_dropped: Optional[Callable[[str], None]] = None
+        self.bytes_written = 0
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    # The callback gets the keys of the items the tier drops: the ones
+    # which records are overwritten and the ones replaced by another key
+    # with the same hash
+    def set_drop_callback(self, callback: Callable[[str], None]) -> None:
+        self._on_dropped = callback
+
+    # Writes the item over the oldest ones,
+    # returns False if it's larger than the tier
+    def put(self, key: str, value: StoredValue, expiration: int) -> bool:
+        key_data = key.encode()
+        size = _RECORD_HEADER.size + len(key_data) + len(value.data)
+        if size > self._size:
+            return False
+        offset = self._position % self._size
+        skipped = self._size - offset if offset + size > self._size else 0
+        self._drop_overwritten(self._position + skipped + size)
+        if skipped:
+            # records don't wrap, the rest of the ring is skipped
+            if skipped >= _RECORD_HEADER.size:
+                _RECORD_HEADER.pack_into(
+                    self._map, offset, _PADDING_FLAG, 0, 0, 0)
+            if self._tail == self._position:
+                # the whole ring is overwritten along with the padding
+                self._tail += skipped
+            self._position += skipped
+            offset = 0
+
+        key_hash = hash(key)
+        position = self._index.get(key_hash)
+        if position is not None:
+            previous_key = self._read_key(position)
+            if previous_key != key:
+                # another key with the same hash, it isn't found anymore
+                self._dropped(previous_key)
+
+        flags = _COMPRESSED_FLAG if value.compressed else 0
+        _RECORD_HEADER.pack_into(
+            self._map, offset, flags, len(key_data), len(value.data),
+            expiration)
+        data_start = offset + _RECORD_HEADER.size
+        self._map[data_start:data_start + len(key_data)] = key_data
+        value_start = data_start + len(key_data)
+        self._map[value_start:value_start + len(value.data)] = value.data
+
+        self._index[key_hash] = self._position
+        self._position += size
+        self.bytes_written += size
+        return True
+
+    # Removes the item from the tier and returns it, if it's there
+    def take(self, key: str) -> Optional[DiskItem]:
+        key_hash = hash(key)
+        position = self._index.get(key_hash)
+        if position is None:
+            return None
+
+        offset = position % self._size
+        flags, key_length, value_length, expiration =\
+            _RECORD_HEADER.unpack_from(self._map, offset)
+        key_start = offset + _RECORD_HEADER.size
+        value_start = key_start + key_length
+        if self._map[key_start:value_start] != key.encode():
+            # another key with the same hash
+            return None
+        del self._index[key_hash]
+        value = self._map[value_start:value_start + value_length]
+        return DiskItem(
+            StoredValue(value, bool(flags & _COMPRESSED_FLAG)), expiration)
+
+    # Forgets the item, its record is left to be overwritten
+    def remove(self, key: str) -> None:
+        key_hash = hash(key)
+        position = self._index.get(key_hash)
+        # the entry may belong to another key with the same hash
+        if position is not None and self._read_key(position) == key:
+            del self._index[key_hash]
+
+    def close(self) -> None:
+        self._map.close()
+
+    def _read_key(self, position: int) -> str:
+        offset = position % self._size
+        key_length = _RECORD_HEADER.unpack_from(self._map, offset)[1]
+        key_start = offset + _RECORD_HEADER.size
+        return self._map[key_start:key_start + key_length].decode()
+
+    def _dropped(self, key: str) -> None:
+        if self._on_dropped is not None:
+            self._on_dropped(key)
+
+    # Drops the index entries of the records which the writes up to the
+    # position overwrite, reading their keys before they are overwritten
+    def _drop_overwritten(self, position: int) -> None:
+        overwritten = min(position - self._size, self._position)
+        while self._tail < overwritten:
+            offset = self._tail % self._size
+            rest = self._size - offset
+            if rest < _RECORD_HEADER.size:
+                self._tail += rest
+                continue
+            flags, key_length, value_length, _ =\
+                _RECORD_HEADER.unpack_from(self._map, offset)
+            if flags & _PADDING_FLAG:
+                self._tail += rest
+                continue
+            key = self._read_key(self._tail)
+            if self._index.get(hash(key)) == self._tail:
+                del self._index[hash(key)]
+                self._dropped(key)
+            self._tail += _RECORD_HEADER.size + key_length + value_length
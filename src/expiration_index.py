@@ -0,0 +1,224 @@
+import heapq
+import time
+from typing import Dict, List, Tuple
+
+
+EXPIRATION_INDEX_HEAP = 'heap'
+EXPIRATION_INDEX_TIMING_WHEEL = 'timing_wheel'
+
+# the heap is not compacted while the number of its stale entries is small
+_MIN_STALE_ENTRIES_TO_COMPACT = 1024
+
+# duration of the timing wheel tick in nanoseconds (10ms below)
+_TICK = 10 * 1000 * 1000
+# number of slots on each level of the timing wheel, a power of 2
+_SLOT_BITS = 8
+_SLOTS_NUMBER = 1 << _SLOT_BITS
+_SLOT_MASK = _SLOTS_NUMBER - 1
+# with 4 levels the wheel covers 2^32 ticks, which is over a year,
+# items expiring later are kept aside until the wheel gets closer to them
+_LEVELS_NUMBER = 4
+
+
+class ExpirationIndex:
+    """
+    Tracks expiration timestamps (in nanoseconds) of the item keys
+    """
+
+    def add(self, key: str, expiration: int) -> None:
+        raise NotImplementedError
+
+    # Stops tracking the key, does nothing if it isn't tracked
+    def remove(self, key: str) -> None:
+        raise NotImplementedError
+
+    # Returns up to "limit" keys that are expired by the "now" timestamp,
+    # the returned keys are no longer tracked
+    def pop_expired(self, now: int, limit: int) -> List[str]:
+        raise NotImplementedError
+
+
+class HeapExpirationIndex(ExpirationIndex):
+    """
+    Binary heap ordered by expiration: O(log n) insertion.
+    Removed keys leave stale entries in the heap, which are skipped
+    and dropped once the heap is compacted.
+    """
+
+    def __init__(self) -> None:
+        # In this queue item keys that expire earlier go first
+        self._queue: List[Tuple[int, str]] = []
+        # Actual expiration of the tracked keys,
+        # queue entries that don't match it are stale
+        self._expirations: Dict[str, int] = {}
+
+    def add(self, key: str, expiration: int) -> None:
+        self._expirations[key] = expiration
+        heapq.heappush(self._queue, (expiration, key))
+
+    def remove(self, key: str) -> None:
+        self._expirations.pop(key, None)
+
+    def pop_expired(self, now: int, limit: int) -> List[str]:
+        queue = self._queue
+        expirations = self._expirations
+        result: List[str] = []
+        while len(queue) > 0 and len(result) < limit:
+            expiration, key = queue[0]
+            if expiration > now:
+                # all remaning items in the queue are not expiring
+                break
+            heapq.heappop(queue)
+            if expirations.get(key) == expiration:
+                del expirations[key]
+                result.append(key)
+        self._compact()
+        return result
+
+    # Rebuilds the queue without the stale entries
+    # once they outnumber the live ones
+    def _compact(self) -> None:
+        stale_entries_number = len(self._queue) - len(self._expirations)
+        if stale_entries_number < _MIN_STALE_ENTRIES_TO_COMPACT or\
+                stale_entries_number < len(self._expirations):
+            return
+        self._queue = [
+            (expiration, key) for key, expiration in self._expirations.items()
+        ]
+        heapq.heapify(self._queue)
+
+
+class TimingWheelExpirationIndex(ExpirationIndex):
+    """
+    Hierarchical timing wheel: O(1) insertion and removal,
+    expired keys are collected in batches per tick.
+    Level 0 has a slot per tick, each slot of a higher level
+    covers a whole revolution of the level below it. When the wheel
+    reaches a slot of a higher level, its keys are cascaded down.
+    Keys are returned at most one tick after their expiration.
+    """
+
+    def __init__(self) -> None:
+        # Each slot maps keys to their expiration
+        self._levels: List[List[Dict[str, int]]] = [
+            [{} for _ in range(_SLOTS_NUMBER)] for _ in range(_LEVELS_NUMBER)
+        ]
+        # Keys expiring beyond the range of the wheel
+        self._overflow: Dict[str, int] = {}
+        # Keys of the processed ticks, not returned yet due to the limit
+        self._expired: Dict[str, int] = {}
+        # Slot (or another dict above) holding each key
+        self._locations: Dict[str, Dict[str, int]] = {}
+        # All ticks before this one are processed
+        self._tick = time.time_ns() // _TICK
+
+    def add(self, key: str, expiration: int) -> None:
+        slot = self._locations.get(key)
+        if slot is not None:
+            del slot[key]
+        self._place(key, expiration)
+
+    def remove(self, key: str) -> None:
+        slot = self._locations.pop(key, None)
+        if slot is not None:
+            del slot[key]
+
+    def pop_expired(self, now: int, limit: int) -> List[str]:
+        expired = self._expired
+        if not self._locations:
+            # nothing to process, the wheel may jump to the current tick
+            self._tick = max(self._tick, now // _TICK)
+            return []
+
+        # the ticks that have fully passed
+        last_tick = now // _TICK
+        while len(expired) < limit:
+            self._skip_empty_ticks(last_tick)
+            if self._tick >= last_tick:
+                break
+            self._advance()
+
+        result: List[str] = []
+        for key in expired:
+            if len(result) >= limit:
+                break
+            result.append(key)
+        for key in result:
+            del expired[key]
+            del self._locations[key]
+        return result
+
+    def _place(self, key: str, expiration: int) -> None:
+        tick = expiration // _TICK
+        delta = tick - self._tick
+        if delta <= 0:
+            # expired already, handled along with the current tick
+            tick = self._tick
+            level = 0
+        else:
+            # the level covering the distance to the expiration tick
+            level = (delta.bit_length() - 1) // _SLOT_BITS
+        if level < _LEVELS_NUMBER:
+            index = (tick >> (_SLOT_BITS * level)) & _SLOT_MASK
+            slot = self._levels[level][index]
+        else:
+            slot = self._overflow
+        slot[key] = expiration
+        self._locations[key] = slot
+
+    # Processes the current tick and moves to the next one
+    def _advance(self) -> None:
+        tick = self._tick
+        # cascade the slots of higher levels reached by the wheel
+        for level in range(_LEVELS_NUMBER - 1, 0, -1):
+            if tick & ((1 << (_SLOT_BITS * level)) - 1) == 0:
+                index = (tick >> (_SLOT_BITS * level)) & _SLOT_MASK
+                self._cascade(self._levels[level], index)
+        if tick & ((1 << (_SLOT_BITS * _LEVELS_NUMBER)) - 1) == 0:
+            overflow = self._overflow
+            self._overflow = {}
+            for key, expiration in overflow.items():
+                self._place(key, expiration)
+
+        slot = self._levels[0][tick & _SLOT_MASK]
+        if slot:
+            self._levels[0][tick & _SLOT_MASK] = {}
+            expired = self._expired
+            locations = self._locations
+            for key, expiration in slot.items():
+                expired[key] = expiration
+                locations[key] = expired
+        self._tick = tick + 1
+
+    # Jumps over the ticks that have nothing to process:
+    # while the lower levels are empty, nothing happens
+    # until the wheel reaches the next slot of the lowest non-empty level
+    def _skip_empty_ticks(self, last_tick: int) -> None:
+        tick = self._tick
+        for level in range(_LEVELS_NUMBER):
+            if any(self._levels[level]):
+                break
+        else:
+            level = _LEVELS_NUMBER
+        if level == 0:
+            return
+        span_bits = _SLOT_BITS * level
+        if tick & ((1 << span_bits) - 1) != 0:
+            next_tick = ((tick >> span_bits) + 1) << span_bits
+            self._tick = min(next_tick, last_tick)
+
+    def _cascade(self, slots: List[Dict[str, int]], index: int) -> None:
+        slot = slots[index]
+        if not slot:
+            return
+        slots[index] = {}
+        for key, expiration in slot.items():
+            self._place(key, expiration)
+
+
+def create_expiration_index(name: str) -> ExpirationIndex:
+    if name == EXPIRATION_INDEX_HEAP:
+        return HeapExpirationIndex()
+    if name == EXPIRATION_INDEX_TIMING_WHEEL:
+        return TimingWheelExpirationIndex()
+    raise ValueError(f'Unknown expiration index: {name}')
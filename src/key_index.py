@@ -0,0 +1,123 @@
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
+
+
+# keys are split into segments by this delimiter, e.g. "user:42:profile"
+KEY_DELIMITER = ':'
+
+
+class _Node:
+    __slots__ = ('children', 'key')
+
+    def __init__(self) -> None:
+        self.children: Dict[str, '_Node'] = {}
+        # the key which ends at this node, if any
+        self.key: Optional[str] = None
+
+
+class PrefixIndex:
+    """
+    Trie of the keys split into segments by the delimiter, so that
+    the keys sharing a prefix share the nodes of its segments.
+    A prefix doesn't have to end at a delimiter: the children
+    of its last complete segment are matched by the rest of it.
+    """
+
+    def __init__(self) -> None:
+        self._root = _Node()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, key: str) -> None:
+        node = self._root
+        for segment in key.split(KEY_DELIMITER):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _Node()
+            node = child
+        if node.key is None:
+            node.key = key
+            self._size += 1
+
+    def remove(self, key: str) -> None:
+        path = [self._root]
+        segments = key.split(KEY_DELIMITER)
+        for segment in segments:
+            child = path[-1].children.get(segment)
+            if child is None:
+                return
+            path.append(child)
+        node = path[-1]
+        if node.key is None:
+            return
+        node.key = None
+        self._size -= 1
+        # the nodes left without keys are removed
+        for segment, parent in zip(reversed(segments), reversed(path[:-1])):
+            if node.key is not None or node.children:
+                break
+            del parent.children[segment]
+            node = parent
+
+    def find(self, prefix: str) -> List[str]:
+        *segments, partial = prefix.split(KEY_DELIMITER)
+        node = self._root
+        for segment in segments:
+            child = node.children.get(segment)
+            if child is None:
+                return []
+            node = child
+        keys: List[str] = []
+        stack = [
+            child for segment, child in node.children.items()
+            if segment.startswith(partial)
+        ]
+        while stack:
+            node = stack.pop()
+            if node.key is not None:
+                keys.append(node.key)
+            stack.extend(node.children.values())
+        return keys
+
+
+class TagIndex:
+    """
+    Tags attached to the keys, and the keys by each tag
+    """
+
+    def __init__(self) -> None:
+        self._tags: Dict[str, FrozenSet[str]] = {}
+        self._keys: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._tags)
+
+    # Replaces the tags of the key
+    def set_tags(self, key: str, tags: Iterable[str]) -> None:
+        self.remove(key)
+        tag_set = frozenset(tags)
+        if not tag_set:
+            return
+        self._tags[key] = tag_set
+        for tag in tag_set:
+            keys = self._keys.get(tag)
+            if keys is None:
+                keys = self._keys[tag] = set()
+            keys.add(key)
+
+    def get_tags(self, key: str) -> FrozenSet[str]:
+        return self._tags.get(key, frozenset())
+
+    def remove(self, key: str) -> None:
+        tags = self._tags.pop(key, None)
+        if tags is None:
+            return
+        for tag in tags:
+            keys = self._keys[tag]
+            keys.discard(key)
+            if not keys:
+                del self._keys[tag]
+
+    def find(self, tag: str) -> List[str]:
+        return list(self._keys.get(tag, ()))
@@ -0,0 +1,64 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from config import LEASE_TIMEOUT
+
+
+_NANOSECONDS_IN_SECOND = 1000 * 1000 * 1000
+
+
+class LeaseTable:
+    """
+    Leases on the missing items: the first client which misses an item
+    gets a lease token and is expected to fill the item, the others
+    are told to wait meanwhile instead of regenerating it as well.
+    A lease is released once the item is filled, invalidated by any
+    other change of the item, and expires after the timeout in case
+    its holder never fills the item.
+    """
+
+    def __init__(self, timeout: int = LEASE_TIMEOUT) -> None:
+        self._timeout = timeout * _NANOSECONDS_IN_SECOND
+        # (token, deadline) by the key, in the order of the deadlines,
+        # since all leases have the same timeout
+        self._leases: 'OrderedDict[str, Tuple[int, int]]' = OrderedDict()
+        # tokens are unique across restarts as well
+        self._last_token = time.time_ns()
+
+    def __len__(self) -> int:
+        return len(self._leases)
+
+    # Returns the token of a new lease on the key,
+    # or None if another client holds the lease
+    def acquire(self, key: str) -> Optional[int]:
+        now = time.monotonic_ns()
+        self._remove_expired(now)
+        if key in self._leases:
+            return None
+        self._last_token += 1
+        self._leases[key] = (self._last_token, now + self._timeout)
+        return self._last_token
+
+    # Releases the lease on the key,
+    # returns whether the token was the one of the valid lease
+    def release(self, key: str, token: int) -> bool:
+        self._remove_expired(time.monotonic_ns())
+        lease = self._leases.get(key)
+        if lease is None or lease[0] != token:
+            return False
+        del self._leases[key]
+        return True
+
+    # The item has changed, so the value its lease holder
+    # has been generating may be outdated
+    def invalidate(self, key: str) -> None:
+        self._leases.pop(key, None)
+
+    def _remove_expired(self, now: int) -> None:
+        leases = self._leases
+        while leases:
+            key, (_, deadline) = next(iter(leases.items()))
+            if deadline > now:
+                break
+            del leases[key]
@@ -1,7 +1,11 @@
+import argparse
 import sys
-from typing import Type
+from multiprocessing import Process
+from typing import Type, List, Optional, Tuple
 from types import TracebackType
 
+from config import WORKERS, PORT, REPLICA_OF
+from replication import parse_address
 from server import Server
 
 
@@ -24,9 +28,52 @@ def _patch_uncaught_exception_hook() -> None:
     sys.excepthook = _handle_exception
 
 
+def _run_worker(
+        shard_index: int,
+        port: int,
+        replica_of: Optional[Tuple[str, int]]
+) -> None:
+    _patch_uncaught_exception_hook()
+    Server(shard_index, port, replica_of).run()
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Run the cache server.')
+    parser.add_argument(
+        '--port', type=int, default=PORT,
+        help='port of the first worker (default: PORT of the configuration)')
+    parser.add_argument(
+        '--replica-of', type=parse_address, default=REPLICA_OF,
+        metavar='HOST:PORT',
+        help='run as a read-only replica of the primary, '
+             'which streams the changes on this port')
+    return parser.parse_args()
+
+
 def main() -> int:
-    server = Server()
-    server.run()
+    args = _parse_args()
+    if WORKERS <= 1:
+        server = Server(port=args.port, replica_of=args.replica_of)
+        server.run()
+        return 0
+
+    # every worker process owns a shard of the keyspace
+    workers: List[Process] = [
+        Process(target=_run_worker,
+                args=(index, args.port, args.replica_of))
+        for index in range(WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        # workers save their snapshots before exiting
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
     return 0
 
 
@@ -0,0 +1,125 @@
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+from responses import Buffer
+
+
+# upper bounds of the latency histogram buckets in nanoseconds,
+# the last bucket takes the rest
+_LATENCY_BUCKETS = (
+    10_000, 25_000, 50_000, 100_000, 250_000, 500_000,
+    1_000_000, 2_500_000, 5_000_000, 10_000_000, 100_000_000
+)
+_NANOSECONDS_IN_MICROSECOND = 1000
+_NANOSECONDS_IN_SECOND = 1000 * 1000 * 1000
+
+
+class LatencyHistogram:
+    """
+    Counts durations in fixed buckets,
+    recording a sample doesn't allocate any objects
+    """
+
+    def __init__(self) -> None:
+        self._counts = array('Q', bytes(8 * (len(_LATENCY_BUCKETS) + 1)))
+        self.count = 0
+        # sum of all durations in nanoseconds
+        self.total = 0
+
+    def record(self, duration: int) -> None:
+        self._counts[bisect_left(_LATENCY_BUCKETS, duration)] += 1
+        self.count += 1
+        self.total += duration
+
+    # Returns the upper bound of the bucket holding the given percentile
+    # in microseconds, the samples beyond the last bucket are reported
+    # at its bound
+    def get_percentile(self, percentile: float) -> int:
+        rank = self.count * percentile / 100
+        last_index = len(_LATENCY_BUCKETS) - 1
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank and count > 0:
+                bound = _LATENCY_BUCKETS[min(index, last_index)]
+                return bound // _NANOSECONDS_IN_MICROSECOND
+        return 0
+
+    # Cumulative counts by the bucket bounds in seconds,
+    # the last bound is infinity
+    def get_buckets(self) -> List[Tuple[float, int]]:
+        result = []
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            bound = _LATENCY_BUCKETS[index] / _NANOSECONDS_IN_SECOND\
+                if index < len(_LATENCY_BUCKETS) else float('inf')
+            result.append((bound, seen))
+        return result
+
+
+class ServerMetrics:
+    """
+    Counters of the server and the command latency histograms
+    """
+
+    def __init__(self) -> None:
+        self.connections = 0
+        self.total_connections = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        # by the command name, created on the first execution
+        self.latencies: Dict[str, LatencyHistogram] = {}
+
+    def record_latency(self, command: str, duration: int) -> None:
+        histogram = self.latencies.get(command)
+        if histogram is None:
+            histogram = self.latencies[command] = LatencyHistogram()
+        histogram.record(duration)
+
+    def record_sent(self, buffers: Iterable[Buffer]) -> None:
+        self.bytes_sent += sum(map(len, buffers))
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = {
+            'connections': self.connections,
+            'total_connections': self.total_connections,
+            'bytes_received': self.bytes_received,
+            'bytes_sent': self.bytes_sent,
+        }
+        for command, histogram in self.latencies.items():
+            stats[f'{command}_count'] = histogram.count
+            stats[f'{command}_p50_us'] = histogram.get_percentile(50)
+            stats[f'{command}_p99_us'] = histogram.get_percentile(99)
+        return stats
+
+
+# Formats the statistics in the Prometheus text exposition format,
+# each metric is labeled with the shard of the server
+def format_metrics(
+        cache_stats: Dict[str, int], metrics: ServerMetrics, shard: int
+) -> str:
+    label = f'shard="{shard}"'
+    lines = []
+    for name, value in cache_stats.items():
+        lines.append(f'cache_{name}{{{label}}} {value}')
+    lines.append(f'cache_connections{{{label}}} {metrics.connections}')
+    lines.append(
+        f'cache_connections_total{{{label}}} {metrics.total_connections}')
+    lines.append(
+        f'cache_received_bytes_total{{{label}}} {metrics.bytes_received}')
+    lines.append(f'cache_sent_bytes_total{{{label}}} {metrics.bytes_sent}')
+
+    name = 'cache_command_duration_seconds'
+    lines.append(f'# TYPE {name} histogram')
+    for command, histogram in metrics.latencies.items():
+        command_label = f'{label},command="{command}"'
+        for bound, count in histogram.get_buckets():
+            bound_text = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(
+                f'{name}_bucket{{{command_label},le="{bound_text}"}} {count}')
+        lines.append(f'{name}_sum{{{command_label}}} '
+                     f'{histogram.total / _NANOSECONDS_IN_SECOND}')
+        lines.append(f'{name}_count{{{command_label}}} {histogram.count}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,96 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Tuple, TypeVar
+
+from config import OFFLOAD_THREADS, MAX_IN_FLIGHT_BYTES
+
+
+_Result = TypeVar('_Result')
+
+
+class OffloadScheduler:
+    """
+    Runs the heavy processing of large values in a bounded thread pool,
+    so that the event loop keeps serving small requests meanwhile.
+    The total size of the values being received and processed is limited:
+    the values are admitted in the order of arrival once they fit
+    in the limit. Each connection waits for its own value to be processed
+    before taking the next one, so the connections take turns.
+    """
+
+    def __init__(
+            self,
+            threads: int = OFFLOAD_THREADS,
+            max_in_flight_bytes: int = MAX_IN_FLIGHT_BYTES
+    ) -> None:
+        self._executor = ThreadPoolExecutor(
+            threads, thread_name_prefix='offload')
+        self._max_in_flight_bytes = max_in_flight_bytes
+        self.in_flight_bytes = 0
+        # sizes of the values waiting for admission with their waiters
+        self._waiting: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    # Waits until the value of the given size fits in the limit,
+    # a value larger than the limit is admitted alone
+    async def acquire(self, size: int) -> None:
+        if not self._waiting and self._fits(size):
+            self.in_flight_bytes += size
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (size, waiter)
+        self._waiting.append(entry)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                # the values behind it may fit now
+                self._admit_waiting()
+            else:
+                # admitted right before the cancellation
+                self.release(size)
+            raise
+
+    def release(self, size: int) -> None:
+        self.in_flight_bytes -= size
+        self._admit_waiting()
+
+    # Runs the function in the thread pool, the values must be admitted
+    async def run(
+            self, function: Callable[..., _Result], *args: Any
+    ) -> _Result:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, function, *args)
+
+    # Admits the value and runs the function on it in the thread pool,
+    # the result may be awaited or handled by a callback
+    def submit(
+            self, function: Callable[[bytes], _Result], value: bytes
+    ) -> 'asyncio.Task[_Result]':
+        return asyncio.ensure_future(self._submit(function, value))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _submit(
+            self, function: Callable[[bytes], _Result], value: bytes
+    ) -> _Result:
+        await self.acquire(len(value))
+        try:
+            return await self.run(function, value)
+        finally:
+            self.release(len(value))
+
+    def _admit_waiting(self) -> None:
+        waiting = self._waiting
+        while waiting and self._fits(waiting[0][0]):
+            size, waiter = waiting.popleft()
+            if not waiter.cancelled():
+                self.in_flight_bytes += size
+                waiter.set_result(None)
+
+    def _fits(self, size: int) -> bool:
+        return self.in_flight_bytes == 0 or\
+            self.in_flight_bytes + size <= self._max_in_flight_bytes
@@ -0,0 +1,518 @@
+import asyncio
+import gc
+import mmap
+import os
+import signal
+import struct
+import threading
+import time
+import traceback
+import warnings
+from typing import BinaryIO, Dict, FrozenSet, Iterable, Iterator, List,\
+    NamedTuple, Optional, Tuple
+
+from cache import Cache
+from commands import TAG_SEPARATOR
+from server_logging import logger
+
+
+# Records describe changes of the cache items:
+# a stored item (with its absolute expiration and tags) or a deleted one
+OPERATION_SET = 1
+OPERATION_DELETE = 2
+
+# policies of syncing the append-only log to the disk:
+# after every group of written records, once a second, or never
+# (left to the operating system)
+FSYNC_ALWAYS = 'always'
+FSYNC_EVERY_SECOND = 'everysec'
+FSYNC_NO = 'no'
+
+# operation, key size, value size, tags size,
+# expiration timestamp in nanoseconds;
+# the header is followed by the key, the value and the tags
+RECORD_HEADER = struct.Struct('<BIIIq')
+
+# size of the write buffer of the record files
+_WRITE_BUFFER_SIZE = 1024 * 1024
+
+# snapshot file starts with this marker, followed by the item records
+SNAPSHOT_HEADER = b'CACHE-SNAPSHOT-2\r\n'
+# same for the append-only log
+_LOG_HEADER = b'CACHE-LOG-2\r\n'
+
+# the log is rewritten once it grows this many times
+# since the previous rewrite
+_LOG_REWRITE_GROWTH_FACTOR = 2
+# seconds between the syncs of the log with the "everysec" policy
+_LOG_SYNC_INTERVAL = 1.0
+
+
+# Items in the form they are persisted: (key, value, expiration, tags)
+Item = Tuple[str, bytes, int, FrozenSet[str]]
+
+
+class Record(NamedTuple):
+    operation: int
+    key: str
+    value: bytes
+    expiration: int
+    tags: FrozenSet[str] = frozenset()
+
+
+class CorruptedFileException(Exception):
+    """
+    Holds the number of the complete records read before the corruption
+    """
+
+    def __init__(self, message: str, records: int = 0) -> None:
+        super().__init__(message)
+        self.records = records
+
+
+def encode_record(record: Record) -> bytes:
+    key_data = record.key.encode()
+    tags_data = encode_tags(record.tags)
+    return RECORD_HEADER.pack(
+        record.operation, len(key_data), len(record.value), len(tags_data),
+        record.expiration
+    ) + key_data + record.value + tags_data
+
+
+def write_set_record(
+        file: BinaryIO,
+        key: str,
+        value: bytes,
+        expiration: int,
+        tags: FrozenSet[str]
+) -> None:
+    key_data = key.encode()
+    tags_data = encode_tags(tags)
+    file.write(RECORD_HEADER.pack(
+        OPERATION_SET, len(key_data), len(value), len(tags_data), expiration))
+    file.write(key_data)
+    file.write(value)
+    file.write(tags_data)
+
+
+# Tags are stored in the same comma-separated form as they are set
+def encode_tags(tags: FrozenSet[str]) -> bytes:
+    return TAG_SEPARATOR.join(sorted(tags)).encode()
+
+
+def decode_tags(data: bytes) -> FrozenSet[str]:
+    if not data:
+        return frozenset()
+    return frozenset(data.decode().split(TAG_SEPARATOR))
+
+
+def open_for_writing(path: str) -> BinaryIO:
+    return open(path, 'wb', buffering=_WRITE_BUFFER_SIZE)
+
+
+# Flushes the file to the disk and replaces the target file with it,
+# so that readers never see a partially written file
+def commit_file(file: BinaryIO, target_path: str) -> None:
+    file.flush()
+    os.fsync(file.fileno())
+    file.close()
+    os.replace(file.name, target_path)
+
+
+# Reads records one by one from a memory-mapped file, which must start
+# with the given header. Each record is returned with the offset
+# of its end. A truncated record at the end of the file
+# (e.g. after a crash during writing) stops the reading,
+# a broken one raises CorruptedFileException.
+def read_records(
+        path: str, header: bytes = b'') -> Iterator[Tuple[Record, int]]:
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            if header:
+                raise CorruptedFileException(f'{path} is empty')
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data,\
+                memoryview(data) as view:
+            if view[:len(header)] != header:
+                raise CorruptedFileException(f'{path} has unexpected header')
+            position = len(header)
+            end = len(view)
+            header_size = RECORD_HEADER.size
+            records = 0
+            while position + header_size <= end:
+                operation, key_size, value_size, tags_size, expiration =\
+                    RECORD_HEADER.unpack_from(view, position)
+                key_start = position + header_size
+                value_start = key_start + key_size
+                value_end = value_start + value_size
+                tags_end = value_end + tags_size
+                if tags_end > end:
+                    break
+                if operation not in (OPERATION_SET, OPERATION_DELETE):
+                    raise CorruptedFileException(
+                        f'{path} has unknown operation at {position}',
+                        records)
+                try:
+                    record = Record(
+                        operation,
+                        str(view[key_start:value_start], 'utf-8'),
+                        bytes(view[value_start:value_end]),
+                        expiration,
+                        decode_tags(bytes(view[value_end:tags_end]))
+                    )
+                except UnicodeDecodeError:
+                    raise CorruptedFileException(
+                        f'{path} has undecodable record at {position}',
+                        records)
+                yield record, tags_end
+                records += 1
+                position = tags_end
+
+
+# Snapshot is a file with records of all unexpired items,
+# ordered from the least to the most recently used one
+
+# Writes the snapshot synchronously, returns the number of saved items
+def save_snapshot(cache: Cache, path: str) -> int:
+    return _write_items(cache.iter_items(), path, SNAPSHOT_HEADER)
+
+
+# Writes the snapshot without blocking the event loop
+async def save_snapshot_in_background(cache: Cache, path: str) -> None:
+    await _write_items_in_background(cache, path, SNAPSHOT_HEADER)
+
+
+# Loads the snapshot into the cache skipping the expired items,
+# returns the numbers of loaded and skipped items
+def load_snapshot(cache: Cache, path: str) -> Tuple[int, int]:
+    loaded = 0
+    skipped = 0
+    for record, _ in read_records(path, SNAPSHOT_HEADER):
+        if record.operation == OPERATION_SET and\
+                cache.restore_item(record.key, record.value,
+                                   record.expiration, record.tags):
+            loaded += 1
+        else:
+            skipped += 1
+    return loaded, skipped
+
+
+class ChangeLog:
+    """
+    Receives the changes of the items made by the commands
+    """
+
+    # The item is recorded after it's stored, with the expiration
+    # timestamp of the stored item, so that it expires at the same time,
+    # and with its tags
+    def record_set(
+            self,
+            key: str,
+            value: bytes,
+            expiration: int,
+            tags: FrozenSet[str] = frozenset()
+    ) -> None:
+        raise NotImplementedError
+
+    def record_delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class ChangeLogs(ChangeLog):
+    """
+    Passes the changes to all of the given logs
+    """
+
+    def __init__(self, logs: List[ChangeLog]) -> None:
+        self._logs = logs
+
+    def record_set(
+            self,
+            key: str,
+            value: bytes,
+            expiration: int,
+            tags: FrozenSet[str] = frozenset()
+    ) -> None:
+        for log in self._logs:
+            log.record_set(key, value, expiration, tags)
+
+    def record_delete(self, key: str) -> None:
+        for log in self._logs:
+            log.record_delete(key)
+
+
+class AppendOnlyLog(ChangeLog):
+    """
+    Log of the item changes, replayed on startup.
+    Records are queued by the event loop and written in groups
+    by a background thread, which syncs the file to the disk
+    according to the fsync policy.
+    The log is rewritten from the cache contents once it grows
+    far beyond the size of the live items, or once writing it failed
+    and some of the changes are lost.
+    """
+
+    # A new log starts with the items already in the cache
+    def __init__(
+            self,
+            cache: Cache,
+            path: str,
+            fsync_policy: str,
+            rewrite_min_size: int
+    ) -> None:
+        if fsync_policy not in (FSYNC_ALWAYS, FSYNC_EVERY_SECOND, FSYNC_NO):
+            raise ValueError(f'Unknown fsync policy: {fsync_policy}')
+        self._path = path
+        self._fsync_policy = fsync_policy
+        self._rewrite_min_size = rewrite_min_size
+        if not os.path.exists(path):
+            _write_items(cache.iter_items(), path, _LOG_HEADER)
+        self._file = open(path, 'ab')
+        self._size = self._file.tell()
+        # size of the log right after the last rewrite
+        self._base_size = self._size
+
+        self._condition = threading.Condition()
+        # records not written yet
+        self._pending: List[Record] = []
+        # records made during the rewrite, they are appended
+        # to the rewritten log
+        self._rewrite_records: Optional[List[Record]] = None
+        # rewritten log waiting to replace the current one
+        self._rewritten_path: Optional[str] = None
+        self._closing = False
+        # number of failed writes, the log is incomplete after each of them
+        # until it's rewritten
+        self._errors = 0
+        self._incomplete = False
+        self._thread = threading.Thread(
+            target=self._write_records, daemon=True)
+        self._thread.start()
+
+    def record_set(
+            self,
+            key: str,
+            value: bytes,
+            expiration: int,
+            tags: FrozenSet[str] = frozenset()
+    ) -> None:
+        self._add(Record(OPERATION_SET, key, value, expiration, tags))
+
+    def record_delete(self, key: str) -> None:
+        self._add(Record(OPERATION_DELETE, key, b'', 0))
+
+    def is_rewrite_needed(self) -> bool:
+        return self._rewrite_records is None and (
+            self._incomplete or (
+                self._size >= self._rewrite_min_size and
+                self._size >= self._base_size * _LOG_REWRITE_GROWTH_FACTOR))
+
+    def get_stats(self) -> Dict[str, int]:
+        return {'append_log_errors': self._errors}
+
+    # Rewrites the log from the cache contents without blocking
+    # the event loop, the changes made meanwhile are appended to it
+    async def rewrite(self, cache: Cache) -> None:
+        rewritten_path = f'{self._path}.rewrite'
+        with self._condition:
+            self._rewrite_records = []
+        try:
+            await _write_items_in_background(
+                cache, rewritten_path, _LOG_HEADER)
+        except BaseException:
+            with self._condition:
+                self._rewrite_records = None
+            _remove_file(rewritten_path)
+            raise
+        with self._condition:
+            self._rewritten_path = rewritten_path
+            self._condition.notify()
+
+    # Writes the remaining records and stops the writer thread
+    def close(self) -> None:
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._thread.join()
+        self._file.close()
+
+    def _add(self, record: Record) -> None:
+        with self._condition:
+            self._pending.append(record)
+            if self._rewrite_records is not None:
+                self._rewrite_records.append(record)
+            self._condition.notify()
+
+    def _write_records(self) -> None:
+        last_sync = time.monotonic()
+        unsynced = False
+        while True:
+            with self._condition:
+                if not self._pending and not self._closing and\
+                        self._rewritten_path is None:
+                    self._condition.wait(_LOG_SYNC_INTERVAL)
+                records, self._pending = self._pending, []
+                rewritten_path = self._rewritten_path
+                rewrite_records = self._rewrite_records
+                if rewritten_path is not None:
+                    self._rewritten_path = None
+                    self._rewrite_records = None
+                closing = self._closing
+
+            try:
+                unsynced = self._write_group(
+                    records, rewritten_path, rewrite_records, unsynced)
+                now = time.monotonic()
+                if unsynced and (
+                        closing or self._fsync_policy == FSYNC_ALWAYS or (
+                            self._fsync_policy == FSYNC_EVERY_SECOND and
+                            now - last_sync >= _LOG_SYNC_INTERVAL)):
+                    os.fsync(self._file.fileno())
+                    last_sync = now
+                    unsynced = False
+            except Exception as e:
+                # the thread keeps running, the lost changes are restored
+                # by the rewrite of the log
+                logger.error('Failed to write append-only log %s: %s',
+                             self._path, e)
+                self._errors += 1
+                self._incomplete = True
+            if closing:
+                break
+
+    # Returns whether the file has unsynced data
+    def _write_group(
+            self,
+            records: List[Record],
+            rewritten_path: Optional[str],
+            rewrite_records: Optional[List[Record]],
+            unsynced: bool
+    ) -> bool:
+        if records:
+            data = b''.join(map(encode_record, records))
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            unsynced = True
+        if rewritten_path is not None:
+            assert rewrite_records is not None
+            self._replace_file(rewritten_path, rewrite_records)
+            unsynced = False
+        return unsynced
+
+    # Replaces the log with the rewritten one,
+    # completed with the records made during the rewrite
+    def _replace_file(self, path: str, records: List[Record]) -> None:
+        with open(path, 'ab') as file:
+            file.write(b''.join(map(encode_record, records)))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path, self._path)
+        # the rewritten log is made from the cache contents,
+        # so it includes the changes that failed to be written before
+        self._incomplete = False
+        self._file.close()
+        self._file = open(self._path, 'ab')
+        self._size = self._file.tell()
+        self._base_size = self._size
+
+
+# Applies the log records to the cache, returns the number of records.
+# The incomplete record at the end of the log is cut off,
+# so that the new records follow the complete ones.
+def replay_append_log(cache: Cache, path: str) -> int:
+    count = 0
+    end = len(_LOG_HEADER)
+    for record, end in read_records(path, _LOG_HEADER):
+        if record.operation != OPERATION_SET or not cache.restore_item(
+                record.key, record.value, record.expiration, record.tags):
+            # the expired item replaces the previous one as well
+            cache.delete_item(record.key)
+        count += 1
+    if os.path.getsize(path) > end:
+        os.truncate(path, end)
+    return count
+
+
+# Writes the items without blocking the event loop:
+# a forked child process writes the copy-on-write image of the cache.
+# Where fork is unavailable, the items are collected at once
+# and written by a thread.
+# The other threads of the server may hold their locks at the fork,
+# which stay locked in the child. So the child takes none of them:
+# the cache and the written file are used by the event loop thread only,
+# the child doesn't log and reports its failure straight to the stderr
+# descriptor, bypassing the lock of sys.stderr.
+async def _write_items_in_background(
+        cache: Cache, path: str, header: bytes) -> None:
+    loop = asyncio.get_running_loop()
+    if not hasattr(os, 'fork'):
+        items = list(cache.iter_items())
+        await loop.run_in_executor(None, _write_items, items, path, header)
+        return
+
+    with warnings.catch_warnings():
+        # the fork with the threads running is safe as described above
+        warnings.simplefilter('ignore', DeprecationWarning)
+        pid = os.fork()
+    if pid == 0:
+        _run_writer_child(cache, path, header)
+    try:
+        _, status = await loop.run_in_executor(None, os.waitpid, pid, 0)
+    except asyncio.CancelledError:
+        # the server is shutting down, the file is written
+        # synchronously instead, so the outdated one is dropped
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        _remove_file(_get_temporary_path(path, pid))
+        raise
+    if status != 0:
+        raise RuntimeError(f'Writer process failed with status {status}')
+
+
+def _run_writer_child(cache: Cache, path: str, header: bytes) -> None:
+    status = 1
+    try:
+        # the finalizers of the parent objects may take their locks,
+        # and the collection would copy the shared pages
+        gc.disable()
+        # signals are meant for the parent server process
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        _write_items(cache.iter_items(), path, header)
+        status = 0
+    except BaseException:
+        os.write(2, traceback.format_exc().encode())
+    finally:
+        # skip the cleanup of the inherited server state
+        os._exit(status)
+
+
+# Writes a file of set records, returns the number of written items
+def _write_items(items: Iterable[Item], path: str, header: bytes) -> int:
+    file = open_for_writing(_get_temporary_path(path, os.getpid()))
+    try:
+        file.write(header)
+        count = 0
+        for key, value, expiration, tags in items:
+            write_set_record(file, key, value, expiration, tags)
+            count += 1
+        commit_file(file, path)
+    except BaseException:
+        file.close()
+        _remove_file(file.name)
+        raise
+    return count
+
+
+# Each writer uses its own temporary file
+def _get_temporary_path(path: str, pid: int) -> str:
+    return f'{path}.{pid}.{threading.get_ident()}.tmp'
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,129 @@
+from typing import List, Optional, Tuple, Union
+
+from commands import Command, CommandPipeline
+from command_parser import parse_command, get_declared_attachment_size,\
+    CommandOrError
+from config import MAX_MESSAGE_SIZE
+from protocol import SEPARATOR_BINARY
+from server_utils import MalformedMessageException, build_error_message
+
+
+class PipelineBuffer:
+    """
+    Accumulates raw bytes received in the pipelined mode
+    and splits them into complete commands.
+    In this mode the value of a set command follows its header inline,
+    without waiting for the "Send N bytes" prompt, so the value
+    of a rejected header is skipped. Out of the pipelined mode
+    the client sends no value after the error, the buffer switches
+    to the pipelined mode once it parses the "pipeline" command.
+    """
+
+    def __init__(self, pipelined: bool = False) -> None:
+        self._buffer = bytearray()
+        self._pipelined = pipelined
+        # command which header is parsed, but attachment is not received yet
+        self._pending: Optional[Command] = None
+        # error of the rejected header with the size of its value
+        # which is not received yet
+        self._rejected: Optional[Tuple[CommandOrError, int]] = None
+
+    def feed(self, data: Union[bytes, memoryview]) -> None:
+        self._buffer += data
+
+    # Command which header is parsed, but the attachment is not received
+    def get_pending_command(self) -> Optional[Command]:
+        return self._pending
+
+    # Returns all commands (or errors) that can be completely parsed
+    # from the received data, the incomplete tail is kept for later
+    def pop_commands(self) -> List[CommandOrError]:
+        buffer = self._buffer
+        separator_length = len(SEPARATOR_BINARY)
+        result: List[CommandOrError] = []
+        position = 0
+
+        while True:
+            pending = self._pending
+            if pending is not None:
+                end = position + pending.get_attachment_size()
+                if len(buffer) < end + separator_length:
+                    break
+                if buffer[end:end + separator_length] != SEPARATOR_BINARY:
+                    raise MalformedMessageException()
+                # copy the payload out of the buffer only once
+                with memoryview(buffer) as view:
+                    pending.set_bytes_attachment(bytes(view[position:end]))
+                if not pending.is_attachment_valid():
+                    raise MalformedMessageException()
+                result.append(CommandOrError(command=pending))
+                self._pending = None
+                position = end + separator_length
+                continue
+
+            rejected = self._rejected
+            if rejected is not None:
+                error, size = rejected
+                end = position + size
+                if len(buffer) < end + separator_length:
+                    break
+                if buffer[end:end + separator_length] != SEPARATOR_BINARY:
+                    raise MalformedMessageException()
+                result.append(error)
+                self._rejected = None
+                position = end + separator_length
+                continue
+
+            end = buffer.find(SEPARATOR_BINARY, position)
+            if end < 0:
+                if len(buffer) - position > MAX_MESSAGE_SIZE:
+                    raise MalformedMessageException()
+                break
+            line = bytes(buffer[position:end])
+            position = end + separator_length
+
+            try:
+                message = line.decode()
+            except ValueError:
+                error = CommandOrError(error=build_error_message(
+                    'failed to decode message', fatal=False))
+                if self._pipelined:
+                    # the header still declares the size of its value
+                    self._reject(
+                        error, line.decode(errors='replace'), result)
+                else:
+                    result.append(error)
+                continue
+            if len(message.strip()) == 0:
+                # ignore empty messages
+                continue
+
+            command_or_error = parse_command(message)
+            command = command_or_error.command
+            if command is not None and command.has_attachment():
+                self._pending = command
+            elif command is None and self._pipelined:
+                self._reject(command_or_error, message, result)
+            else:
+                if isinstance(command, CommandPipeline):
+                    self._pipelined = True
+                result.append(command_or_error)
+
+        del buffer[:position]
+        return result
+
+    # The error is returned once the value of the rejected header
+    # is skipped, a value over the size limit breaks the framing
+    def _reject(
+            self,
+            error: CommandOrError,
+            message: str,
+            result: List[CommandOrError]
+    ) -> None:
+        size = get_declared_attachment_size(message)
+        if size is None:
+            result.append(error)
+        elif size > MAX_MESSAGE_SIZE:
+            raise MalformedMessageException()
+        else:
+            self._rejected = (error, size)
@@ -0,0 +1,67 @@
+import cProfile
+import tracemalloc
+from typing import Optional
+
+
+PROFILE_CPU = 'cpu'
+PROFILE_MEMORY = 'memory'
+
+# number of frames kept for each traced memory allocation
+_MEMORY_TRACE_DEPTH = 10
+# number of the allocation sites written to the memory report
+_MEMORY_REPORT_SIZE = 50
+
+
+class Profiler:
+    """
+    Collects a CPU or memory profile of the running server on demand.
+    The CPU profile covers the thread which has started it, that is
+    the event loop, where all commands are executed.
+    Both profilers slow the server down noticeably while they run.
+    """
+
+    def __init__(self, path: str) -> None:
+        # prefix of the files the profiles are written to
+        self._path = path
+        self._cpu_profile: Optional[cProfile.Profile] = None
+
+    def is_running(self, kind: str) -> bool:
+        if kind == PROFILE_CPU:
+            return self._cpu_profile is not None
+        return tracemalloc.is_tracing()
+
+    # Returns False if the profiler is already running
+    def start(self, kind: str) -> bool:
+        if self.is_running(kind):
+            return False
+        if kind == PROFILE_CPU:
+            self._cpu_profile = cProfile.Profile()
+            self._cpu_profile.enable()
+        else:
+            tracemalloc.start(_MEMORY_TRACE_DEPTH)
+        return True
+
+    # Stops the profiler and writes its results to a file,
+    # returns the path of the file or None if it hasn't been running.
+    # The CPU profile is written in the pstats format, the memory one
+    # lists the allocation sites holding the most memory.
+    def stop(self, kind: str) -> Optional[str]:
+        if not self.is_running(kind):
+            return None
+        if kind == PROFILE_CPU:
+            profile = self._cpu_profile
+            assert profile is not None
+            profile.disable()
+            self._cpu_profile = None
+            path = f'{self._path}.cpu.prof'
+            profile.dump_stats(path)
+            return path
+
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        statistics = snapshot.statistics('lineno')
+        path = f'{self._path}.memory.txt'
+        with open(path, 'w') as file:
+            for statistic in statistics[:_MEMORY_REPORT_SIZE]:
+                file.write(f'{statistic}\n')
+        return path
@@ -0,0 +1,244 @@
+import asyncio
+import os
+import tempfile
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from cache import Cache
+from compression import StoredValue
+from config import REPLICATION_BACKLOG_SIZE
+from offload import OffloadScheduler
+from persistence import ChangeLog, Record, encode_record,\
+    save_snapshot_in_background, decode_tags, RECORD_HEADER,\
+    SNAPSHOT_HEADER, OPERATION_SET, OPERATION_DELETE
+from server_logging import logger
+
+
+# Besides the changes of the items, the stream carries the records
+# marking the end of the initial sync and the heartbeats.
+# Both of them hold the time they were sent by the primary,
+# in nanoseconds, in place of the expiration.
+_OPERATION_SYNCED = 3
+_OPERATION_HEARTBEAT = 4
+
+# seconds between the heartbeats, the lag is measured by them
+_HEARTBEAT_INTERVAL = 0.1
+# seconds between the attempts to connect to the primary
+_RECONNECT_INTERVAL = 1.0
+_NANOSECONDS_IN_MILLISECOND = 1000 * 1000
+# reported while the replica isn't in sync with the primary
+_UNKNOWN_LAG = -1
+
+
+def _encode_marker(operation: int) -> bytes:
+    return encode_record(Record(operation, '', b'', time.time_ns()))
+
+
+class _ReplicaConnection:
+    """
+    Changes waiting to be sent to a single replica
+    """
+
+    def __init__(self) -> None:
+        self.pending: List[bytes] = []
+        self.pending_size = 0
+        self.changed = asyncio.Event()
+
+    def add(self, data: bytes) -> None:
+        self.pending.append(data)
+        self.pending_size += len(data)
+        self.changed.set()
+
+    def take(self) -> List[bytes]:
+        pending, self.pending = self.pending, []
+        self.pending_size = 0
+        self.changed.clear()
+        return pending
+
+
+class ReplicationSource(ChangeLog):
+    """
+    Primary side of the replication. A connected replica first gets
+    a snapshot of the cache, written by a forked process, and then
+    the stream of the changes made since the fork, with the expiration
+    of the items as absolute timestamps. The replicas which fall
+    more than "backlog_size" bytes behind are disconnected,
+    they reconnect and sync again.
+    """
+
+    def __init__(self, backlog_size: int = REPLICATION_BACKLOG_SIZE) -> None:
+        self._backlog_size = backlog_size
+        self._replicas: List[_ReplicaConnection] = []
+
+    def get_stats(self) -> Dict[str, int]:
+        return {'replicas': len(self._replicas)}
+
+    def record_set(
+            self,
+            key: str,
+            value: bytes,
+            expiration: int,
+            tags: FrozenSet[str] = frozenset()
+    ) -> None:
+        if self._replicas:
+            self._add(encode_record(
+                Record(OPERATION_SET, key, value, expiration, tags)))
+
+    def record_delete(self, key: str) -> None:
+        if self._replicas:
+            self._add(encode_record(Record(OPERATION_DELETE, key, b'', 0)))
+
+    # Serves the connected replica until it disconnects
+    async def serve_replica(
+            self,
+            cache: Cache,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter
+    ) -> None:
+        replica = _ReplicaConnection()
+        # the changes are collected from the moment of the fork
+        self._replicas.append(replica)
+        descriptor, path = tempfile.mkstemp(suffix='.snapshot')
+        os.close(descriptor)
+        try:
+            await save_snapshot_in_background(cache, path)
+            with open(path, 'rb') as file:
+                await asyncio.get_running_loop().sendfile(
+                    writer.transport, file)
+            writer.write(_encode_marker(_OPERATION_SYNCED))
+            await self._send_changes(replica, writer)
+        finally:
+            self._replicas.remove(replica)
+            os.remove(path)
+            writer.close()
+
+    def _add(self, data: bytes) -> None:
+        for replica in self._replicas:
+            replica.add(data)
+
+    async def _send_changes(
+            self,
+            replica: _ReplicaConnection,
+            writer: asyncio.StreamWriter
+    ) -> None:
+        while replica.pending_size <= self._backlog_size:
+            try:
+                await asyncio.wait_for(
+                    replica.changed.wait(), _HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            buffers = replica.take()
+            buffers.append(_encode_marker(_OPERATION_HEARTBEAT))
+            writer.writelines(buffers)
+            await writer.drain()
+        logger.warning('Replica %s fell behind, disconnecting',
+                       writer.get_extra_info('peername'))
+
+
+class Replica:
+    """
+    Replica side of the replication: connects to the primary,
+    loads its snapshot into a new cache and applies the changes
+    streamed after it. The connection is restored when it's lost,
+    starting over with a new cache.
+    """
+
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            create_cache: Callable[[], Cache],
+            offload: Optional[OffloadScheduler] = None
+    ) -> None:
+        self._address = (host, port)
+        self._create_cache = create_cache
+        # compresses the values off the event loop, if it's provided
+        self._offload = offload
+        self._connected = False
+        self._synced = False
+        # time of the last heartbeat of the primary
+        self._primary_time = 0
+        self._changes = 0
+
+    # The lag is the age of the last heartbeat applied by the replica,
+    # so it's up to the heartbeat interval more than the actual delay
+    def get_stats(self) -> Dict[str, int]:
+        lag = (time.time_ns() - self._primary_time) //\
+            _NANOSECONDS_IN_MILLISECOND if self._synced else _UNKNOWN_LAG
+        return {
+            'replication_connected': int(self._connected),
+            'replication_synced': int(self._synced),
+            'replication_lag_ms': lag,
+            'replication_changes': self._changes,
+        }
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self._replicate()
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                logger.warning('Replication from %s:%d stopped: %s',
+                               *self._address, e)
+            finally:
+                self._connected = False
+                self._synced = False
+            await asyncio.sleep(_RECONNECT_INTERVAL)
+
+    async def _replicate(self) -> None:
+        reader, writer = await asyncio.open_connection(*self._address)
+        try:
+            self._connected = True
+            logger.info('Syncing with the primary %s:%d', *self._address)
+            header = await reader.readexactly(len(SNAPSHOT_HEADER))
+            if header != SNAPSHOT_HEADER:
+                raise ValueError(f'unexpected header {header!r}')
+            cache = self._create_cache()
+            while True:
+                operation, key, value, expiration, tags =\
+                    await _read_record(reader)
+                if operation == OPERATION_SET:
+                    prepared = await self._prepare_value(cache, value)
+                    if not cache.restore_item(
+                            key, value, expiration, tags, prepared):
+                        # the expired item replaces the previous one
+                        cache.delete_item(key)
+                    self._changes += 1
+                elif operation == OPERATION_DELETE:
+                    cache.delete_item(key)
+                    self._changes += 1
+                elif operation == _OPERATION_HEARTBEAT:
+                    self._primary_time = expiration
+                elif operation == _OPERATION_SYNCED:
+                    self._primary_time = expiration
+                    self._synced = True
+                    logger.info('Synced with the primary %s:%d, %d items',
+                                *self._address, cache.get_stats()['items'])
+                else:
+                    raise ValueError(f'unknown operation {operation}')
+        finally:
+            writer.close()
+
+    async def _prepare_value(
+            self, cache: Cache, value: bytes) -> Optional[StoredValue]:
+        if self._offload is None or not cache.is_compressible(len(value)):
+            return None
+        return await self._offload.submit(cache.prepare_value, value)
+
+
+async def _read_record(reader: asyncio.StreamReader) -> Record:
+    operation, key_size, value_size, tags_size, expiration =\
+        RECORD_HEADER.unpack(await reader.readexactly(RECORD_HEADER.size))
+    data = await reader.readexactly(key_size + value_size + tags_size)
+    value_end = key_size + value_size
+    return Record(
+        operation, data[:key_size].decode(), data[key_size:value_end],
+        expiration, decode_tags(data[value_end:]))
+
+
+# Parses "HOST:PORT" of the primary
+def parse_address(text: str) -> Tuple[str, int]:
+    host, _, port = text.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f'Invalid address: {text}')
+    return host, int(port)
+
@@ -0,0 +1,116 @@
+from typing import List, Optional, Union
+
+from protocol import SEPARATOR, SEPARATOR_BINARY
+
+
+# A chunk of the response data, written to the socket as is
+Buffer = Union[bytes, memoryview]
+
+
+class Response:
+    """
+    Result of the command execution.
+    The response is written as a list of buffers, so that
+    item values are sent without being copied into a single message.
+    """
+
+    def get_buffers(self) -> List[Buffer]:
+        raise NotImplementedError
+
+
+class TextResponse(Response):
+    def __init__(self, text: str):
+        self.text = text
+        self._data = (text + SEPARATOR).encode()
+
+    def get_buffers(self) -> List[Buffer]:
+        return [self._data]
+
+
+class ValueResponse(Response):
+    """
+    Size of the value, followed by the value itself
+    """
+
+    def __init__(self, value: bytes):
+        self.value = value
+
+    def get_buffers(self) -> List[Buffer]:
+        header = str(len(self.value)).encode() + SEPARATOR_BINARY
+        return [header, self.value, SEPARATOR_BINARY]
+
+
+class StaleValueResponse(ValueResponse):
+    """
+    Value of an expired item, its size is preceded by the marker
+    """
+
+    _HEADER = 'STALE'
+
+    def get_buffers(self) -> List[Buffer]:
+        header = f'{self._HEADER} {len(self.value)}'.encode() +\
+            SEPARATOR_BINARY
+        return [header, self.value, SEPARATOR_BINARY]
+
+
+class VersionedValueResponse(ValueResponse):
+    """
+    Value of an item, its size is preceded by the marker and the version
+    """
+
+    _HEADER = 'VERSION'
+
+    def __init__(self, value: bytes, version: int):
+        super().__init__(value)
+        self.version = version
+
+    def get_buffers(self) -> List[Buffer]:
+        header = f'{self._HEADER} {self.version} {len(self.value)}'\
+            .encode() + SEPARATOR_BINARY
+        return [header, self.value, SEPARATOR_BINARY]
+
+
+class CompressedValueResponse(ValueResponse):
+    """
+    Compressed value, its size is preceded by the marker
+    and the compression algorithm
+    """
+
+    _HEADER = 'COMPRESSED'
+
+    def __init__(self, value: bytes, algorithm: str):
+        super().__init__(value)
+        self.algorithm = algorithm
+
+    def get_buffers(self) -> List[Buffer]:
+        header = f'{self._HEADER} {self.algorithm} {len(self.value)}'\
+            .encode() + SEPARATOR_BINARY
+        return [header, self.value, SEPARATOR_BINARY]
+
+
+class MultiValueResponse(Response):
+    """
+    The header lists sizes of all values, so that the client can
+    read all of them at once. The header is followed by found values,
+    each terminated with the separator
+    """
+
+    _HEADER = 'VALUES'
+    # size reported for the values that are not found
+    _MISSING_VALUE_SIZE = '-1'
+
+    def __init__(self, values: List[Optional[bytes]]):
+        self.values = values
+
+    def get_buffers(self) -> List[Buffer]:
+        sizes = [
+            str(len(value)) if value is not None else self._MISSING_VALUE_SIZE
+            for value in self.values
+        ]
+        header = f'{self._HEADER} {" ".join(sizes)}{SEPARATOR}'.encode()
+        buffers: List[Buffer] = [header]
+        for value in self.values:
+            if value is not None:
+                buffers.append(value)
+                buffers.append(SEPARATOR_BINARY)
+        return buffers
@@ -1,70 +1,379 @@
 import asyncio
+import os
+import signal
+import time
 from asyncio import StreamReader, StreamWriter
-from typing import Union
+from typing import Dict, List, Optional, Tuple
 
-from config import PORT, HOST, MAX_MESSAGE_SIZE
-from commands import CommandSet
+from config import PORT, HOST, MAX_MESSAGE_SIZE, WORKERS,\
+    EXPIRATION_INTERVAL, EXPIRATION_STEP_TIME, SNAPSHOT_PATH,\
+    SNAPSHOT_INTERVAL, APPEND_LOG_PATH, APPEND_LOG_FSYNC,\
+    APPEND_LOG_REWRITE_MIN_SIZE, SERVER_CORE, EVENT_LOOP, METRICS_PORT,\
+    PROFILE_PATH, DISK_TIER_PATH, DISK_TIER_SIZE, REPLICATION_PORT,\
+    REPLICA_OF
+from commands import Command, CommandPipeline, CommandShards, CommandStats,\
+    CommandProfile, CommandSet, CommandLeaseSet, CommandDelete,\
+    CommandMultiSet, CommandMultiDelete, CommandInvalidate, CommandIncrement,\
+    CommandAppend, CommandPrepend, CommandCompareAndSet
 from command_parser import parse_command
-from command_executor import execute_command
+from command_executor import execute_command, execute_binary_request,\
+    build_stats_response, find_invalidated_keys, delete_items
+from binary_protocol import BinaryRequest, BinaryRequestBuffer,\
+    BinaryResponse, REQUEST_MAGIC, OPCODE_NOOP, OPCODE_SET, OPCODE_DELETE,\
+    OPCODE_NAMES, STATUS_MOVED, STATUS_READ_ONLY
 from cache import Cache
-from server_utils import send_message,\
-    close_connection, process_set_command, MalformedMessageException,\
-    build_error_message, SEPARATOR_BINARY, log_received_message
+from compression import StoredValue
+from responses import Buffer, Response, TextResponse
+from sharding import ShardMap
+from server_utils import send_message, send_response,\
+    close_connection, process_attachment, MalformedMessageException,\
+    build_error_message, SEPARATOR, SEPARATOR_BINARY
+from pipeline import PipelineBuffer
+from server_protocol import ClientProtocol
+from server_logging import logger, setup_logging, ConnectionLog
+from metrics import ServerMetrics, format_metrics
+from leases import LeaseTable
+from offload import OffloadScheduler
+from disk_tier import DiskTier
+from profiling import Profiler
+from persistence import save_snapshot, save_snapshot_in_background,\
+    load_snapshot, replay_append_log, AppendOnlyLog, CorruptedFileException,\
+    ChangeLog, ChangeLogs
+from replication import ReplicationSource, Replica
+
+
+# max number of bytes read from the socket at once in the pipelined mode
+_PIPELINE_READ_SIZE = 64 * 1024
+
+SERVER_CORE_STREAMS = 'streams'
+SERVER_CORE_PROTOCOL = 'protocol'
+
+EVENT_LOOP_ASYNCIO = 'asyncio'
+EVENT_LOOP_UVLOOP = 'uvloop'
+
+# values of at least this size in bytes are received by the streams core
+# within the limit of the in-flight bytes
+_LARGE_VALUE_SIZE = 64 * 1024
+
+# number of items deleted by "delprefix" and "deltag" at once,
+# the other clients are served between the chunks
+_INVALIDATION_CHUNK_SIZE = 1000
+
+# seconds between the checks whether the append-only log needs a rewrite
+_LOG_REWRITE_CHECK_INTERVAL = 1
+
+
+# the metrics are served over HTTP, the request itself is ignored
+_HTTP_REQUEST_END = b'\r\n\r\n'
+_HTTP_RESPONSE_HEADER = 'HTTP/1.1 200 OK\r\n' \
+    'Content-Type: text/plain; version=0.0.4\r\n' \
+    'Content-Length: {}\r\n' \
+    'Connection: close\r\n\r\n'
+_UNKNOWN_BINARY_COMMAND = 'binary_unknown'
+
+_MOVED = 'MOVED'
+_PROFILE = 'PROFILE'
+_PROFILING_DISABLED = TextResponse('PROFILING_DISABLED')
+_PROFILE_STARTED = TextResponse('SUCCESS')
+_PROFILE_FAILED = TextResponse('COMMAND_FAILED')
+_SHARD = 'SHARD'
+_END = 'END'
+_READ_ONLY = TextResponse('READ_ONLY')
+
+# commands rejected by the replicas, the items are changed
+# only by the primary
+_WRITE_COMMANDS = (
+    CommandSet, CommandDelete, CommandMultiSet, CommandMultiDelete,
+    CommandLeaseSet, CommandInvalidate, CommandIncrement, CommandAppend,
+    CommandCompareAndSet
+)
 
 
 class Server:
-    def __init__(self) -> None:
-        self._cache = Cache()
+    """
+    Serves the cache over TCP. When several workers are configured,
+    each server process owns a shard of the keyspace and redirects
+    clients to the owner of the keys it doesn't own.
+    A replica follows the primary at the given replication address
+    (the worker with the same index, when there are several of them),
+    and serves reads only. It keeps no snapshots or logs of its own.
+    """
+
+    def __init__(
+            self,
+            shard_index: int = 0,
+            port: int = PORT,
+            replica_of: Optional[Tuple[str, int]] = REPLICA_OF
+    ) -> None:
+        self._disk_tier_path = _get_shard_path(DISK_TIER_PATH, shard_index)
+        self._disk_tier: Optional[DiskTier] = None
+        self._cache = self._create_cache()
+        self._leases = LeaseTable()
+        self._offload = OffloadScheduler()
+        self._shard_map = ShardMap(
+            [(HOST, port + index) for index in range(WORKERS)],
+            shard_index
+        )
+        self._replica: Optional[Replica] = None
+        self._replication: Optional[ReplicationSource] = None
+        if replica_of is not None:
+            primary_host, primary_port = replica_of
+            self._replica = Replica(
+                primary_host, primary_port + shard_index, self._create_cache,
+                self._offload)
+        elif REPLICATION_PORT is not None:
+            self._replication = ReplicationSource()
+        is_primary = self._replica is None
+        self._snapshot_path = _get_shard_path(SNAPSHOT_PATH, shard_index)\
+            if is_primary else None
+        self._log_path = _get_shard_path(APPEND_LOG_PATH, shard_index)\
+            if is_primary else None
+        self._log: Optional[AppendOnlyLog] = None
+        # the changes of the items are passed to the log and the replicas
+        self._changes: Optional[ChangeLog] = self._replication
+        self._metrics = ServerMetrics()
+        profile_path = _get_shard_path(PROFILE_PATH, shard_index)
+        self._profiler = Profiler(profile_path)\
+            if profile_path is not None else None
 
     def run(self) -> None:
-        asyncio.run(self._serve())
+        listener = setup_logging()
+        if EVENT_LOOP == EVENT_LOOP_UVLOOP:
+            try:
+                import uvloop
+                asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            except ImportError:
+                logger.warning(
+                    'uvloop is not installed, using the asyncio loop')
+        elif EVENT_LOOP != EVENT_LOOP_ASYNCIO:
+            raise ValueError(f'Unknown event loop: {EVENT_LOOP}')
+        try:
+            asyncio.run(self._serve())
+        finally:
+            listener.stop()
 
     async def _serve(self) -> None:
-        server = await asyncio.start_server(
-            self._accept_client,
-            HOST,
-            PORT,
-            limit=(MAX_MESSAGE_SIZE + len(SEPARATOR_BINARY))
-        )
+        self._load_items()
+        # shut down gracefully on termination, saving the snapshot
+        terminated = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, terminated.set)
+
+        host, port = self._shard_map.addresses[self._shard_map.own_index]
+        server = await self._start_server(host, port)
 
         addr: str = server.sockets[0].getsockname()
-        print(f'Serving on {addr}')
+        logger.info('Serving on %s', addr)
+
+        tasks = [asyncio.create_task(self._reclaim_expired_items())]
+        if METRICS_PORT is not None:
+            tasks.append(asyncio.create_task(self._serve_metrics(host)))
+        if self._snapshot_path is not None:
+            tasks.append(asyncio.create_task(self._save_snapshots()))
+        if self._log is not None:
+            tasks.append(asyncio.create_task(self._rewrite_log()))
+        if self._replication is not None:
+            tasks.append(asyncio.create_task(self._serve_replicas(host)))
+        if self._replica is not None:
+            tasks.append(asyncio.create_task(self._replica.run()))
+        try:
+            async with server:
+                await terminated.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._offload.close()
+            if self._log is not None:
+                self._log.close()
+            self._save_snapshot()
+            if self._disk_tier is not None:
+                self._disk_tier.close()
+
+    # A new cache replaces the current one when a replica syncs
+    # with the primary, the items on the disk are dropped along with it
+    def _create_cache(self) -> Cache:
+        if self._disk_tier_path is not None:
+            if self._disk_tier is not None:
+                self._disk_tier.close()
+            self._disk_tier = DiskTier(self._disk_tier_path, DISK_TIER_SIZE)
+        self._cache = Cache(disk_tier=self._disk_tier)
+        return self._cache
 
+    async def _start_server(self, host: str, port: int) -> asyncio.Server:
+        if SERVER_CORE == SERVER_CORE_STREAMS:
+            return await asyncio.start_server(
+                self._accept_client,
+                host,
+                port,
+                limit=(MAX_MESSAGE_SIZE + len(SEPARATOR_BINARY))
+            )
+        if SERVER_CORE == SERVER_CORE_PROTOCOL:
+            receive_buffer = memoryview(bytearray(_PIPELINE_READ_SIZE))
+            return await asyncio.get_running_loop().create_server(
+                lambda: ClientProtocol(
+                    receive_buffer, self._execute, self._execute_binary,
+                    self._offload_command, self._offload_binary,
+                    self._metrics),
+                host,
+                port
+            )
+        raise ValueError(f'Unknown server core: {SERVER_CORE}')
+
+    # Serves the metrics in the Prometheus format over HTTP,
+    # each worker listens on its own port
+    async def _serve_metrics(self, host: str) -> None:
+        assert METRICS_PORT is not None
+        port = METRICS_PORT + self._shard_map.own_index
+        server = await asyncio.start_server(
+            self._send_metrics, host, port)
+        logger.info('Serving metrics on %s', (host, port))
+        async with server:
+            await server.serve_forever()
+
+    # Streams the changes to the replicas, each worker
+    # listens on its own port
+    async def _serve_replicas(self, host: str) -> None:
+        assert REPLICATION_PORT is not None
+        port = REPLICATION_PORT + self._shard_map.own_index
+        server = await asyncio.start_server(
+            self._serve_replica, host, port)
+        logger.info('Serving replicas on %s', (host, port))
         async with server:
             await server.serve_forever()
 
+    async def _serve_replica(
+            self, reader: StreamReader, writer: StreamWriter) -> None:
+        assert self._replication is not None
+        addr = writer.get_extra_info('peername')
+        logger.info('Replica %s connected', addr)
+        try:
+            await self._replication.serve_replica(
+                self._cache, reader, writer)
+        except (OSError, RuntimeError) as e:
+            logger.warning('Replica %s disconnected: %s', addr, e)
+        except asyncio.CancelledError:
+            # the server is shutting down, the replica will reconnect
+            # once it's back
+            pass
+
+    async def _send_metrics(
+            self, reader: StreamReader, writer: StreamWriter) -> None:
+        try:
+            await reader.readuntil(_HTTP_REQUEST_END)
+            body = format_metrics(
+                self._get_cache_stats(), self._metrics,
+                self._shard_map.own_index
+            ).encode()
+            writer.write(
+                _HTTP_RESPONSE_HEADER.format(len(body)).encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionResetError):
+            pass
+        writer.close()
+
+    # Reclaims expired items in small steps,
+    # letting the clients be served in between
+    async def _reclaim_expired_items(self) -> None:
+        max_duration = int(EXPIRATION_STEP_TIME * 1e9)
+        while True:
+            if self._cache.reclaim_expired_items(max_duration):
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(EXPIRATION_INTERVAL)
+
+    async def _save_snapshots(self) -> None:
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            try:
+                await save_snapshot_in_background(
+                    self._cache, self._snapshot_path)
+            except (OSError, RuntimeError) as e:
+                logger.error('Failed to save snapshot: %s', e)
+
+    async def _rewrite_log(self) -> None:
+        assert self._log is not None
+        while True:
+            await asyncio.sleep(_LOG_REWRITE_CHECK_INTERVAL)
+            if not self._log.is_rewrite_needed():
+                continue
+            try:
+                await self._log.rewrite(self._cache)
+            except (OSError, RuntimeError) as e:
+                logger.error('Failed to rewrite append-only log: %s', e)
+
+    # The append-only log is more recent than the snapshot,
+    # so the snapshot is loaded only when there is no log yet,
+    # or when nothing could be replayed from it
+    def _load_items(self) -> None:
+        path = self._log_path
+        if path is None or not os.path.exists(path) or\
+                not self._replay_log(path):
+            self._load_snapshot()
+        if path is not None:
+            self._log = AppendOnlyLog(
+                self._cache, path, APPEND_LOG_FSYNC,
+                APPEND_LOG_REWRITE_MIN_SIZE)
+            self._changes = self._log if self._replication is None\
+                else ChangeLogs([self._log, self._replication])
+
+    # Returns whether any changes are replayed. The broken log is moved
+    # aside, the cache keeps the changes read before the corruption.
+    def _replay_log(self, path: str) -> bool:
+        start = time.monotonic()
+        try:
+            replayed = replay_append_log(self._cache, path)
+        except CorruptedFileException as e:
+            broken_path = f'{path}.broken'
+            os.replace(path, broken_path)
+            logger.error('Failed to replay append-only log: %s, '
+                         'replayed %d changes, moved it to %s',
+                         e, e.records, broken_path)
+            return e.records > 0
+        logger.info('Replayed %d changes from %s in %.2fs',
+                    replayed, path, time.monotonic() - start)
+        return True
+
+    def _load_snapshot(self) -> None:
+        path = self._snapshot_path
+        if path is None or not os.path.exists(path):
+            return
+        start = time.monotonic()
+        try:
+            loaded, skipped = load_snapshot(self._cache, path)
+        except CorruptedFileException as e:
+            # the cache starts with the items read before the corruption
+            logger.error('Failed to load snapshot: %s', e)
+            return
+        logger.info('Loaded %d items from %s in %.2fs, skipped %d',
+                    loaded, path, time.monotonic() - start, skipped)
+
+    def _save_snapshot(self) -> None:
+        path = self._snapshot_path
+        if path is None:
+            return
+        start = time.monotonic()
+        saved = save_snapshot(self._cache, path)
+        logger.info('Saved %d items to %s in %.2fs',
+                    saved, path, time.monotonic() - start)
+
     async def _accept_client(
             self, reader: StreamReader, writer: StreamWriter) -> None:
         addr: str = writer.get_extra_info('peername')
-        print(f'Accepted client from {addr}')
+        logger.debug('Accepted client from %s', addr)
+        log = ConnectionLog(addr)
+        metrics = self._metrics
+        metrics.connections += 1
+        metrics.total_connections += 1
 
         try:
-            while True:
-                data = await reader.readuntil(SEPARATOR_BINARY)
-
-                log_received_message(data, writer)
-
-                response: Union[str, bytes] = ''
-                try:
-                    message = data.decode()
-                    if len(message.strip()) == 0:
-                        # ignore empty messages
-                        continue
-
-                    command_or_error = parse_command(message)
-                    if command_or_error.error:
-                        response = command_or_error.error
-                    else:
-                        command = command_or_error.command
-                        if isinstance(command, CommandSet):
-                            await process_set_command(command, reader, writer)
-
-                        response = execute_command(command, self._cache)
-                except ValueError:
-                    print(f'Failed to decode message from {addr}')
-                    response = build_error_message(
-                        'failed to decode message', fatal=False)
-                await send_message(response, writer)
+            # the binary protocol is detected by the first byte
+            first_byte = await reader.readexactly(1)
+            if first_byte[0] == REQUEST_MAGIC:
+                await self._serve_binary(reader, writer, first_byte, log)
+            else:
+                await self._serve_text(reader, writer, first_byte, log)
 
         except (MalformedMessageException, asyncio.LimitOverrunError):
             await send_message(
@@ -79,4 +388,345 @@ class Server:
             # client disconnected
             pass
 
+        metrics.connections -= 1
         await close_connection(writer)
+
+    # Serves the connection in the text protocol,
+    # the prefix is the beginning of the first message
+    async def _serve_text(
+            self,
+            reader: StreamReader,
+            writer: StreamWriter,
+            prefix: bytes,
+            log: ConnectionLog
+    ) -> None:
+        while True:
+            data = prefix + await reader.readuntil(SEPARATOR_BINARY)
+            prefix = b''
+
+            log.received(data)
+            metrics = self._metrics
+            metrics.bytes_received += len(data)
+
+            try:
+                message = data.decode()
+                if len(message.strip()) == 0:
+                    # ignore empty messages
+                    continue
+
+                command_or_error = parse_command(message)
+                if command_or_error.error:
+                    metrics.bytes_sent += await send_message(
+                        command_or_error.error, writer)
+                    continue
+
+                command = command_or_error.command
+                if command.has_attachment():
+                    await self._receive_attachment(
+                        command, reader, writer, log)
+                else:
+                    task = self._offload_command(command)
+                    if task is not None:
+                        await task
+
+                metrics.bytes_sent += await send_response(
+                    self._execute(command), writer)
+                if isinstance(command, CommandPipeline):
+                    await self._serve_pipelined(reader, writer, log)
+                    break
+            except ValueError:
+                logger.debug('Failed to decode message from %s', log.peer)
+                metrics.bytes_sent += await send_message(
+                    build_error_message(
+                        'failed to decode message', fatal=False),
+                    writer
+                )
+
+    # Serves the connection in the pipelined mode:
+    # all commands found in the received data are executed,
+    # and their responses are sent back in one batch
+    async def _serve_pipelined(
+            self,
+            reader: StreamReader,
+            writer: StreamWriter,
+            log: ConnectionLog
+    ) -> None:
+        buffer = PipelineBuffer(pipelined=True)
+        while True:
+            data = await reader.read(_PIPELINE_READ_SIZE)
+            if not data:
+                # client disconnected
+                break
+
+            log.received(data)
+            self._metrics.bytes_received += len(data)
+            buffer.feed(data)
+
+            buffers: List[Buffer] = []
+            for command_or_error in buffer.pop_commands():
+                if command_or_error.error:
+                    buffers.append(command_or_error.error.encode())
+                    continue
+                command = command_or_error.command
+                task = self._offload_command(command)
+                if task is not None:
+                    await task
+                buffers.extend(self._execute(command).get_buffers())
+            if buffers:
+                self._metrics.record_sent(buffers)
+                writer.writelines(buffers)
+                await writer.drain()
+
+    # Serves the connection in the binary protocol, which is always
+    # pipelined: all requests found in the received data are executed,
+    # and their responses are sent back in one batch
+    async def _serve_binary(
+            self,
+            reader: StreamReader,
+            writer: StreamWriter,
+            data: bytes,
+            log: ConnectionLog
+    ) -> None:
+        buffer = BinaryRequestBuffer()
+        while data:
+            log.received(data)
+            self._metrics.bytes_received += len(data)
+            buffer.feed(data)
+            try:
+                requests = buffer.pop_requests()
+            except MalformedMessageException:
+                # the framing is lost, the connection can't be recovered
+                break
+
+            buffers: List[Buffer] = []
+            for request in requests:
+                task = self._offload_binary(request)
+                if task is not None:
+                    request = await task
+                buffers.extend(self._execute_binary(request).get_buffers())
+            if buffers:
+                self._metrics.record_sent(buffers)
+                writer.writelines(buffers)
+                await writer.drain()
+            data = await reader.read(_PIPELINE_READ_SIZE)
+
+    # Reads the value of the command and prepares it for storing.
+    # Large values are read only once they fit in the limit
+    # of the in-flight bytes, so that many of them don't take
+    # all the memory, and they are compressed in the thread pool.
+    async def _receive_attachment(
+            self,
+            command: Command,
+            reader: StreamReader,
+            writer: StreamWriter,
+            log: ConnectionLog
+    ) -> None:
+        size = command.get_attachment_size()
+        compressible = self._is_compressible(command)
+        if size < _LARGE_VALUE_SIZE and not compressible:
+            await process_attachment(command, reader, writer, log)
+            self._metrics.bytes_received += size + len(SEPARATOR_BINARY)
+        else:
+            await self._offload.acquire(size)
+            try:
+                await process_attachment(command, reader, writer, log)
+                self._metrics.bytes_received += size + len(SEPARATOR_BINARY)
+                if compressible:
+                    await self._prepare_values(command)
+            finally:
+                self._offload.release(size)
+        if isinstance(command, CommandAppend):
+            # the new value of the item is known once the attachment is read
+            task = self._offload_append(command)
+            if task is not None:
+                await task
+
+    # Starts the preparation of the command off the event loop,
+    # returns None if the command doesn't need it. The values are
+    # compressed in the thread pool, the items matched by an invalidation
+    # are deleted in chunks.
+    def _offload_command(
+            self, command: Command) -> 'Optional[asyncio.Task[None]]':
+        if isinstance(command, CommandInvalidate):
+            if self._replica is not None:
+                return None
+            return asyncio.ensure_future(self._invalidate_in_chunks(command))
+        if isinstance(command, CommandAppend):
+            return self._offload_append(command)
+        if not self._is_compressible(command):
+            return None
+        return asyncio.ensure_future(self._prepare_command(command))
+
+    async def _prepare_command(self, command: Command) -> None:
+        size = command.get_attachment_size()
+        await self._offload.acquire(size)
+        try:
+            await self._prepare_values(command)
+        finally:
+            self._offload.release(size)
+
+    # Compresses the values of the admitted command in the thread pool
+    async def _prepare_values(self, command: Command) -> None:
+        if isinstance(command, CommandMultiSet):
+            command.prepared_values = await self._offload.run(
+                self._cache.prepare_values,
+                [value for _, value, _ in command.get_items()])
+        else:
+            command.prepared_attachment = await self._offload.run(
+                self._cache.prepare_value, command.bytes_attachment)
+
+    # The new value of the item is made and compressed in the thread pool,
+    # it's stored unless the item changes meanwhile
+    def _offload_append(
+            self, command: CommandAppend) -> 'Optional[asyncio.Task[None]]':
+        if self._replica is not None or self._cache.get_compression() is None:
+            return None
+        stored = self._cache.get_stored_version(command.args[0])
+        if stored is None:
+            return None
+        value, _ = stored
+        if not value.compressed and not self._cache.is_compressible(
+                len(value.data) + len(command.bytes_attachment)):
+            return None
+        return asyncio.ensure_future(self._prepare_update(command, *stored))
+
+    async def _prepare_update(
+            self, command: CommandAppend, stored: StoredValue, version: int
+    ) -> None:
+        size = len(stored.data) + len(command.bytes_attachment)
+        await self._offload.acquire(size)
+        try:
+            command.prepared_update = await self._offload.run(
+                self._cache.prepare_update, stored, version,
+                command.bytes_attachment, isinstance(command, CommandPrepend))
+        finally:
+            self._offload.release(size)
+
+    # Starts the compression of the value of the binary request
+    # in the thread pool, returns None if the request doesn't need it
+    def _offload_binary(
+            self, request: BinaryRequest
+    ) -> 'Optional[asyncio.Task[BinaryRequest]]':
+        if request.opcode != OPCODE_SET or self._replica is not None or\
+                not self._cache.is_compressible(len(request.value)):
+            return None
+        return asyncio.ensure_future(self._prepare_request(request))
+
+    async def _prepare_request(self, request: BinaryRequest) -> BinaryRequest:
+        return request._replace(prepared=await self._offload.submit(
+            self._cache.prepare_value, request.value))
+
+    # The items matched later are deleted by the command itself
+    async def _invalidate_in_chunks(self, command: CommandInvalidate) -> None:
+        keys = find_invalidated_keys(command, self._cache)
+        for start in range(0, len(keys), _INVALIDATION_CHUNK_SIZE):
+            command.deleted += delete_items(
+                keys[start:start + _INVALIDATION_CHUNK_SIZE],
+                self._cache, self._changes, self._leases)
+            await asyncio.sleep(0)
+
+    # Whether storing the values of the command involves their compression
+    def _is_compressible(self, command: Command) -> bool:
+        if isinstance(command, CommandMultiSet):
+            return any(self._cache.is_compressible(size)
+                       for size in command.get_sizes())
+        return isinstance(
+            command, (CommandSet, CommandLeaseSet, CommandCompareAndSet)
+        ) and self._cache.is_compressible(command.get_attachment_size())
+
+    # Executes the command recording its latency
+    def _execute(self, command: Command) -> Response:
+        start = time.perf_counter_ns()
+        response = self._execute_command(command)
+        self._metrics.record_latency(
+            command.get_id(), time.perf_counter_ns() - start)
+        return response
+
+    def _execute_binary(self, request: BinaryRequest) -> Response:
+        start = time.perf_counter_ns()
+        response = self._execute_binary_request(request)
+        self._metrics.record_latency(
+            OPCODE_NAMES.get(request.opcode, _UNKNOWN_BINARY_COMMAND),
+            time.perf_counter_ns() - start
+        )
+        return response
+
+    def _execute_command(self, command: Command) -> Response:
+        if isinstance(command, CommandShards):
+            return self._build_shards_response()
+        if isinstance(command, CommandStats):
+            return build_stats_response(
+                {**self._get_cache_stats(), **self._metrics.get_stats()})
+        if isinstance(command, CommandProfile):
+            return self._execute_profile_command(command)
+        if self._replica is not None and isinstance(command, _WRITE_COMMANDS):
+            return _READ_ONLY
+        if self._replica is None and self._shard_map.is_sharded():
+            # all keys of the command must belong to this shard
+            for key in command.get_keys():
+                index = self._shard_map.get_shard_index(key)
+                if index != self._shard_map.own_index:
+                    host, port = self._shard_map.addresses[index]
+                    return TextResponse(f'{_MOVED} {host}:{port}')
+        return execute_command(
+            command, self._cache, self._changes, self._leases)
+
+    def _execute_binary_request(
+            self, request: BinaryRequest) -> BinaryResponse:
+        if self._replica is not None and\
+                request.opcode in (OPCODE_SET, OPCODE_DELETE):
+            return BinaryResponse(
+                request.opcode, STATUS_READ_ONLY, request.opaque)
+        if self._replica is None and self._shard_map.is_sharded() and\
+                request.opcode != OPCODE_NOOP:
+            index = self._shard_map.get_shard_index(request.key)
+            if index != self._shard_map.own_index:
+                host, port = self._shard_map.addresses[index]
+                return BinaryResponse(
+                    request.opcode, STATUS_MOVED, request.opaque,
+                    f'{host}:{port}'.encode()
+                )
+        return execute_binary_request(
+            request, self._cache, self._changes, self._leases)
+
+    # Starts the profiler, or stops it and reports the file
+    # the results are written to as "PROFILE [PATH]"
+    def _execute_profile_command(self, command: CommandProfile) -> Response:
+        if self._profiler is None:
+            return _PROFILING_DISABLED
+        if command.is_start():
+            if self._profiler.start(command.get_kind()):
+                logger.info('Started the %s profiler', command.get_kind())
+                return _PROFILE_STARTED
+            return _PROFILE_FAILED
+        path = self._profiler.stop(command.get_kind())
+        if path is None:
+            return _PROFILE_FAILED
+        logger.info('Saved the %s profile to %s', command.get_kind(), path)
+        return TextResponse(f'{_PROFILE} {path}')
+
+    def _get_cache_stats(self) -> Dict[str, int]:
+        stats = self._cache.get_stats()
+        if self._log is not None:
+            stats.update(self._log.get_stats())
+        if self._replication is not None:
+            stats.update(self._replication.get_stats())
+        if self._replica is not None:
+            stats.update(self._replica.get_stats())
+        return stats
+
+    # Each shard is reported on a separate line,
+    # the list is terminated with the end marker
+    def _build_shards_response(self) -> Response:
+        lines = [
+            f'{_SHARD} {index} {host} {port}'
+            for index, (host, port) in enumerate(self._shard_map.addresses)
+        ]
+        return TextResponse(SEPARATOR.join(lines + [_END]))
+
+
+# With several workers each of them keeps its own files
+def _get_shard_path(path: Optional[str], shard_index: int) -> Optional[str]:
+    if path is None or WORKERS <= 1:
+        return path
+    return f'{path}.{shard_index}'
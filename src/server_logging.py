@@ -0,0 +1,65 @@
+import logging
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Union
+
+from config import LOG_LEVEL, LOG_FILE, LOG_SAMPLE_RATE,\
+    LOG_MAX_PAYLOAD_SIZE
+
+
+logger = logging.getLogger('cache')
+
+_LOG_FORMAT = '%(asctime)s %(levelname)s [%(process)d] %(message)s'
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Passes the records to the writer thread as they are,
+    so that even the message formatting is done off the event loop.
+    The arguments of the records must not change after logging.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class ConnectionLog:
+    """
+    Logs the messages received over a connection at the DEBUG level.
+    Only a sample of the connections is logged, the decision is made
+    once per connection, so the rest of them cost a flag check.
+    """
+
+    __slots__ = ('peer', 'sampled')
+
+    def __init__(self, peer: str) -> None:
+        self.peer = peer
+        self.sampled = logger.isEnabledFor(logging.DEBUG) and\
+            random.random() < LOG_SAMPLE_RATE
+
+    def received(self, message: Union[bytes, memoryview]) -> None:
+        if self.sampled:
+            # copied right away, the buffer may be reused
+            logger.debug(
+                'Received %d bytes from %s: %r', len(message), self.peer,
+                bytes(message[:LOG_MAX_PAYLOAD_SIZE]))
+
+
+# Makes the records be written by a separate thread,
+# returns the listener to stop once the server exits
+def setup_logging() -> QueueListener:
+    if LOG_FILE is None:
+        handler: logging.Handler = logging.StreamHandler(sys.stdout)
+    else:
+        handler = logging.FileHandler(LOG_FILE)
+    handler.setFormatter(logging.Formatter(_LOG_FORMAT))
+
+    records: 'queue.SimpleQueue[logging.LogRecord]' = queue.SimpleQueue()
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    logger.handlers = [_DeferredQueueHandler(records)]
+    listener = QueueListener(records, handler)
+    listener.start()
+    return listener
@@ -0,0 +1,258 @@
+import asyncio
+from collections import deque
+from typing import Callable, Deque, List, Optional
+
+from binary_protocol import BinaryRequest, BinaryRequestBuffer,\
+    BinaryResponse, REQUEST_MAGIC, OPCODE_NAMES, STATUS_NOT_STORED
+from commands import Command, CommandPipeline
+from command_parser import CommandOrError
+from metrics import ServerMetrics
+from pipeline import PipelineBuffer
+from protocol import SEPARATOR
+from responses import Buffer, Response
+from server_logging import logger, ConnectionLog
+from server_utils import MalformedMessageException, build_error_message
+
+
+# sent when the preparation of the command fails, the command isn't executed
+_PREPARATION_FAILED = ('COMMAND_FAILED' + SEPARATOR).encode()
+
+
+class ClientProtocol(asyncio.BufferedProtocol):
+    """
+    Serves a client connection with protocol callbacks instead of streams:
+    commands are parsed as soon as the data arrives, and their responses
+    are written to the transport right away, without awaiting.
+    Reading is paused while the write buffer of the transport is full.
+    The receive buffer is shared by all connections of the server,
+    since the received data is consumed before the callback returns.
+    While a command is prepared off the event loop (its value is
+    processed in the thread pool, or the items it deletes are removed
+    in chunks), the following commands wait for it and reading is paused.
+    The binary requests wait the same way for the compression of a value.
+    """
+
+    def __init__(
+            self,
+            receive_buffer: memoryview,
+            execute: Callable[[Command], Response],
+            execute_binary: Callable[[BinaryRequest], Response],
+            offload: Callable[[Command], 'Optional[asyncio.Task[None]]'],
+            offload_binary: Callable[
+                [BinaryRequest], 'Optional[asyncio.Task[BinaryRequest]]'],
+            metrics: ServerMetrics
+    ) -> None:
+        self._receive_buffer = receive_buffer
+        self._execute = execute
+        self._execute_binary = execute_binary
+        self._offload = offload
+        self._offload_binary = offload_binary
+        self._metrics = metrics
+        self._transport: Optional[asyncio.Transport] = None
+        self._log: Optional[ConnectionLog] = None
+        # one of them is created once the protocol is detected
+        self._commands: Optional[PipelineBuffer] = None
+        self._requests: Optional[BinaryRequestBuffer] = None
+        self._pipelined = False
+        # pending command which attachment has been requested
+        self._prompted: Optional[Command] = None
+        # parsed commands waiting for the one which value is processed
+        self._queued: Deque[CommandOrError] = deque()
+        self._offloaded: Optional[Command] = None
+        # binary requests waiting for the one which value is compressed
+        self._queued_requests: Deque[BinaryRequest] = deque()
+        self._offloaded_request: Optional[BinaryRequest] = None
+        self._writing_paused = False
+        self._eof_received = False
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        assert isinstance(transport, asyncio.Transport)
+        self._transport = transport
+        addr: str = transport.get_extra_info('peername')
+        logger.debug('Accepted client from %s', addr)
+        self._log = ConnectionLog(addr)
+        self._metrics.connections += 1
+        self._metrics.total_connections += 1
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        assert self._log is not None
+        logger.debug('Closed the client socket %s', self._log.peer)
+        self._metrics.connections -= 1
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self._receive_buffer
+
+    def buffer_updated(self, nbytes: int) -> None:
+        transport = self._transport
+        assert transport is not None and self._log is not None
+        data = self._receive_buffer[:nbytes]
+        self._log.received(data)
+        self._metrics.bytes_received += nbytes
+
+        if self._commands is None and self._requests is None:
+            # the binary protocol is detected by the first byte
+            if data[0] == REQUEST_MAGIC:
+                self._requests = BinaryRequestBuffer()
+            else:
+                self._commands = PipelineBuffer()
+
+        try:
+            if self._requests is not None:
+                buffers = self._process_requests(data)
+            else:
+                buffers = self._process_commands(data)
+        except MalformedMessageException:
+            if self._commands is not None:
+                transport.write(build_error_message(
+                    'unexpected message length or termination marker.',
+                    fatal=True
+                ).encode())
+            transport.close()
+            return
+        self._send(buffers)
+
+    # Closes the connection once the client has closed its side,
+    # unless a command is still waiting for its value to be processed
+    def eof_received(self) -> Optional[bool]:
+        self._eof_received = True
+        return self._is_offloading()
+
+    def pause_writing(self) -> None:
+        self._writing_paused = True
+        self._update_reading()
+
+    def resume_writing(self) -> None:
+        self._writing_paused = False
+        self._update_reading()
+
+    def _send(self, buffers: List[Buffer]) -> None:
+        if buffers:
+            assert self._transport is not None
+            self._metrics.record_sent(buffers)
+            self._transport.writelines(buffers)
+
+    def _update_reading(self) -> None:
+        transport = self._transport
+        assert transport is not None
+        if transport.is_closing():
+            return
+        if self._writing_paused or self._is_offloading():
+            transport.pause_reading()
+        else:
+            transport.resume_reading()
+
+    def _is_offloading(self) -> bool:
+        return self._offloaded is not None or\
+            self._offloaded_request is not None
+
+    def _process_commands(self, data: memoryview) -> List[Buffer]:
+        commands = self._commands
+        assert commands is not None
+        commands.feed(data)
+        self._queued.extend(commands.pop_commands())
+        return self._execute_queued()
+
+    # Executes the queued commands until one of them
+    # needs to be prepared off the event loop
+    def _execute_queued(self) -> List[Buffer]:
+        commands = self._commands
+        assert commands is not None
+        buffers: List[Buffer] = []
+        while self._queued and self._offloaded is None:
+            command_or_error = self._queued.popleft()
+            if command_or_error.error:
+                buffers.append(command_or_error.error.encode())
+                continue
+            command = command_or_error.command
+            task = self._offload(command)
+            if task is not None:
+                self._offloaded = command
+                self._update_reading()
+                task.add_done_callback(self._on_offloaded)
+                # the prompt is sent once the value is stored
+                return buffers
+            buffers.extend(self._execute(command).get_buffers())
+            if isinstance(command, CommandPipeline):
+                self._pipelined = True
+
+        if not self._pipelined:
+            # out of the pipelined mode the client waits for the prompt
+            # before sending the attachment
+            pending = commands.get_pending_command()
+            if pending is not None and pending is not self._prompted:
+                self._prompted = pending
+                buffers.append(
+                    (pending.get_attachment_prompt() + SEPARATOR).encode())
+        return buffers
+
+    def _on_offloaded(self, task: 'asyncio.Task[None]') -> None:
+        command = self._offloaded
+        assert command is not None and self._transport is not None
+        self._offloaded = None
+        if self._transport.is_closing() or task.cancelled():
+            return
+        buffers: List[Buffer]
+        try:
+            # raises the error of the preparation, if any
+            task.result()
+        except Exception as e:
+            logger.error('Failed to prepare the %s command: %s',
+                         command.get_id(), e)
+            buffers = [_PREPARATION_FAILED]
+        else:
+            buffers = list(self._execute(command).get_buffers())
+        buffers.extend(self._execute_queued())
+        self._resume(buffers)
+
+    # Sends the responses of the commands executed after the offloaded
+    # one and goes on reading, unless the client has closed its side
+    def _resume(self, buffers: List[Buffer]) -> None:
+        assert self._transport is not None
+        self._send(buffers)
+        if not self._is_offloading() and self._eof_received:
+            self._transport.close()
+        else:
+            self._update_reading()
+
+    def _process_requests(self, data: memoryview) -> List[Buffer]:
+        requests = self._requests
+        assert requests is not None
+        requests.feed(data)
+        self._queued_requests.extend(requests.pop_requests())
+        return self._execute_queued_requests()
+
+    # Executes the queued requests until the value of one of them
+    # needs to be compressed off the event loop
+    def _execute_queued_requests(self) -> List[Buffer]:
+        buffers: List[Buffer] = []
+        while self._queued_requests and self._offloaded_request is None:
+            request = self._queued_requests.popleft()
+            task = self._offload_binary(request)
+            if task is not None:
+                self._offloaded_request = request
+                self._update_reading()
+                task.add_done_callback(self._on_request_offloaded)
+                return buffers
+            buffers.extend(self._execute_binary(request).get_buffers())
+        return buffers
+
+    def _on_request_offloaded(
+            self, task: 'asyncio.Task[BinaryRequest]') -> None:
+        request = self._offloaded_request
+        assert request is not None and self._transport is not None
+        self._offloaded_request = None
+        if self._transport.is_closing() or task.cancelled():
+            return
+        buffers: List[Buffer]
+        try:
+            prepared = task.result()
+        except Exception as e:
+            logger.error('Failed to prepare the %s request: %s',
+                         OPCODE_NAMES[request.opcode], e)
+            buffers = list(BinaryResponse(
+                request.opcode, STATUS_NOT_STORED, request.opaque
+            ).get_buffers())
+        else:
+            buffers = list(self._execute_binary(prepared).get_buffers())
+        buffers.extend(self._execute_queued_requests())
+        self._resume(buffers)
@@ -2,19 +2,31 @@ from typing import Union
 from asyncio import StreamReader, StreamWriter
 
 
-from commands import CommandSet
+from commands import Command
+from responses import Response
 from protocol import SEPARATOR, SEPARATOR_BINARY
+from server_logging import logger, ConnectionLog
 
 
 class MalformedMessageException(Exception):
     pass
 
 
+# Returns the number of sent bytes
 async def send_message(
-        message: Union[str, bytes], writer: StreamWriter) -> None:
+        message: Union[str, bytes], writer: StreamWriter) -> int:
     data = message.encode() if isinstance(message, str) else message
     writer.write(data)
     await writer.drain()
+    return len(data)
+
+
+# Returns the number of sent bytes
+async def send_response(response: Response, writer: StreamWriter) -> int:
+    buffers = response.get_buffers()
+    writer.writelines(buffers)
+    await writer.drain()
+    return sum(map(len, buffers))
 
 
 def build_error_message(message: str, fatal: bool) -> str:
@@ -26,26 +38,27 @@ async def close_connection(writer: StreamWriter) -> None:
     writer.close()
     await writer.wait_closed()
     addr: str = writer.get_extra_info('peername')
-    print(f'Closed the client socket {addr}')
+    logger.debug('Closed the client socket %s', addr)
 
 
-async def process_set_command(
-        command: CommandSet, reader: StreamReader, writer: StreamWriter
+# Prompts the client for the payload of the command and reads it
+async def process_attachment(
+        command: Command,
+        reader: StreamReader,
+        writer: StreamWriter,
+        log: ConnectionLog
 ) -> None:
-    size = int(command.get_arguments()[2])
-    await send_message(
-        f'Send {size} bytes, terminated with \\r\\n.{SEPARATOR}', writer)
-    data = await reader.readexactly(size + len(SEPARATOR_BINARY))
-    log_received_message(data, writer)
-    _validate_message(data)
-    data_without_separator = data[:len(data) - len(SEPARATOR_BINARY)]
-    command.bytes_attachment = data_without_separator
-
-
-def log_received_message(message: bytes, writer: StreamWriter) -> None:
-    addr: str = writer.get_extra_info('peername')
-    print(f'Received message from {addr}')
-    print(message)
+    size = command.get_attachment_size()
+    await send_message(command.get_attachment_prompt() + SEPARATOR, writer)
+    # the payload and its terminator are read separately,
+    # so that the payload is not copied to trim the terminator
+    data = await reader.readexactly(size)
+    separator = await reader.readexactly(len(SEPARATOR_BINARY))
+    log.received(data)
+    _validate_message(separator)
+    command.set_bytes_attachment(data)
+    if not command.is_attachment_valid():
+        raise MalformedMessageException()
 
 
 def _validate_message(message: bytes) -> None:
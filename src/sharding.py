@@ -0,0 +1,57 @@
+from bisect import bisect
+from hashlib import md5
+from typing import List, Tuple
+
+
+# number of points each node takes on the ring,
+# more points give more even distribution of the keys
+_POINTS_PER_NODE = 160
+
+
+def _hash(data: str) -> int:
+    return int.from_bytes(md5(data.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hashing of keys over nodes.
+    Each node is identified by a name, e.g. its address.
+    Adding or removing a node only moves the keys of that node.
+    """
+
+    def __init__(self, nodes: List[str]):
+        self.nodes = nodes
+        points: List[Tuple[int, int]] = []
+        for index, node in enumerate(nodes):
+            for point in range(_POINTS_PER_NODE):
+                points.append((_hash(f'{node}#{point}'), index))
+        points.sort()
+        self._hashes = [point_hash for point_hash, _ in points]
+        self._indexes = [index for _, index in points]
+
+    # Returns index of the node owning the key
+    def get_node_index(self, key: str) -> int:
+        position = bisect(self._hashes, _hash(key))
+        if position == len(self._hashes):
+            # the ring wraps around
+            position = 0
+        return self._indexes[position]
+
+
+class ShardMap:
+    """
+    Addresses of all shards of the keyspace and the shard
+    served by this process
+    """
+
+    def __init__(self, addresses: List[Tuple[str, int]], own_index: int):
+        self.addresses = addresses
+        self.own_index = own_index
+        self._ring = HashRing([f'{host}:{port}' for host, port in addresses])
+
+    def is_sharded(self) -> bool:
+        return len(self.addresses) > 1
+
+    # Returns index of the shard owning the key
+    def get_shard_index(self, key: str) -> int:
+        return self._ring.get_node_index(key)
@@ -0,0 +1,139 @@
+import unittest
+from typing import FrozenSet, List, Optional, Tuple
+
+from cache import Cache
+from command_executor import execute_command
+from command_parser import parse_command
+from persistence import ChangeLog
+from value_store import SlabValueStore, ObjectValueStore, MAX_COUNTER
+
+
+class _RecordingLog(ChangeLog):
+    def __init__(self) -> None:
+        self.records: List[Tuple[str, bytes, Optional[int]]] = []
+
+    def record_set(
+            self,
+            key: str,
+            value: bytes,
+            expiration: int,
+            tags: FrozenSet[str] = frozenset()
+    ) -> None:
+        self.records.append((key, value, expiration))
+
+    def record_delete(self, key: str) -> None:
+        self.records.append((key, b'', None))
+
+
+class AtomicTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._cache = Cache(compression=None)
+        self._log = _RecordingLog()
+
+    def _execute(self, message: str, attachment: bytes = b'') -> bytes:
+        command_or_error = parse_command(message)
+        command = command_or_error.command
+        if command is None:
+            assert command_or_error.error is not None
+            return command_or_error.error.encode()
+        command.set_bytes_attachment(attachment)
+        return b''.join(
+            execute_command(command, self._cache, self._log).get_buffers())
+
+    """
+    Counters are created with the initial value, wrap around on overflow,
+    stop at 0 and keep the expiration of the item
+    """
+    def test_counters(self) -> None:
+        execute = self._execute
+        self.assertEqual(execute('incr hits 1'), b'NOT_FOUND\r\n')
+        self.assertEqual(execute('incr hits 1 10 100'), b'COUNTER 10\r\n')
+        self.assertEqual(execute('incr hits 5'), b'COUNTER 15\r\n')
+        self.assertEqual(execute('decr hits 20'), b'COUNTER 0\r\n')
+        self.assertEqual(execute('get hits'), b'1\r\n0\r\n')
+        expiration = self._cache.get_expiration('hits')
+        self.assertEqual(self._log.records[-1], ('hits', b'0', expiration))
+        self.assertNotEqual(expiration, 0)
+
+        self.assertEqual(execute(f'incr max 1 {MAX_COUNTER}'),
+                         f'COUNTER {MAX_COUNTER}\r\n'.encode())
+        self.assertEqual(execute('incr max 2'), b'COUNTER 1\r\n')
+
+        # values set as numbers become counters
+        self._cache.set_item('number', b'41', tags=['tag'])
+        self.assertEqual(execute('incr number 1'), b'COUNTER 42\r\n')
+        self.assertEqual(self._cache.find_keys_by_tag('tag'), ['number'])
+        self._cache.set_item('text', b'4a')
+        self.assertEqual(execute('incr text 1'), b'NOT_A_NUMBER\r\n')
+        self.assertTrue(execute('incr hits -1').startswith(b'Bad argument'))
+
+    """
+    Values are extended at either end keeping the expiration
+    """
+    def test_append(self) -> None:
+        execute = self._execute
+        self.assertEqual(execute('append list 2', b',b'), b'NOT_FOUND\r\n')
+        self._cache.set_item('list', b'b', ttl=100)
+        self.assertEqual(execute('append list 2', b',c'), b'SUCCESS\r\n')
+        self.assertEqual(execute('prepend list 2', b'a,'), b'SUCCESS\r\n')
+        self.assertEqual(self._cache.get_item('list'), b'a,b,c')
+        self.assertEqual(
+            self._log.records[-1],
+            ('list', b'a,b,c', self._cache.get_expiration('list')))
+
+        # counters turn into plain values
+        execute('incr counter 1 1')
+        self.assertEqual(execute('append counter 1', b'0'), b'SUCCESS\r\n')
+        self.assertEqual(execute('incr counter 1'), b'COUNTER 11\r\n')
+
+    """
+    The item is replaced only if its version is the one read by "gets",
+    every change of the item renews the version
+    """
+    def test_compare_and_set(self) -> None:
+        execute = self._execute
+        self.assertEqual(execute('gets item'), b'NOT_FOUND\r\n')
+        self.assertEqual(execute('cas item 0 1 1', b'a'), b'NOT_FOUND\r\n')
+        self._cache.set_item('item', b'a')
+        versioned_item = self._cache.get_versioned_item('item')
+        assert versioned_item is not None
+        value, version = versioned_item
+        self.assertEqual(execute('gets item'),
+                         f'VERSION {version} 1\r\na\r\n'.encode())
+
+        self.assertEqual(execute(f'cas item 0 1 {version}', b'b'),
+                         b'SUCCESS\r\n')
+        self.assertEqual(execute(f'cas item 0 1 {version}', b'c'),
+                         b'EXISTS\r\n')
+        self.assertEqual(self._cache.get_item('item'), b'b')
+
+        for message, attachment in (('append item 1', b'c'),
+                                    ('set item 0 1', b'd')):
+            version = self._cache.get_version('item')
+            execute(message, attachment)
+            self.assertNotEqual(self._cache.get_version('item'), version)
+
+    """
+    Counters are stored as integers and updated in place
+    """
+    def test_store_counters(self) -> None:
+        for store in (ObjectValueStore(), SlabValueStore()):
+            handle = store.put_counter(MAX_COUNTER, 5, 1)
+            self.assertEqual(store.get_counter(handle), MAX_COUNTER)
+            self.assertEqual(store.get_value(handle),
+                             str(MAX_COUNTER).encode())
+            handle = store.set_counter(handle, 7, 2)
+            self.assertEqual(store.get_counter(handle), 7)
+            self.assertEqual(store.get_value(handle), b'7')
+            self.assertEqual(store.get_version(handle), 2)
+            self.assertEqual(store.get_expiration(handle), 5)
+            self.assertFalse(store.is_compressed(handle))
+
+            plain = store.put(b'7', 5, version=3)
+            self.assertIsNone(store.get_counter(plain))
+            self.assertEqual(store.get_version(plain), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
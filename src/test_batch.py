@@ -0,0 +1,54 @@
+import asyncio
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from config import PORT, HOST
+from test_utils import send_message, receive_message, decode_and_trim,\
+    SUCCESS, SEPARATOR_BINARY
+
+
+class BatchTest(IsolatedAsyncioTestCase):
+
+    """
+    Multi-key commands: mset, mget and mdel
+    """
+    async def test_batch(self) -> None:
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+
+        values = {'batch_a': b'1', 'batch_b': b'', 'batch_c': b'a\r\nb'}
+
+        # insert all items at once
+        header = ' '.join(
+            f'{key} 0 {len(value)}' for key, value in values.items())
+        await send_message(f'mset {header}', writer)
+        await receive_message(reader)
+        await send_message(SEPARATOR_BINARY.join(values.values()), writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), SUCCESS)
+
+        # read them back along with a missing key
+        await send_message(
+            'mget batch_a batch_missing batch_b batch_c', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), 'VALUES 1 -1 0 4')
+        response = await receive_message(reader, 1 + 2 + 0 + 2 + 4)
+        self.assertEqual(response, b'1\r\n\r\na\r\nb\r\n')
+
+        # delete them
+        await send_message('mdel batch_a batch_missing batch_b', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), 'DELETED 2')
+        await send_message('mget batch_a batch_c', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), 'VALUES -1 4')
+        await receive_message(reader, 4)
+        await send_message('mdel batch_c', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), 'DELETED 1')
+
+        writer.close()
+        await writer.wait_closed()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import asyncio
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from config import PORT, HOST
+from binary_protocol import REQUEST_HEADER, RESPONSE_HEADER,\
+    REQUEST_MAGIC, RESPONSE_MAGIC, OPCODE_GET, OPCODE_SET, OPCODE_DELETE,\
+    OPCODE_NOOP, STATUS_SUCCESS, STATUS_NOT_FOUND, STATUS_UNKNOWN_COMMAND
+
+
+_NUMBER_OF_ITEMS = 100
+
+
+def _build_request(
+        opcode: int, key: str = '', value: bytes = b'', ttl: int = 0,
+        opaque: int = 0
+) -> bytes:
+    key_data = key.encode()
+    return REQUEST_HEADER.pack(
+        REQUEST_MAGIC, opcode, len(key_data), ttl, len(value), opaque
+    ) + key_data + value
+
+
+async def _receive_response(
+        reader: asyncio.StreamReader) -> tuple:
+    header = await reader.readexactly(RESPONSE_HEADER.size)
+    magic, opcode, status, value_length, opaque =\
+        RESPONSE_HEADER.unpack(header)
+    value = await reader.readexactly(value_length)
+    return magic, opcode, status, value, opaque
+
+
+class BinaryProtocolTest(IsolatedAsyncioTestCase):
+
+    """
+    Sends a batch of requests in the binary protocol
+    and matches the responses by their opaque ids
+    """
+    async def test_binary_protocol(self) -> None:
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+
+        batch = b''
+        for index in range(_NUMBER_OF_ITEMS):
+            batch += _build_request(
+                OPCODE_SET, f'binary_{index}', bytes([index]) * index,
+                opaque=index)
+        writer.write(batch)
+        await writer.drain()
+        for index in range(_NUMBER_OF_ITEMS):
+            response = await _receive_response(reader)
+            self.assertEqual(
+                response, (RESPONSE_MAGIC, OPCODE_SET, STATUS_SUCCESS, b'',
+                           index))
+
+        writer.write(b''.join(
+            _build_request(OPCODE_GET, f'binary_{index}', opaque=index)
+            for index in range(_NUMBER_OF_ITEMS)
+        ))
+        await writer.drain()
+        for index in range(_NUMBER_OF_ITEMS):
+            _, opcode, status, value, opaque = await _receive_response(reader)
+            self.assertEqual(opcode, OPCODE_GET)
+            self.assertEqual(status, STATUS_SUCCESS)
+            self.assertEqual(value, bytes([index]) * index)
+            self.assertEqual(opaque, index)
+
+        writer.write(
+            _build_request(OPCODE_DELETE, 'binary_1', opaque=1) +
+            _build_request(OPCODE_GET, 'binary_1', opaque=2) +
+            _build_request(OPCODE_DELETE, 'binary_1', opaque=3) +
+            _build_request(0x55, opaque=4) +
+            _build_request(OPCODE_NOOP, opaque=5)
+        )
+        await writer.drain()
+        statuses = [
+            (await _receive_response(reader))[2] for _ in range(5)
+        ]
+        self.assertEqual(statuses, [
+            STATUS_SUCCESS, STATUS_NOT_FOUND, STATUS_NOT_FOUND,
+            STATUS_UNKNOWN_COMMAND, STATUS_SUCCESS
+        ])
+
+        writer.close()
+        await writer.wait_closed()
+
+
+if __name__ == "__main__":
+    unittest.main()
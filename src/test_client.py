@@ -0,0 +1,129 @@
+import asyncio
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from client import Client
+from config import PORT, HOST, MAX_MESSAGE_SIZE
+
+
+class ClientTest(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self._client = await Client.discover(HOST, PORT, pool_size=2)
+
+    async def asyncTearDown(self) -> None:
+        await self._client.close()
+
+    """
+    Single-key operations
+    """
+    async def test_items(self) -> None:
+        client = self._client
+        await client.set('client_key', b'a\r\nb')
+        self.assertEqual(await client.get('client_key'), b'a\r\nb')
+        await client.set('client_key', b'', ttl=100)
+        self.assertEqual(await client.get('client_key'), b'')
+        self.assertTrue(await client.delete('client_key'))
+        self.assertFalse(await client.delete('client_key'))
+        self.assertIsNone(await client.get('client_key'))
+
+        # rejected before sending, the connection stays usable
+        with self.assertRaises(ValueError):
+            await client.set('invalid key', b'value')
+        with self.assertRaises(ValueError):
+            await client.set('client_key', b'x' * (MAX_MESSAGE_SIZE + 1))
+        self.assertIsNone(await client.get('client_key'))
+
+    """
+    Batches, including the ones split into several commands
+    """
+    async def test_batches(self) -> None:
+        client = self._client
+        items = [
+            (f'client_batch_{index}', str(index).encode(), 0)
+            for index in range(100)
+        ]
+        # doesn't fit in a single message
+        large_value = b'x' * (MAX_MESSAGE_SIZE // 2 + 1)
+        items += [('client_large_a', large_value, 0),
+                  ('client_large_b', large_value, 0)]
+        await client.set_many(items)
+
+        keys = [key for key, _, _ in items]
+        self.assertEqual(
+            await client.get_many(keys + ['client_missing']),
+            [value for _, value, _ in items] + [None])
+        self.assertEqual(
+            await client.delete_many(keys[:50] + ['client_missing']), 50)
+        self.assertEqual(
+            await client.get_many(keys[49:51]), [None, b'50'])
+        self.assertEqual(await client.delete_many(keys[50:]), 52)
+
+    """
+    Items are deleted by the prefix and the tags on all servers
+    """
+    async def test_invalidation(self) -> None:
+        client = self._client
+        await client.set('client_inv:1', b'1', tags=['client_tag'])
+        await client.set('client_inv:2', b'2', tags=['client_tag', 'other'])
+        await client.set('client_inv:3', b'3')
+        self.assertEqual(await client.delete_tag('client_tag'), 2)
+        self.assertEqual(await client.delete_prefix('client_inv:'), 1)
+        self.assertEqual(await client.get_many(
+            ['client_inv:1', 'client_inv:2', 'client_inv:3']),
+            [None, None, None])
+        with self.assertRaises(ValueError):
+            await client.set('client_inv:1', b'1', tags=['a,b'])
+
+    """
+    Counters, appends and compare-and-set take a single request
+    """
+    async def test_atomic(self) -> None:
+        client = self._client
+        self.assertIsNone(await client.increment('client_counter'))
+        self.assertEqual(
+            await client.increment('client_counter', 1, initial=5, ttl=100),
+            5)
+        self.assertEqual(await client.increment('client_counter', 3), 8)
+        self.assertEqual(await client.decrement('client_counter', 10), 0)
+
+        self.assertFalse(await client.append('client_list', b'b'))
+        await client.set('client_list', b'b')
+        self.assertTrue(await client.append('client_list', b',c'))
+        self.assertTrue(await client.prepend('client_list', b'a,'))
+        versioned = await client.get_versioned('client_list')
+        assert versioned is not None
+        value, version = versioned
+        self.assertEqual(value, b'a,b,c')
+        self.assertTrue(
+            await client.compare_and_set('client_list', b'x', version))
+        self.assertFalse(
+            await client.compare_and_set('client_list', b'y', version))
+        self.assertEqual(await client.get('client_list'), b'x')
+        await client.delete_many(['client_counter', 'client_list'])
+
+    """
+    Simultaneous requests are pipelined over the bounded pool
+    and each one gets its own response
+    """
+    async def test_pipelining(self) -> None:
+        client = self._client
+        await client.set_many([
+            (f'client_pipelined_{index}', str(index).encode(), 0)
+            for index in range(500)
+        ])
+        values = await asyncio.gather(*(
+            client.get(f'client_pipelined_{index}') for index in range(500)
+        ))
+        self.assertEqual(values, [str(index).encode() for index in range(500)])
+
+        stats = await client.get_stats()
+        self.assertEqual(list(stats), [f'{HOST}:{PORT}'])
+        # the stats connection itself is one of them
+        self.assertLessEqual(stats[f'{HOST}:{PORT}']['connections'], 2)
+        await client.delete_many(
+            [f'client_pipelined_{index}' for index in range(500)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from cache import Cache
+from command_executor import execute_command
+from command_parser import parse_command
+from compression import Compressor, COMPRESSION_ZLIB, COMPRESSION_LZMA
+from value_store import SlabValueStore
+
+
+# a large value that compresses well
+_VALUE = json.dumps(
+    [{'id': index, 'name': f'item {index}'} for index in range(5000)]
+).encode()
+_SMALL_VALUE = b'{"id": 1}'
+
+
+class CompressionTest(unittest.TestCase):
+
+    """
+    Large values are compressed, taking less memory,
+    and are returned as they were stored
+    """
+    def test_compression(self) -> None:
+        for algorithm in (COMPRESSION_ZLIB, COMPRESSION_LZMA):
+            plain = Cache(compression=None)
+            plain.set_item('key', _VALUE)
+            cache = Cache(compression=algorithm)
+            cache.set_item('key', _VALUE)
+            cache.set_item('small_key', _SMALL_VALUE)
+
+            stats = cache.get_stats()
+            self.assertEqual(stats['compressed_items'], 1)
+            self.assertLess(
+                stats['memory_bytes'] * 5, plain.get_stats()['memory_bytes'])
+            self.assertEqual(cache.get_item('key'), _VALUE)
+            self.assertEqual(cache.get_item('small_key'), _SMALL_VALUE)
+            self.assertEqual(
+                [value for _, value, _, _ in cache.iter_items()],
+                [_VALUE, _SMALL_VALUE])
+
+            cache.delete_item('key')
+            self.assertEqual(cache.get_stats()['compressed_items'], 0)
+
+    """
+    Compressed values are returned by "cget" as they are stored
+    """
+    def test_compressed_get(self) -> None:
+        cache = Cache(compression=COMPRESSION_ZLIB)
+        cache.set_item('key', _VALUE, prepared=cache.prepare_value(_VALUE))
+        cache.set_item('small_key', _SMALL_VALUE)
+
+        def execute(message: str) -> bytes:
+            command = parse_command(message).command
+            assert command is not None
+            return b''.join(execute_command(command, cache).get_buffers())
+
+        stored = cache.get_stored_item('key')
+        assert stored is not None
+        self.assertTrue(stored.compressed)
+        self.assertEqual(
+            execute('cget key'),
+            f'COMPRESSED zlib {len(stored.data)}\r\n'.encode() +
+            stored.data + b'\r\n')
+        self.assertEqual(execute('cget small_key'), b'9\r\n' +
+                         _SMALL_VALUE + b'\r\n')
+        self.assertEqual(execute('cget missing_key'), b'NOT_FOUND\r\n')
+
+    """
+    The values of "mset" and "append" prepared in advance are stored
+    as they are, the append prepared from an outdated item is redone
+    """
+    def test_prepared_values(self) -> None:
+        cache = Cache(compression=COMPRESSION_ZLIB)
+        prepared = cache.prepare_values([_VALUE, _SMALL_VALUE])
+        appended = _VALUE + _SMALL_VALUE
+        with patch.object(Compressor, 'compress', side_effect=AssertionError):
+            self.assertEqual(
+                cache.set_items(
+                    [('key', _VALUE, 0), ('small_key', _SMALL_VALUE, 0)],
+                    prepared),
+                [True, True])
+            stored = cache.get_stored_version('key')
+            assert stored is not None
+            self.assertTrue(stored[0].compressed)
+            self.assertEqual(cache.get_stats()['hits'], 0)
+        update = cache.prepare_update(*stored, _SMALL_VALUE)
+        self.assertEqual(update.value, appended)
+        with patch.object(Compressor, 'compress', side_effect=AssertionError):
+            self.assertEqual(
+                cache.append_item('key', _SMALL_VALUE, prepared=update),
+                appended)
+        self.assertEqual(cache.get_item('key'), appended)
+        self.assertEqual(cache.get_stats()['compressed_items'], 1)
+
+        self.assertEqual(
+            cache.append_item('key', b'!', prepend=True, prepared=update),
+            b'!' + appended)
+        self.assertIsNone(cache.get_stored_version('missing_key'))
+
+    def test_slab_flag(self) -> None:
+        store = SlabValueStore()
+        compressed = store.put(b'compressed', 1, compressed=True)
+        plain = store.put(b'plain', 2)
+        self.assertTrue(store.is_compressed(compressed))
+        self.assertFalse(store.is_compressed(plain))
+        self.assertEqual(store.get_value(compressed), b'compressed')
+        self.assertEqual(store.get_expiration(compressed), 1)
+        self.assertEqual(store.get_value(plain), b'plain')
+
+
+if __name__ == '__main__':
+    unittest.main()
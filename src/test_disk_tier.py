@@ -0,0 +1,140 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cache import Cache
+from compression import Compressor, StoredValue, COMPRESSION_ZLIB
+from disk_tier import DiskTier
+
+
+class DiskTierTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._directory.name, 'tier')
+
+    def tearDown(self) -> None:
+        self._directory.cleanup()
+
+    def _create_tier(self, size: int) -> DiskTier:
+        tier = DiskTier(self._path, size)
+        self.addCleanup(tier.close)
+        return tier
+
+    """
+    Evicted items are moved to the disk and back once requested
+    """
+    def test_demotion(self) -> None:
+        tier = self._create_tier(4096)
+        cache = Cache(max_number_of_items=2, eviction_policy='lru',
+                      compression=None, disk_tier=tier)
+        cache.set_item('first', b'1')
+        cache.set_item('second', b'2')
+        cache.set_item('third', b'3', ttl=100)
+        self.assertEqual(len(tier), 1)
+
+        self.assertEqual(cache.get_item('first'), b'1')
+        # "second" is the least recently used one now
+        self.assertEqual(cache.get_item('second'), b'2')
+        self.assertEqual(cache.get_item('third'), b'3')
+        stats = cache.get_stats()
+        self.assertEqual(stats['disk_hits'], 3)
+        self.assertEqual(stats['disk_items'], 1)
+        self.assertEqual(stats['misses'], 0)
+
+        # the demoted copies are dropped on replacing and deleting
+        cache.set_item('first', b'new')
+        self.assertEqual(cache.get_item('first'), b'new')
+        self.assertTrue(cache.delete_item('second'))
+        self.assertFalse(cache.delete_item('second'))
+        self.assertIsNone(cache.get_item('second'))
+
+    """
+    The oldest records are overwritten once the writes wrap around
+    """
+    def test_wraparound(self) -> None:
+        tier = self._create_tier(200)
+        value = StoredValue(b'x' * 40, False)
+        for index in range(8):
+            self.assertTrue(tier.put(f'key{index}', value, 0))
+        self.assertFalse(tier.put('large', StoredValue(b'x' * 300, False), 0))
+
+        self.assertIsNone(tier.take('key0'))
+        self.assertIsNone(tier.take('key3'))
+        item = tier.take('key7')
+        assert item is not None
+        self.assertEqual(item.value, value)
+        # taken items are removed
+        self.assertIsNone(tier.take('key7'))
+        self.assertLessEqual(len(tier), 4)
+
+    """
+    Compressed values keep their flag and expiration on the disk
+    """
+    def test_compressed_values(self) -> None:
+        tier = self._create_tier(4096)
+        tier.put('key', StoredValue(b'compressed', True), 123)
+        tier.put('plain_key', StoredValue(b'plain', False), 0)
+        self.assertEqual(
+            tier.take('key'), (StoredValue(b'compressed', True), 123))
+        self.assertEqual(
+            tier.take('plain_key'), (StoredValue(b'plain', False), 0))
+
+        cache = Cache(max_number_of_items=1, compression=COMPRESSION_ZLIB,
+                      disk_tier=tier)
+        value = b'value ' * 5000
+        cache.set_item('key', value)
+        cache.set_item('other_key', b'other')
+        # the promoted item keeps the form it's stored in
+        with patch.object(Compressor, 'compress', side_effect=AssertionError):
+            self.assertEqual(cache.get_item('key'), value)
+        self.assertEqual(cache.get_stats()['compressed_items'], 1)
+
+    """
+    Keys longer than 64 KiB are demoted like any other ones
+    """
+    def test_long_keys(self) -> None:
+        tier = self._create_tier(1024 * 1024)
+        cache = Cache(max_number_of_items=2, eviction_policy='lru',
+                      compression=None, disk_tier=tier)
+        long_key = 'k' * 70000
+        cache.set_item(long_key, b'long')
+        cache.set_item('first', b'1')
+        cache.set_item('second', b'2')
+        self.assertEqual(cache.get_stats()['items'], 2)
+        self.assertEqual(len(tier), 1)
+        self.assertEqual(cache.get_item(long_key), b'long')
+        self.assertEqual(cache.get_stats()['items'], 2)
+
+    """
+    Items overwritten on the disk are removed from the indexes, along with
+    the ones which keys collide with the hash of a newer demoted key
+    """
+    def test_overwritten_items_unindexed(self) -> None:
+        tier = self._create_tier(64 * 1024)
+        cache = Cache(max_number_of_items=10, eviction_policy='lru',
+                      compression=None, disk_tier=tier)
+        for index in range(20000):
+            cache.set_item(f'key{index}', b'x' * 50, tags=['tag'])
+        stored = cache.get_stats()['items'] + len(tier)
+        self.assertLess(stored, 1000)
+        # the latest items are in the memory and on the disk
+        keys = {f'key{index}' for index in range(20000 - stored, 20000)}
+        self.assertEqual(set(cache.find_keys_by_prefix('key')), keys)
+        self.assertEqual(set(cache.find_keys_by_tag('tag')), keys)
+
+        with patch('disk_tier.hash', return_value=0, create=True):
+            tier.put('first', StoredValue(b'1', False), 0)
+            dropped = []
+            tier.set_drop_callback(dropped.append)
+            tier.put('second', StoredValue(b'2', False), 0)
+            self.assertEqual(dropped, ['first'])
+            # the entry of another key is kept
+            tier.remove('first')
+            self.assertEqual(
+                tier.take('second'), (StoredValue(b'2', False), 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
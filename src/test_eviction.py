@@ -0,0 +1,101 @@
+import unittest
+from typing import List
+
+from cache import SlruPolicy, TinyLfuPolicy, _FrequencySketch
+
+
+class EvictionTest(unittest.TestCase):
+
+    """
+    Accessed items are promoted from probation to the protected segment,
+    the overflow of the protected segment is demoted back to probation,
+    which is evicted from first
+    """
+    def test_slru_promotion(self) -> None:
+        # 4 of the items are protected
+        policy = SlruPolicy(5)
+        for key in 'abcdef':
+            policy.on_insert(key)
+        self.assertEqual(policy.select_victim(), 'a')
+
+        for key in 'abcde':
+            policy.on_access(key)
+        # "a" is the least recently used protected item
+        self.assertEqual(policy.select_victim(), 'f')
+        policy.on_remove('f')
+        self.assertEqual(policy.select_victim(), 'a')
+
+        # accessed again, "a" is protected and "b" is demoted instead
+        policy.on_access('a')
+        self.assertEqual(policy.select_victim(), 'b')
+        policy.on_remove('b')
+        self.assertEqual(len(policy), 4)
+        # with probation empty the protected items are evicted
+        self.assertEqual(policy.select_victim(), 'c')
+        policy.on_remove('c')
+        self.assertEqual(policy.select_victim(), 'd')
+
+    """
+    Items leaving the window are rejected while they were seen less often
+    than the eviction candidate of the main segment, and admitted once
+    they were seen more often
+    """
+    def test_tiny_lfu_admission(self) -> None:
+        # the window holds 10 items
+        policy = TinyLfuPolicy(1000)
+        hot_keys = [f'hot{index}' for index in range(10)]
+        for key in hot_keys:
+            policy.on_insert(key)
+            for _ in range(4):
+                policy.on_access(key)
+        # the cache isn't full yet, the hot items enter probation
+        for index in range(10):
+            policy.on_insert(f'filler{index}')
+
+        # the cache is full from now on
+        def insert(key: str) -> str:
+            policy.on_insert(key)
+            victim = policy.select_victim()
+            policy.on_remove(victim)
+            return victim
+
+        evicted: List[str] = [insert(f'cold{index}') for index in range(20)]
+        self.assertEqual(
+            evicted,
+            [f'filler{index}' for index in range(10)] +
+            [f'cold{index}' for index in range(10)])
+
+        # the accessed item moves to the end of the window
+        for _ in range(10):
+            policy.on_access('cold10')
+        self.assertEqual(
+            [insert(f'new{index}') for index in range(10)],
+            [f'cold{index}' for index in range(11, 20)] + ['hot0'])
+
+    """
+    Counters are capped and halved once the sketch has been incremented
+    the number of times proportional to its capacity
+    """
+    def test_sketch_aging(self) -> None:
+        sketch = _FrequencySketch(16)
+        for _ in range(20):
+            sketch.increment('key')
+        self.assertEqual(sketch.estimate('key'), 15)
+
+        previous = 15
+        for index in range(1000):
+            sketch.increment(f'other{index}')
+            estimate = sketch.estimate('key')
+            if estimate < previous:
+                break
+            previous = estimate
+        else:
+            self.fail('The counters are never halved')
+        # 160 increments are needed, 15 of them were made by the key
+        self.assertGreaterEqual(index + 1, 160 - 15)
+        # the capped counters of the key are halved exactly
+        self.assertEqual(estimate, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import random
+import time
+import unittest
+from typing import Dict, Set
+
+from expiration_index import ExpirationIndex, HeapExpirationIndex,\
+    TimingWheelExpirationIndex, _TICK, _SLOT_BITS, _LEVELS_NUMBER
+
+
+_KEYS_NUMBER = 300
+_STEPS = 2000
+# keys returned by one call, small to exercise the batches
+_LIMIT = 7
+# the furthest level of the wheel covers this number of ticks
+_WHEEL_RANGE = 1 << (_SLOT_BITS * _LEVELS_NUMBER)
+
+
+def _pop_all_expired(index: ExpirationIndex, now: int) -> Set[str]:
+    result: Set[str] = set()
+    while True:
+        keys = index.pop_expired(now, _LIMIT)
+        result.update(keys)
+        if len(keys) < _LIMIT:
+            return result
+
+
+class ExpirationIndexTest(unittest.TestCase):
+
+    """
+    The timing wheel returns the same keys as the heap when the time
+    is sampled at the tick boundaries: with deadlines on every level
+    of the wheel and beyond it, keys re-added with another deadline,
+    removed, and added with a deadline in the past
+    """
+    def test_same_as_heap(self) -> None:
+        generator = random.Random(1)
+        heap = HeapExpirationIndex()
+        wheel = TimingWheelExpirationIndex()
+        # the wheel starts at the current tick
+        tick = time.time_ns() // _TICK + 1
+        # deadline ticks of the tracked keys
+        deadlines: Dict[str, int] = {}
+
+        def add(key: str, deadline_tick: int) -> None:
+            # deadlines fall in the middle of a tick, the wheel returns
+            # the keys of the tick once it has passed
+            expiration = deadline_tick * _TICK + _TICK // 2
+            heap.add(key, expiration)
+            wheel.add(key, expiration)
+            deadlines[key] = deadline_tick
+
+        for step in range(_STEPS):
+            key = f'key{generator.randrange(_KEYS_NUMBER)}'
+            operation = generator.random()
+            if operation < 0.5:
+                span = generator.choice(
+                    [1 << 8, 1 << 16, 1 << 24, _WHEEL_RANGE])
+                delay = generator.randrange(span)
+                if span == _WHEEL_RANGE and generator.random() < 0.5:
+                    # beyond the furthest level
+                    delay += _WHEEL_RANGE
+                add(key, tick + delay)
+            elif operation < 0.6:
+                add(key, tick - generator.randrange(1, 100))
+            elif operation < 0.7:
+                heap.remove(key)
+                wheel.remove(key)
+                deadlines.pop(key, None)
+            else:
+                pending = [
+                    deadline for deadline in deadlines.values()
+                    if deadline >= tick
+                ]
+                if pending and generator.random() < 0.5:
+                    # right before or right after the nearest deadline,
+                    # which tells a key returned a tick late
+                    tick = max(tick + 1,
+                               min(pending) + generator.randrange(2))
+                else:
+                    tick += generator.choice(
+                        [1, generator.randrange(1, 1 << 8),
+                         generator.randrange(1, 1 << 16),
+                         generator.randrange(1, 1 << 26)])
+                now = tick * _TICK
+                expired = _pop_all_expired(heap, now)
+                self.assertEqual(_pop_all_expired(wheel, now), expired,
+                                 f'step {step}')
+                for key in expired:
+                    del deadlines[key]
+
+        # the remaining keys are returned once their deadlines pass
+        self.assertTrue(deadlines)
+        now = (tick + 3 * _WHEEL_RANGE) * _TICK
+        self.assertEqual(_pop_all_expired(heap, now), set(deadlines))
+        self.assertEqual(_pop_all_expired(wheel, now), set(deadlines))
+
+    """
+    Keys are returned at most one tick after their expiration
+    """
+    def test_tick_precision(self) -> None:
+        wheel = TimingWheelExpirationIndex()
+        tick = time.time_ns() // _TICK + 1
+        wheel.add('key', tick * _TICK + 1)
+        self.assertEqual(wheel.pop_expired(tick * _TICK + 2, _LIMIT), [])
+        self.assertEqual(wheel.pop_expired((tick + 1) * _TICK, _LIMIT),
+                         ['key'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from cache import Cache
+from config import PORT, HOST
+from disk_tier import DiskTier
+from key_index import PrefixIndex
+from test_utils import send_message, receive_message, decode_and_trim,\
+    SUCCESS
+
+
+class KeyIndexTest(unittest.TestCase):
+
+    """
+    Prefixes match whole segments and the beginning of the last one
+    """
+    def test_prefix_index(self) -> None:
+        index = PrefixIndex()
+        for key in ('user:1', 'user:1:name', 'user:12', 'users', 'item:1'):
+            index.add(key)
+        index.add('user:1')
+        self.assertEqual(len(index), 5)
+
+        self.assertEqual(sorted(index.find('user:1')),
+                         ['user:1', 'user:12', 'user:1:name'])
+        self.assertEqual(index.find('user:1:'), ['user:1:name'])
+        self.assertEqual(sorted(index.find('user')),
+                         ['user:1', 'user:12', 'user:1:name', 'users'])
+        self.assertEqual(len(index.find('')), 5)
+        self.assertEqual(index.find('order:'), [])
+
+        index.remove('user:1')
+        index.remove('user:1')
+        index.remove('user:missing')
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.find('user:1:'), ['user:1:name'])
+        index.remove('user:1:name')
+        self.assertEqual(index.find('user:1:'), [])
+
+    """
+    Evicted, expired and replaced items leave the indexes,
+    the ones moved to the disk tier stay in them
+    """
+    def test_cache_indexes(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            tier = DiskTier(os.path.join(directory, 'tier'), 4096)
+            self.addCleanup(tier.close)
+            for prefix_index in (True, False):
+                cache = Cache(max_number_of_items=2, eviction_policy='lru',
+                              compression=None, prefix_index=prefix_index)
+                self._check_indexes(cache)
+            # the prefix index is enabled along with the disk tier
+            cache = Cache(max_number_of_items=1, eviction_policy='lru',
+                          compression=None, prefix_index=False,
+                          disk_tier=tier)
+            cache.set_item('a:1', b'1', tags=['red'])
+            cache.set_item('a:2', b'2', tags=['red'])
+            self.assertEqual(sorted(cache.find_keys_by_tag('red')),
+                             ['a:1', 'a:2'])
+            self.assertEqual(sorted(cache.find_keys_by_prefix('a:')),
+                             ['a:1', 'a:2'])
+            # the promoted item keeps its tags
+            self.assertEqual(cache.get_item('a:1'), b'1')
+            self.assertEqual(cache.delete_items(
+                cache.find_keys_by_tag('red')), 2)
+            self.assertEqual(cache.find_keys_by_prefix('a:'), [])
+
+            # the demoted items are deleted by their prefix
+            cache.set_item('b:1', b'1')
+            cache.set_item('b:2', b'2')
+            self.assertEqual(cache.delete_items(
+                cache.find_keys_by_prefix('b:')), 2)
+            self.assertIsNone(cache.get_item('b:1'))
+            self.assertIsNone(cache.get_item('b:2'))
+
+    def _check_indexes(self, cache: Cache) -> None:
+        cache.set_item('a:1', b'1', tags=['red', 'blue'])
+        cache.set_item('a:2', b'2', tags=['red'])
+        self.assertEqual(sorted(cache.find_keys_by_tag('red')),
+                         ['a:1', 'a:2'])
+        # replacing the item replaces its tags
+        cache.set_item('a:1', b'1')
+        self.assertEqual(cache.find_keys_by_tag('red'), ['a:2'])
+        self.assertEqual(cache.find_keys_by_tag('blue'), [])
+
+        cache.set_item('b:1', b'3', tags=['red'])
+        cache.set_item('b:2', b'4')
+        # "a:1" and "a:2" are evicted
+        self.assertEqual(cache.find_keys_by_tag('red'), ['b:1'])
+        self.assertEqual(cache.find_keys_by_prefix('a:'), [])
+        self.assertEqual(sorted(cache.find_keys_by_prefix('b')),
+                         ['b:1', 'b:2'])
+        cache.delete_item('b:1')
+        self.assertEqual(cache.find_keys_by_tag('red'), [])
+
+
+class InvalidationTest(IsolatedAsyncioTestCase):
+
+    """
+    Items are deleted by the prefix of their keys and by their tags
+    """
+    async def test_invalidation(self) -> None:
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+
+        items = [('inv:user:1:name', 'inv_a,inv_b'),
+                 ('inv:user:1:avatar', 'inv_a'),
+                 ('inv:user:2:name', ''),
+                 ('inv:item:1', 'inv_b')]
+        for key, tags in items:
+            await send_message(f'set {key} 0 1 {tags}'.strip(), writer)
+            await receive_message(reader)
+            await send_message('1', writer)
+            response = await receive_message(reader)
+            self.assertEqual(decode_and_trim(response), SUCCESS)
+
+        await send_message('delprefix inv:user:1:', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), 'DELETED 2')
+        await send_message('deltag inv_a', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), 'DELETED 0')
+        await send_message('deltag inv_b', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), 'DELETED 1')
+        await send_message('delprefix inv:', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), 'DELETED 1')
+
+        await send_message('delprefix', writer)
+        response = await receive_message(reader)
+        self.assertNotEqual(decode_and_trim(response)[:7], 'DELETED')
+
+        writer.close()
+        await writer.wait_closed()
+
+
+if __name__ == '__main__':
+    unittest.main()
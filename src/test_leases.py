@@ -0,0 +1,88 @@
+import time
+import unittest
+from typing import List
+
+from cache import Cache
+from command_executor import execute_command
+from command_parser import parse_command
+from leases import LeaseTable
+
+
+class LeaseTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._cache = Cache(max_number_of_items=100, stale_time=10)
+        self._leases = LeaseTable(timeout=1)
+
+    def _execute(self, message: str, attachment: bytes = b'') -> List[bytes]:
+        command = parse_command(message).command
+        assert command is not None
+        command.set_bytes_attachment(attachment)
+        response = execute_command(
+            command, self._cache, leases=self._leases)
+        return [bytes(buffer) for buffer in response.get_buffers()]
+
+    def _acquire(self, key: str) -> int:
+        response = self._execute(f'lget {key}')
+        self.assertEqual(response[0][:6], b'LEASE ')
+        return int(response[0][6:])
+
+    """
+    Only the first client which misses the item gets the lease,
+    the item filled by the lease holder is returned to everyone
+    """
+    def test_lease(self) -> None:
+        token = self._acquire('key')
+        self.assertEqual(self._execute('lget key'), [b'WAIT\r\n'])
+        self.assertEqual(
+            self._execute(f'lset key {token + 1} 0 5', b'value'),
+            [b'INVALID_LEASE\r\n'])
+        self.assertEqual(
+            self._execute(f'lset key {token} 0 5', b'value'),
+            [b'SUCCESS\r\n'])
+        self.assertEqual(
+            self._execute('lget key'), [b'5\r\n', b'value', b'\r\n'])
+        # the lease is released once the item is filled
+        self.assertEqual(
+            self._execute(f'lset key {token} 0 5', b'value'),
+            [b'INVALID_LEASE\r\n'])
+
+    """
+    Changes of the item invalidate its lease,
+    the lease expires if it's not used
+    """
+    def test_invalidation(self) -> None:
+        token = self._acquire('key')
+        self._execute('del key')
+        self.assertEqual(
+            self._execute(f'lset key {token} 0 5', b'value'),
+            [b'INVALID_LEASE\r\n'])
+
+        self._acquire('key')
+        self.assertEqual(self._execute('lget key'), [b'WAIT\r\n'])
+        time.sleep(1.1)
+        self._acquire('key')
+
+    """
+    While the lease holder regenerates the expired item,
+    the others get its stale value
+    """
+    def test_stale_value(self) -> None:
+        self._execute('set key 1 5', b'value')
+        time.sleep(1.1)
+        self.assertEqual(self._execute('get key'), [b'NOT_FOUND\r\n'])
+        self._acquire('key')
+        self.assertEqual(
+            self._execute('lget key'), [b'STALE 5\r\n', b'value', b'\r\n'])
+
+        # without the stale time expired items are never served
+        self._cache = Cache(max_number_of_items=100, stale_time=0)
+        self._leases = LeaseTable(timeout=1)
+        self._execute('set key 1 5', b'value')
+        time.sleep(1.1)
+        self._acquire('key')
+        self.assertEqual(self._execute('lget key'), [b'WAIT\r\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import server_logging
+from config import LOG_MAX_PAYLOAD_SIZE
+from server_logging import logger, setup_logging, ConnectionLog
+
+
+class LoggingTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        level = logger.level
+        handlers = logger.handlers
+        propagate = logger.propagate
+
+        def restore() -> None:
+            logger.setLevel(level)
+            logger.handlers = handlers
+            logger.propagate = propagate
+        self.addCleanup(restore)
+
+    """
+    Records of the configured level and above are written
+    by the listener thread, the others are dropped
+    """
+    def test_levels(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.log')
+            with patch.object(server_logging, 'LOG_FILE', path),\
+                    patch.object(server_logging, 'LOG_LEVEL', 'WARNING'):
+                listener = setup_logging()
+            logger.info('Not written')
+            logger.warning('Written %d', 1)
+            logger.error('Written %d', 2)
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+            with open(path) as file:
+                lines = file.read().splitlines()
+
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith(
+            f'WARNING [{os.getpid()}] Written 1'))
+        self.assertTrue(lines[1].endswith(f'ERROR [{os.getpid()}] Written 2'))
+
+    """
+    The received messages are logged truncated, copied from the buffer
+    they were received to, and only for the sampled connections
+    """
+    def test_connection_log(self) -> None:
+        buffer = bytearray(b'x' * (LOG_MAX_PAYLOAD_SIZE + 50))
+        with self.assertLogs(logger, logging.DEBUG) as logs,\
+                patch.object(server_logging, 'LOG_SAMPLE_RATE', 1.0):
+            log = ConnectionLog('peer')
+            self.assertTrue(log.sampled)
+            log.received(memoryview(buffer))
+            buffer[:] = b'y' * len(buffer)
+        self.assertEqual(len(logs.records), 1)
+        record = logs.records[0]
+        self.assertEqual(
+            record.args,
+            (len(buffer), 'peer', b'x' * LOG_MAX_PAYLOAD_SIZE))
+
+        logger.setLevel(logging.DEBUG)
+        with patch.object(server_logging, 'LOG_SAMPLE_RATE', 0):
+            self.assertFalse(ConnectionLog('peer').sampled)
+        logger.setLevel(logging.INFO)
+        self.assertFalse(ConnectionLog('peer').sampled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from offload import OffloadScheduler
+
+
+class OffloadTest(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self._scheduler = OffloadScheduler(
+            threads=2, max_in_flight_bytes=100)
+
+    async def asyncTearDown(self) -> None:
+        self._scheduler.close()
+
+    """
+    Values are admitted in the order of arrival within the limit,
+    a value larger than the limit is admitted alone
+    """
+    async def test_admission(self) -> None:
+        scheduler = self._scheduler
+        admitted = []
+
+        async def admit(name: str, size: int) -> None:
+            await scheduler.acquire(size)
+            admitted.append(name)
+
+        await admit('first', 60)
+        tasks = [
+            asyncio.create_task(admit(name, size))
+            for name, size in (('second', 60), ('third', 30), ('large', 500))
+        ]
+        await asyncio.sleep(0)
+        # the small value waits behind the one which doesn't fit
+        self.assertEqual(admitted, ['first'])
+
+        scheduler.release(60)
+        await asyncio.sleep(0)
+        self.assertEqual(admitted, ['first', 'second', 'third'])
+        self.assertEqual(scheduler.in_flight_bytes, 90)
+
+        scheduler.release(60)
+        scheduler.release(30)
+        await asyncio.gather(*tasks)
+        self.assertEqual(admitted, ['first', 'second', 'third', 'large'])
+        scheduler.release(500)
+        self.assertEqual(scheduler.in_flight_bytes, 0)
+
+    """
+    Cancelled waiters leave the queue, the ones behind them are admitted
+    """
+    async def test_cancellation(self) -> None:
+        scheduler = self._scheduler
+        await scheduler.acquire(50)
+        waiting = asyncio.create_task(scheduler.acquire(100))
+        following = asyncio.create_task(scheduler.acquire(40))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await following
+        self.assertEqual(scheduler.in_flight_bytes, 90)
+
+    """
+    Submitted values are processed in the thread pool
+    and release their bytes once done
+    """
+    async def test_submit(self) -> None:
+        scheduler = self._scheduler
+        results = await asyncio.gather(*(
+            scheduler.submit(bytes.upper, value)
+            for value in (b'a' * 80, b'b' * 80, b'c' * 80)
+        ))
+        self.assertEqual(results, [b'A' * 80, b'B' * 80, b'C' * 80])
+        self.assertEqual(scheduler.in_flight_bytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
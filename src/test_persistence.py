@@ -0,0 +1,285 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+import warnings
+from typing import Optional
+from unittest.mock import patch
+
+import server
+from cache import Cache, get_expiration_timestamp
+from persistence import save_snapshot, load_snapshot, replay_append_log,\
+    AppendOnlyLog, FSYNC_ALWAYS, SNAPSHOT_HEADER, _LOG_HEADER,\
+    _write_items_in_background
+
+
+class PersistenceTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._directory.name, 'cache.snapshot')
+
+    def tearDown(self) -> None:
+        self._directory.cleanup()
+
+    """
+    Snapshot restores the items with their expiration and recency order,
+    the expired items are skipped
+    """
+    def test_snapshot(self) -> None:
+        cache = Cache(max_number_of_items=3)
+        cache.set_item('key_1', b'value_1')
+        cache.set_item('key_2', b'value_2', ttl=100, tags=['tag'])
+        cache.set_item('key_3', b'\x00' * 1000, tags=['tag', 'other'])
+        cache.get_item('key_1')
+        self.assertEqual(save_snapshot(cache, self._path), 3)
+
+        restored = Cache(max_number_of_items=3)
+        self.assertEqual(load_snapshot(restored, self._path), (3, 0))
+        self.assertEqual(sorted(restored.find_keys_by_tag('tag')),
+                         ['key_2', 'key_3'])
+        self.assertEqual(list(restored.iter_items()),
+                         list(cache.iter_items()))
+
+        # the least recently used item is evicted first
+        restored.set_item('key_4', b'value_4')
+        self.assertIsNone(restored.get_item('key_2'))
+        self.assertEqual(restored.get_item('key_1'), b'value_1')
+
+        cache.set_item('key_5', b'value_5', ttl=1)
+        save_snapshot(cache, self._path)
+        time.sleep(1.1)
+        self.assertEqual(load_snapshot(Cache(), self._path), (2, 1))
+
+    """
+    The items of a truncated snapshot are loaded up to the broken record
+    """
+    def test_truncated_snapshot(self) -> None:
+        cache = Cache()
+        for index in range(10):
+            cache.set_item(f'key_{index}', b'value')
+        save_snapshot(cache, self._path)
+        with open(self._path, 'r+b') as file:
+            file.truncate(os.path.getsize(self._path) - 1)
+
+        restored = Cache()
+        self.assertEqual(load_snapshot(restored, self._path), (9, 0))
+        self.assertIsNone(restored.get_item('key_9'))
+
+    """
+    Replaying the log repeats the recorded changes,
+    the broken record at the end of the log is cut off
+    """
+    def test_append_log(self) -> None:
+        cache = Cache()
+        cache.set_item('key_1', b'stale')
+        log = AppendOnlyLog(cache, self._path, FSYNC_ALWAYS, 0)
+        log.record_set('key_1', b'value_1', 0, frozenset(['tag']))
+        log.record_set('key_2', b'value_2', get_expiration_timestamp(100))
+        log.record_set('key_3', b'value_3', 0)
+        log.record_delete('key_3')
+        log.record_set('key_4', b'value_4', 0)
+        log.close()
+        with open(self._path, 'r+b') as file:
+            file.truncate(os.path.getsize(self._path) - 1)
+
+        restored = Cache()
+        self.assertEqual(replay_append_log(restored, self._path), 5)
+        self.assertEqual(restored.get_item('key_1'), b'value_1')
+        self.assertEqual(restored.find_keys_by_tag('tag'), ['key_1'])
+        self.assertEqual(restored.get_item('key_2'), b'value_2')
+        self.assertIsNone(restored.get_item('key_3'))
+        self.assertIsNone(restored.get_item('key_4'))
+
+        # new records follow the complete ones
+        log = AppendOnlyLog(restored, self._path, FSYNC_ALWAYS, 0)
+        log.record_set('key_5', b'value_5', 0)
+        log.close()
+        self.assertEqual(replay_append_log(Cache(), self._path), 6)
+
+    """
+    Rewriting the log shrinks it to the live items
+    and keeps the changes made during the rewrite
+    """
+    def test_append_log_rewrite(self) -> None:
+        cache = Cache()
+        log = AppendOnlyLog(cache, self._path, FSYNC_ALWAYS, 0)
+        for index in range(1000):
+            log.record_set('key', str(index).encode(), 0)
+            cache.set_item('key', str(index).encode())
+
+        async def rewrite() -> None:
+            task = asyncio.create_task(log.rewrite(cache))
+            await asyncio.sleep(0)
+            log.record_set('key_2', b'value_2', 0)
+            await task
+
+        # the log size is updated once the records are written
+        deadline = time.monotonic() + 5
+        while not log.is_rewrite_needed():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        asyncio.run(rewrite())
+        log.close()
+        self.assertEqual(replay_append_log(Cache(), self._path), 2)
+
+        restored = Cache()
+        replay_append_log(restored, self._path)
+        self.assertEqual(restored.get_item('key'), b'999')
+        self.assertEqual(restored.get_item('key_2'), b'value_2')
+
+    """
+    The writer child takes none of the locks other threads hold
+    at the fork, its failure is reported with the traceback
+    written to the stderr
+    """
+    def test_writer_child(self) -> None:
+        cache = Cache()
+        cache.set_item('key', b'value')
+        log = AppendOnlyLog(cache, self._path + '.log', FSYNC_ALWAYS, 0)
+        self.addCleanup(log.close)
+        locked = threading.Event()
+        unlocked = threading.Event()
+
+        def hold_lock() -> None:
+            with log._condition:
+                locked.set()
+                unlocked.wait()
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        locked.wait()
+        self.addCleanup(thread.join)
+        self.addCleanup(unlocked.set)
+
+        def write() -> None:
+            asyncio.run(asyncio.wait_for(_write_items_in_background(
+                cache, self._path, SNAPSHOT_HEADER), 10))
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            write()
+        restored = Cache()
+        self.assertEqual(load_snapshot(restored, self._path)[0], 1)
+        self.assertEqual(restored.get_item('key'), b'value')
+
+        stderr_path = os.path.join(self._directory.name, 'stderr')
+        stderr = os.dup(2)
+        try:
+            with open(stderr_path, 'wb') as file:
+                os.dup2(file.fileno(), 2)
+            with patch('persistence._write_items',
+                       side_effect=OSError('No space left')),\
+                    self.assertRaises(RuntimeError):
+                write()
+        finally:
+            os.dup2(stderr, 2)
+            os.close(stderr)
+        with open(stderr_path) as file:
+            self.assertIn('OSError: No space left', file.read())
+
+    """
+    A failed write is counted and makes the log be rewritten,
+    the writer keeps writing the later records
+    """
+    def test_append_log_failure(self) -> None:
+        cache = Cache()
+        log = AppendOnlyLog(cache, self._path, FSYNC_ALWAYS, 1 << 30)
+        # the expiration doesn't fit in the record
+        log.record_set('broken', b'value', 1 << 70)
+        deadline = time.monotonic() + 5
+        while not log.get_stats()['append_log_errors']:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertTrue(log.is_rewrite_needed())
+
+        # huge TTLs are clamped to fit
+        cache.set_item('key', b'value', 100000000000)
+        log.record_set('key', b'value', cache.get_expiration('key'))
+        asyncio.run(log.rewrite(cache))
+        log.close()
+        self.assertFalse(log.is_rewrite_needed())
+        self.assertEqual(log.get_stats()['append_log_errors'], 1)
+
+        restored = Cache()
+        self.assertEqual(replay_append_log(restored, self._path), 1)
+        self.assertEqual(restored.get_item('key'), b'value')
+        self.assertEqual(restored.get_expiration('key'),
+                         cache.get_expiration('key'))
+
+
+class LoadingTest(unittest.TestCase):
+    """
+    Loads the items the way the server does on startup
+    """
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self._snapshot_path = os.path.join(
+            self._directory.name, 'cache.snapshot')
+        self._log_path = os.path.join(self._directory.name, 'cache.log')
+        cache = Cache()
+        cache.set_item('snapshot_key', b'value')
+        save_snapshot(cache, self._snapshot_path)
+
+    def _load(self, log_data: Optional[bytes] = None) -> Cache:
+        if log_data is not None:
+            with open(self._log_path, 'wb') as file:
+                file.write(log_data)
+        with patch.object(server, 'SNAPSHOT_PATH', self._snapshot_path),\
+                patch.object(server, 'APPEND_LOG_PATH', self._log_path):
+            instance = server.Server(replica_of=None)
+            instance._load_items()
+        assert instance._log is not None
+        instance._log.close()
+        return instance._cache
+
+    def _write_log(self, *keys: str) -> bytes:
+        log = AppendOnlyLog(Cache(), self._log_path, FSYNC_ALWAYS, 0)
+        for key in keys:
+            log.record_set(key, b'value', 0)
+        log.close()
+        with open(self._log_path, 'rb') as file:
+            data = file.read()
+        os.remove(self._log_path)
+        return data
+
+    def _assert_moved_aside(self, data: bytes) -> None:
+        with open(f'{self._log_path}.broken', 'rb') as file:
+            self.assertEqual(file.read(), data)
+
+    """
+    An empty log or one with a foreign header is moved aside,
+    the items are loaded from the snapshot and start a new log
+    """
+    def test_unreadable_log(self) -> None:
+        foreign = b'FOREIGN\r\n' + self._write_log('key')[len(_LOG_HEADER):]
+        for data in (b'', foreign):
+            cache = self._load(data)
+            self.assertEqual(cache.get_item('snapshot_key'), b'value')
+            self._assert_moved_aside(data)
+            restored = Cache()
+            self.assertEqual(replay_append_log(restored, self._log_path), 1)
+            self.assertEqual(restored.get_item('snapshot_key'), b'value')
+            os.remove(self._log_path)
+
+    """
+    The changes read before a broken record are kept,
+    the snapshot is older than them
+    """
+    def test_broken_log(self) -> None:
+        data = self._write_log('key_1', 'key_2')
+        # the operation of the last record is unknown
+        position = len(self._write_log('key_1'))
+        broken = data[:position] + b'\x09' + data[position + 1:]
+        cache = self._load(broken)
+        self.assertEqual(cache.get_item('key_1'), b'value')
+        self.assertIsNone(cache.get_item('key_2'))
+        self.assertIsNone(cache.get_item('snapshot_key'))
+        self._assert_moved_aside(broken)
+
+
+if __name__ == '__main__':
+    unittest.main()
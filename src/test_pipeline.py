@@ -0,0 +1,131 @@
+import asyncio
+import unittest
+from typing import List
+from unittest import IsolatedAsyncioTestCase
+
+from config import PORT, HOST, MAX_MESSAGE_SIZE
+from pipeline import PipelineBuffer
+from server_utils import MalformedMessageException
+from test_utils import send_message, receive_message, decode_and_trim,\
+    NOT_FOUND, SUCCESS, SEPARATOR
+
+
+_NUMBER_OF_ITEMS = 100
+
+
+class PipelineTest(IsolatedAsyncioTestCase):
+
+    """
+    Sends a batch of commands at once in the pipelined mode
+    and reads all responses back
+    """
+    async def test_pipeline(self) -> None:
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+
+        await send_message('pipeline', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), SUCCESS)
+
+        # insert items, values follow their headers without a prompt
+        batch = ''
+        for index in range(_NUMBER_OF_ITEMS):
+            value = f'value_{index}'
+            batch += f'set pipeline_{index} 0 {len(value)}{SEPARATOR}'
+            batch += f'{value}{SEPARATOR}'
+        writer.write(batch.encode())
+        await writer.drain()
+        for _ in range(_NUMBER_OF_ITEMS):
+            response = await receive_message(reader)
+            self.assertEqual(decode_and_trim(response), SUCCESS)
+
+        # read them back
+        batch = ''.join(
+            f'get pipeline_{index}{SEPARATOR}'
+            for index in range(_NUMBER_OF_ITEMS))
+        writer.write(batch.encode())
+        await writer.drain()
+        for index in range(_NUMBER_OF_ITEMS):
+            value = f'value_{index}'
+            response = await receive_message(reader)
+            self.assertEqual(decode_and_trim(response), str(len(value)))
+            response = await receive_message(reader, len(value))
+            self.assertEqual(decode_and_trim(response), value)
+
+        # delete them
+        batch = ''.join(
+            f'del pipeline_{index}{SEPARATOR}'
+            for index in range(_NUMBER_OF_ITEMS))
+        writer.write(batch.encode())
+        await writer.drain()
+        for _ in range(_NUMBER_OF_ITEMS):
+            response = await receive_message(reader)
+            self.assertEqual(decode_and_trim(response), SUCCESS)
+
+        await send_message('get pipeline_0', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), NOT_FOUND)
+
+        # the value of a rejected header isn't taken for a command
+        writer.write(
+            f'set pipeline_0 -1 3{SEPARATOR}del{SEPARATOR}'
+            f'get pipeline_0{SEPARATOR}'.encode())
+        await writer.drain()
+        response = await receive_message(reader)
+        self.assertTrue(decode_and_trim(response).startswith('Bad argument'))
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), NOT_FOUND)
+
+        writer.close()
+        await writer.wait_closed()
+
+
+class PipelineBufferTest(unittest.TestCase):
+
+    """
+    In the pipelined mode the values of the rejected headers are skipped,
+    even when they arrive later. Out of it the client sends no value
+    after the error, so the next line is a command.
+    """
+    def test_rejected_values(self) -> None:
+        # the errors and the names of the parsed commands
+        def pop(buffer: PipelineBuffer, data: str) -> List[str]:
+            buffer.feed(data.encode())
+            return [
+                command_or_error.command.get_id()
+                if command_or_error.command is not None
+                else str(command_or_error.error)
+                for command_or_error in buffer.pop_commands()
+            ]
+
+        buffer = PipelineBuffer()
+        errors = pop(buffer, f'set key -1 3{SEPARATOR}get key{SEPARATOR}')
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(errors[0].startswith('Bad argument'))
+        self.assertEqual(errors[1], 'get')
+
+        self.assertEqual(pop(buffer, f'pipeline{SEPARATOR}'), ['pipeline'])
+        self.assertEqual(
+            pop(buffer, f'mset key -1 3 other 0 2{SEPARATOR}del{SEPARATOR}'),
+            [])
+        errors = pop(buffer, f'ok{SEPARATOR}del key{SEPARATOR}')
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(errors[0].startswith('Bad argument'))
+        self.assertEqual(errors[1], 'del')
+
+        # the size is unknown, nothing is skipped
+        errors = pop(buffer, f'set key 0 x{SEPARATOR}del key{SEPARATOR}')
+        self.assertEqual(errors[1:], ['del'])
+
+        # the value of an undecodable header is skipped as well
+        buffer.feed(b'set k\xff 0 9' + SEPARATOR.encode())
+        errors = pop(buffer, f'del other{SEPARATOR}get key{SEPARATOR}')
+        self.assertEqual(len(errors), 2)
+        self.assertIn('failed to decode', errors[0])
+        self.assertEqual(errors[1], 'get')
+
+        with self.assertRaises(MalformedMessageException):
+            pop(buffer, f'set key 0 {MAX_MESSAGE_SIZE + 1}{SEPARATOR}')
+
+
+if __name__ == '__main__':
+    unittest.main()
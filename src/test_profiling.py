@@ -0,0 +1,68 @@
+import os
+import pstats
+import tempfile
+import unittest
+
+from cache import Cache
+from command_parser import parse_command
+from profiling import Profiler, PROFILE_CPU, PROFILE_MEMORY
+
+
+def _fill_cache() -> Cache:
+    cache = Cache(max_number_of_items=100)
+    for index in range(1000):
+        cache.set_item(f'key_{index}', b'x' * 100)
+    return cache
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self._profiler = Profiler(
+            os.path.join(self._directory.name, 'server'))
+
+    def tearDown(self) -> None:
+        self._directory.cleanup()
+
+    """
+    CPU profile is written in the pstats format,
+    the profiler can't be started twice or stopped before the start
+    """
+    def test_cpu_profile(self) -> None:
+        self.assertIsNone(self._profiler.stop(PROFILE_CPU))
+        self.assertTrue(self._profiler.start(PROFILE_CPU))
+        self.assertFalse(self._profiler.start(PROFILE_CPU))
+        _fill_cache()
+        path = self._profiler.stop(PROFILE_CPU)
+        self.assertIsNotNone(path)
+        assert path is not None
+
+        functions = pstats.Stats(path).stats  # type: ignore
+        self.assertIn('set_item', {name for _, _, name in functions})
+        self.assertFalse(self._profiler.is_running(PROFILE_CPU))
+
+    """
+    Memory profile lists the allocation sites
+    """
+    def test_memory_profile(self) -> None:
+        self.assertTrue(self._profiler.start(PROFILE_MEMORY))
+        # the items are still alive when the snapshot is taken
+        cache = _fill_cache()
+        path = self._profiler.stop(PROFILE_MEMORY)
+        self.assertIsNotNone(path)
+        assert path is not None
+        with open(path) as file:
+            self.assertIn('cache.py', file.read())
+        self.assertEqual(cache.get_stats()['items'], 100)
+
+    def test_command_arguments(self) -> None:
+        self.assertIsNotNone(parse_command('profile cpu start').command)
+        self.assertIsNotNone(parse_command('profile memory stop').command)
+        self.assertIsNotNone(parse_command('profile disk start').error)
+        self.assertIsNotNone(parse_command('profile cpu pause').error)
+        self.assertIsNotNone(parse_command('profile cpu').error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import asyncio
+import time
+import unittest
+from typing import List, Sequence
+from unittest import IsolatedAsyncioTestCase
+
+from cache import Cache
+from compression import COMPRESSION_ZLIB
+from config import HOST
+from offload import OffloadScheduler
+from replication import ReplicationSource, Replica
+
+
+# polling of the replica state, in seconds
+_POLL_INTERVAL = 0.01
+_TIMEOUT = 5
+
+
+class ReplicationTest(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self._primary = Cache()
+        self._source = ReplicationSource()
+        self._server = await asyncio.start_server(
+            lambda reader, writer: self._source.serve_replica(
+                self._primary, reader, writer),
+            HOST, 0
+        )
+        port = self._server.sockets[0].getsockname()[1]
+        self._replica_caches: List[Cache] = []
+        self._offload = OffloadScheduler()
+        self._replica = Replica(
+            HOST, port, self._create_replica_cache, self._offload)
+
+    async def asyncTearDown(self) -> None:
+        self._offload.close()
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _create_replica_cache(self) -> Cache:
+        # the replica compresses the large values off the event loop
+        self._replica_caches.append(Cache(compression=COMPRESSION_ZLIB))
+        return self._replica_caches[-1]
+
+    def _set(
+            self,
+            key: str,
+            value: bytes,
+            ttl: int = 0,
+            tags: Sequence[str] = ()
+    ) -> None:
+        self._primary.set_item(key, value, ttl, tags=tags)
+        expiration = self._primary.get_expiration(key)
+        assert expiration is not None
+        self._source.record_set(
+            key, value, expiration, self._primary.get_tags(key))
+
+    def _delete(self, key: str) -> None:
+        self._source.record_delete(key)
+        self._primary.delete_item(key)
+
+    async def _wait_for(self, name: str, value: int) -> None:
+        deadline = time.monotonic() + _TIMEOUT
+        while self._replica.get_stats()[name] != value:
+            self.assertLess(time.monotonic(), deadline)
+            await asyncio.sleep(_POLL_INTERVAL)
+
+    """
+    The replica loads the items present on connection,
+    then applies the following changes with the same expiration and tags
+    """
+    async def test_replication(self) -> None:
+        self._set('existing', b'1', tags=['tag'])
+        self._set('expiring', b'2', ttl=100)
+        self._set('deleted', b'3')
+        self.assertEqual(self._replica.get_stats()['replication_lag_ms'], -1)
+
+        task = asyncio.create_task(self._replica.run())
+        try:
+            await self._wait_for('replication_synced', 1)
+            self.assertEqual(self._source.get_stats()['replicas'], 1)
+            self._set('new', b'4', tags=['tag', 'new'])
+            self._set('existing', b'5', ttl=100)
+            self._delete('deleted')
+            self._set('new_expiring', b'6', ttl=50)
+            self._set('large', b'7' * 100000)
+            await self._wait_for('replication_changes', 8)
+
+            replica = self._replica_caches[-1]
+            self.assertEqual(list(replica.iter_items()),
+                             list(self._primary.iter_items()))
+            # replacing "existing" dropped its tags
+            self.assertEqual(replica.find_keys_by_tag('tag'), ['new'])
+            self.assertEqual(replica.get_stats()['compressed_items'], 1)
+            stats = self._replica.get_stats()
+            self.assertEqual(stats['replication_connected'], 1)
+            self.assertGreaterEqual(stats['replication_lag_ms'], 0)
+            self.assertLess(stats['replication_lag_ms'], 1000)
+        finally:
+            task.cancel()
+
+
+if __name__ == '__main__':
+    unittest.main()
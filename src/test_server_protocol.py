@@ -0,0 +1,160 @@
+import asyncio
+import unittest
+from typing import Optional
+from unittest import IsolatedAsyncioTestCase
+
+from binary_protocol import BinaryRequest, OPCODE_GET, OPCODE_SET,\
+    STATUS_SUCCESS, STATUS_NOT_STORED
+from cache import Cache
+from commands import Command, CommandSet
+from command_executor import execute_command, execute_binary_request
+from config import HOST
+from metrics import ServerMetrics
+from responses import Response
+from server_protocol import ClientProtocol
+from test_binary_protocol import _build_request, _receive_response
+from test_utils import send_message, receive_message, decode_and_trim,\
+    SUCCESS
+
+
+class ServerProtocolTest(IsolatedAsyncioTestCase):
+    """
+    Serves the connections with the protocol core
+    on top of a cache of its own
+    """
+
+    async def asyncSetUp(self) -> None:
+        self._cache = Cache(compression=None)
+        receive_buffer = memoryview(bytearray(64 * 1024))
+        self._server = await asyncio.get_running_loop().create_server(
+            lambda: ClientProtocol(
+                receive_buffer, self._execute, self._execute_binary,
+                self._offload, self._offload_binary, ServerMetrics()),
+            HOST, 0
+        )
+        port = self._server.sockets[0].getsockname()[1]
+        self._reader, self._writer =\
+            await asyncio.open_connection(HOST, port)
+
+    async def asyncTearDown(self) -> None:
+        self._writer.close()
+        await self._writer.wait_closed()
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _execute(self, command: Command) -> Response:
+        return execute_command(command, self._cache)
+
+    def _execute_binary(self, request: BinaryRequest) -> Response:
+        return execute_binary_request(request, self._cache)
+
+    # The values starting with "fail" fail to be prepared,
+    # the others are prepared off the event loop
+    def _offload(self, command: Command) -> 'Optional[asyncio.Task[None]]':
+        if not isinstance(command, CommandSet):
+            return None
+        return asyncio.ensure_future(
+            self._prepare(command.get_bytes_attachment()))
+
+    def _offload_binary(
+            self, request: BinaryRequest
+    ) -> 'Optional[asyncio.Task[BinaryRequest]]':
+        if request.opcode != OPCODE_SET:
+            return None
+        return asyncio.ensure_future(self._prepare_request(request))
+
+    @staticmethod
+    async def _prepare(value: bytes) -> None:
+        await asyncio.sleep(0.01)
+        if value.startswith(b'fail'):
+            raise ValueError('Failed to prepare the value')
+
+    async def _prepare_request(
+            self, request: BinaryRequest) -> BinaryRequest:
+        await self._prepare(request.value)
+        return request
+
+    async def _request(self, message: str) -> str:
+        await send_message(message, self._writer)
+        return decode_and_trim(await receive_message(self._reader))
+
+    """
+    Commands are answered in order, waiting for the ones prepared
+    off the event loop, both in the regular and the pipelined mode
+    """
+    async def test_commands(self) -> None:
+        self.assertEqual(await self._request('set key 0 5'),
+                         'Send 5 bytes, terminated with \\r\\n.')
+        self.assertEqual(await self._request('value'), SUCCESS)
+        self.assertEqual(await self._request('get key'), '5')
+        self.assertEqual(
+            decode_and_trim(await receive_message(self._reader)), 'value')
+
+        self.assertEqual(await self._request('pipeline'), SUCCESS)
+        # the value of the rejected header is skipped
+        await send_message(
+            'set key 0 3\r\nnew\r\nset other -1 1\r\n1\r\n'
+            'set other 0 1\r\n1\r\nget key',
+            self._writer)
+        self.assertEqual(
+            decode_and_trim(await receive_message(self._reader)), SUCCESS)
+        self.assertTrue(decode_and_trim(
+            await receive_message(self._reader)).startswith('Bad argument'))
+        for expected in (SUCCESS, '3', 'new'):
+            self.assertEqual(
+                decode_and_trim(await receive_message(self._reader)),
+                expected)
+
+    """
+    A command which preparation fails is answered with an error,
+    the following commands are served
+    """
+    async def test_failed_preparation(self) -> None:
+        await self._request('pipeline')
+        await send_message(
+            'set key 0 4\r\nfail\r\nset key 0 2\r\nok\r\nget key',
+            self._writer)
+        for expected in ('COMMAND_FAILED', SUCCESS, '2', 'ok'):
+            self.assertEqual(
+                decode_and_trim(await asyncio.wait_for(
+                    receive_message(self._reader), 5)),
+                expected)
+
+    """
+    Requests of the binary protocol are detected by the first byte
+    """
+    async def test_binary_requests(self) -> None:
+        self._writer.write(
+            _build_request(OPCODE_SET, 'key', b'value', opaque=1) +
+            _build_request(OPCODE_GET, 'key', opaque=2))
+        _, opcode, status, _, opaque = await _receive_response(self._reader)
+        self.assertEqual((opcode, status, opaque),
+                         (OPCODE_SET, STATUS_SUCCESS, 1))
+        _, opcode, status, value, opaque =\
+            await _receive_response(self._reader)
+        self.assertEqual((opcode, status, value, opaque),
+                         (OPCODE_GET, STATUS_SUCCESS, b'value', 2))
+
+    """
+    A binary request which preparation fails isn't stored,
+    the following requests wait for the prepared ones in order
+    """
+    async def test_failed_binary_preparation(self) -> None:
+        self._writer.write(
+            _build_request(OPCODE_SET, 'key', b'fail', opaque=1) +
+            _build_request(OPCODE_SET, 'key', b'value', opaque=2) +
+            _build_request(OPCODE_GET, 'key', opaque=3))
+        responses = [
+            await asyncio.wait_for(_receive_response(self._reader), 5)
+            for _ in range(3)
+        ]
+        self.assertEqual(
+            [(opcode, status, value, opaque)
+             for _, opcode, status, value, opaque in responses],
+            [(OPCODE_SET, STATUS_NOT_STORED, b'', 1),
+             (OPCODE_SET, STATUS_SUCCESS, b'', 2),
+             (OPCODE_GET, STATUS_SUCCESS, b'value', 3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
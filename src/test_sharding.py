@@ -0,0 +1,33 @@
+import unittest
+
+from sharding import HashRing
+
+
+_NUMBER_OF_KEYS = 10000
+
+
+class ShardingTest(unittest.TestCase):
+
+    """
+    Keys are spread evenly over the nodes, and adding a node
+    only moves the keys that now belong to that node
+    """
+    def test_hash_ring(self) -> None:
+        nodes = [f'127.0.0.1:{port}' for port in range(8888, 8892)]
+        keys = [f'key_{index}' for index in range(_NUMBER_OF_KEYS)]
+
+        ring = HashRing(nodes)
+        owners = [ring.get_node_index(key) for key in keys]
+        for index in range(len(nodes)):
+            share = owners.count(index) / _NUMBER_OF_KEYS
+            self.assertGreater(share, 0.5 / len(nodes))
+            self.assertLess(share, 1.5 / len(nodes))
+
+        extended_ring = HashRing(nodes + ['127.0.0.1:8892'])
+        for key, owner in zip(keys, owners):
+            new_owner = extended_ring.get_node_index(key)
+            self.assertIn(new_owner, (owner, len(nodes)))
+
+
+if __name__ == '__main__':
+    unittest.main()
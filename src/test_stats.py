@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+from unittest import IsolatedAsyncioTestCase
+from typing import Dict
+
+from config import PORT, HOST
+from test_utils import send_message, receive_message, decode_and_trim,\
+    SUCCESS
+
+
+_VALUE_LENGTH = 1000
+
+
+async def get_stats(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter) -> Dict[str, str]:
+    await send_message('stats', writer)
+    stats: Dict[str, str] = {}
+    while True:
+        line = decode_and_trim(await receive_message(reader))
+        if line == 'END':
+            return stats
+        _, name, value = line.split()
+        stats[name] = value
+
+
+class StatsTest(IsolatedAsyncioTestCase):
+
+    """
+    Memory usage reported by the stats command follows stored items
+    """
+    async def test_memory_usage(self) -> None:
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+
+        stats = await get_stats(reader, writer)
+        memory_before = int(stats['memory_bytes'])
+        items_before = int(stats['items'])
+        self.assertGreater(int(stats['max_memory_bytes']), 0)
+
+        value = 'x' * _VALUE_LENGTH
+        await send_message(f'set stats_item 0 {len(value)}', writer)
+        await receive_message(reader)
+        await send_message(value, writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), SUCCESS)
+
+        stats = await get_stats(reader, writer)
+        self.assertEqual(int(stats['items']), items_before + 1)
+        self.assertGreater(
+            int(stats['memory_bytes']), memory_before + _VALUE_LENGTH)
+
+        await send_message('del stats_item', writer)
+        await receive_message(reader)
+        stats = await get_stats(reader, writer)
+        self.assertEqual(int(stats['items']), items_before)
+        self.assertEqual(int(stats['memory_bytes']), memory_before)
+
+        writer.close()
+        await writer.wait_closed()
+
+    """
+    Hits and misses of the cache, and the latency of the commands
+    are counted
+    """
+    async def test_counters(self) -> None:
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+
+        stats = await get_stats(reader, writer)
+        hits_before = int(stats['hits'])
+        misses_before = int(stats['misses'])
+        gets_before = int(stats.get('get_count', 0))
+
+        await send_message('set stats_counter 0 1', writer)
+        await receive_message(reader)
+        await send_message('1', writer)
+        await receive_message(reader)
+        for key in ('stats_counter', 'stats_missing', 'stats_counter'):
+            await send_message(f'get {key}', writer)
+            response = await receive_message(reader)
+            if decode_and_trim(response) != 'NOT_FOUND':
+                await receive_message(reader)
+
+        stats = await get_stats(reader, writer)
+        self.assertEqual(int(stats['hits']), hits_before + 2)
+        self.assertEqual(int(stats['misses']), misses_before + 1)
+        self.assertEqual(int(stats['get_count']), gets_before + 3)
+        self.assertGreater(int(stats['get_p99_us']), 0)
+        self.assertGreater(int(stats['connections']), 0)
+        self.assertGreater(int(stats['bytes_received']), 0)
+
+        writer.close()
+        await writer.wait_closed()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import asyncio
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from config import PORT, HOST
+from test_utils import send_message, receive_message, decode_and_trim,\
+    NOT_FOUND, SUCCESS
+
+
+class TtlTest(IsolatedAsyncioTestCase):
+
+    """
+    Items expire after their TTL, replacing an item resets its TTL
+    """
+    async def test_ttl(self) -> None:
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+
+        for key, ttl in (('ttl_expiring', 1), ('ttl_replaced', 1),
+                         ('ttl_replaced', 0)):
+            value = key
+            await send_message(f'set {key} {ttl} {len(value)}', writer)
+            await receive_message(reader)
+            await send_message(value, writer)
+            response = await receive_message(reader)
+            self.assertEqual(decode_and_trim(response), SUCCESS)
+
+        await send_message('get ttl_expiring', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), str(len('ttl_expiring')))
+        await receive_message(reader, len('ttl_expiring'))
+
+        await asyncio.sleep(1.2)
+
+        await send_message('get ttl_expiring', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), NOT_FOUND)
+
+        await send_message('get ttl_replaced', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), str(len('ttl_replaced')))
+        await receive_message(reader, len('ttl_replaced'))
+
+        await send_message('del ttl_replaced', writer)
+        response = await receive_message(reader)
+        self.assertEqual(decode_and_trim(response), SUCCESS)
+
+        writer.close()
+        await writer.wait_closed()
+
+
+if __name__ == '__main__':
+    unittest.main()
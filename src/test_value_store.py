@@ -0,0 +1,137 @@
+import unittest
+
+from cache import get_expiration_timestamp, MAX_EXPIRATION_TIMESTAMP
+from value_store import SlabValueStore, _CHUNK_SHIFT, _MIN_CHUNK_SIZE,\
+    _PAGE_SIZE, _SLAB_RECORD_BYTES
+
+
+class SlabValueStoreTest(unittest.TestCase):
+
+    """
+    Each value takes the smallest chunk it fits in
+    """
+    def test_class_selection(self) -> None:
+        store = SlabValueStore()
+        chunk_sizes = store._chunk_sizes
+        for length in (0, 1, _MIN_CHUNK_SIZE, _MIN_CHUNK_SIZE + 1, 1000):
+            value = b'v' * length
+            handle = store.put(value, 0)
+            chunk_size = store.get_footprint(handle) - _SLAB_RECORD_BYTES
+            self.assertGreaterEqual(chunk_size, length)
+            index = chunk_sizes.index(chunk_size)
+            if index > 0:
+                self.assertLess(chunk_sizes[index - 1], length)
+            self.assertEqual(store.get_value(handle), value)
+        self.assertEqual(
+            store.get_footprint(store.put(b'v', 0)),
+            _MIN_CHUNK_SIZE + _SLAB_RECORD_BYTES)
+
+    """
+    Released chunks are handed out again before new pages are allocated
+    """
+    def test_chunk_reuse(self) -> None:
+        store = SlabValueStore()
+        first = store.put(b'first', 100, version=1)
+        second = store.put(b'second', 200, version=2)
+        store.free(first)
+        third = store.put(b'third', 300, compressed=True, version=3)
+        self.assertEqual(third >> _CHUNK_SHIFT, first >> _CHUNK_SHIFT)
+        self.assertEqual(store.get_value(third), b'third')
+        self.assertEqual(store.get_expiration(third), 300)
+        self.assertEqual(store.get_version(third), 3)
+        self.assertTrue(store.is_compressed(third))
+        # the other item is intact
+        self.assertEqual(store.get_value(second), b'second')
+        self.assertEqual(store.get_expiration(second), 200)
+        self.assertEqual(store.get_version(second), 2)
+        self.assertFalse(store.is_compressed(second))
+
+        # a full page of chunks is allocated at once
+        slab_class = store._classes[0]
+        self.assertEqual(len(slab_class.pages), 1)
+        for _ in range(slab_class.chunks_per_page - 2):
+            store.put(b'x', 0)
+        self.assertEqual(len(slab_class.pages), 1)
+        store.put(b'x', 0)
+        self.assertEqual(len(slab_class.pages), 2)
+
+    """
+    Pages left with no items are released but one, and their indexes
+    are reused for the pages allocated later
+    """
+    def test_page_release(self) -> None:
+        store = SlabValueStore()
+        slab_class = store._classes[0]
+        handles = [
+            store.put(b'x', 0)
+            for _ in range(3 * slab_class.chunks_per_page)
+        ]
+        self.assertEqual(len(slab_class.pages), 3)
+        for handle in handles[slab_class.chunks_per_page:]:
+            store.free(handle)
+        self.assertEqual(
+            [page is not None for page in slab_class.pages],
+            [True, True, False])
+        for handle in handles[:slab_class.chunks_per_page]:
+            store.free(handle)
+        self.assertEqual(
+            [page is not None for page in slab_class.pages],
+            [False, True, False])
+
+        handles = [
+            store.put(b'y', index)
+            for index in range(2 * slab_class.chunks_per_page + 1)
+        ]
+        self.assertEqual(len(slab_class.pages), 3)
+        self.assertTrue(all(page is not None for page in slab_class.pages))
+        for index, handle in enumerate(handles):
+            self.assertEqual(store.get_value(handle), b'y')
+            self.assertEqual(store.get_expiration(handle), index)
+
+    """
+    Values larger than every other class take a whole page
+    """
+    def test_oversize_values(self) -> None:
+        store = SlabValueStore()
+        value = b'v' * _PAGE_SIZE
+        first = store.put(value, 0)
+        second = store.put(b'w' * (_PAGE_SIZE - 1), 0)
+        self.assertEqual(store.get_value(first), value)
+        self.assertEqual(store.get_value(second), b'w' * (_PAGE_SIZE - 1))
+        self.assertEqual(
+            store.get_footprint(first), _PAGE_SIZE + _SLAB_RECORD_BYTES)
+        page_class = store._classes[-1]
+        self.assertEqual(page_class.chunks_per_page, 1)
+        self.assertEqual(len(page_class.pages), 2)
+        store.free(first)
+        store.put(value, 0)
+        self.assertEqual(len(page_class.pages), 2)
+
+    """
+    Counters take 8 bytes and are read as decimal numbers
+    """
+    def test_counters(self) -> None:
+        store = SlabValueStore()
+        handle = store.put_counter(41, 100, 1)
+        self.assertEqual(store.get_counter(handle), 41)
+        handle = store.set_counter(handle, 42, 2)
+        self.assertEqual(store.get_value(handle), b'42')
+        self.assertEqual(store.get_version(handle), 2)
+        self.assertEqual(store.get_expiration(handle), 100)
+        self.assertEqual(
+            store.get_footprint(handle), _MIN_CHUNK_SIZE + _SLAB_RECORD_BYTES)
+        self.assertIsNone(store.get_counter(store.put(b'42', 0)))
+
+    """
+    Expirations of huge TTLs fit in the expiration arrays
+    """
+    def test_huge_ttl(self) -> None:
+        store = SlabValueStore()
+        expiration = get_expiration_timestamp(100000000000)
+        self.assertEqual(expiration, MAX_EXPIRATION_TIMESTAMP)
+        handle = store.put(b'value', expiration)
+        self.assertEqual(store.get_expiration(handle), expiration)
+
+
+if __name__ == '__main__':
+    unittest.main()
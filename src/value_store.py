@@ -0,0 +1,370 @@
+import sys
+from array import array
+from bisect import bisect_left
+from struct import Struct
+from typing import List, Optional, Tuple, Union, NamedTuple
+
+from config import MAX_MESSAGE_SIZE
+
+
+STORAGE_ENGINE_OBJECTS = 'objects'
+STORAGE_ENGINE_SLAB = 'slab'
+
+
+# A tuple keeps the record compact: there is no attributes dict
+class CachedValue(NamedTuple):
+    # the integer itself for the counters
+    value: Union[bytes, int]
+    # timestamp in nanoseconds, guaranteed to be unique for each item
+    expiration: int
+    compressed: bool = False
+    version: int = 0
+
+
+# Reference to a stored item, kept by the cache instead of the item
+ItemHandle = Union[CachedValue, int]
+
+# the smallest chunk size and the growth factor of the slab size classes
+_MIN_CHUNK_SIZE = 64
+_CHUNK_SIZE_FACTOR = 1.25
+# every page holds at least one chunk of the largest size class
+_PAGE_SIZE = max(1024 * 1024, MAX_MESSAGE_SIZE)
+
+# estimated memory held by the slab item handle and its expiration slot
+_SLAB_RECORD_BYTES = sys.getsizeof(1 << 60) + 8
+
+# bit layout of the slab item handle: [chunk index]
+# [size class index: 8 bits][counter: 1 bit][compressed: 1 bit]
+# [value length: 32 bits]
+_LENGTH_BITS = 32
+_CLASS_BITS = 8
+_LENGTH_MASK = (1 << _LENGTH_BITS) - 1
+_CLASS_MASK = (1 << _CLASS_BITS) - 1
+_COMPRESSED_FLAG = 1 << _LENGTH_BITS
+_COUNTER_FLAG = 1 << (_LENGTH_BITS + 1)
+_CLASS_SHIFT = _LENGTH_BITS + 2
+_CHUNK_SHIFT = _CLASS_SHIFT + _CLASS_BITS
+
+# counters are unsigned 64-bit integers,
+# the slab store keeps them in the chunks in this form
+MAX_COUNTER = (1 << 64) - 1
+_COUNTER = Struct('<Q')
+
+
+class ValueStore:
+    """
+    Keeps the values of the cached items along with their expiration
+    and version. The cache refers to each item by the handle returned
+    from "put". Compressed values are stored as is, along with the flag.
+    Counters are stored as integers, so that they are updated
+    without parsing, and read as their decimal representation.
+    """
+
+    def put(
+            self,
+            value: bytes,
+            expiration: int,
+            compressed: bool = False,
+            version: int = 0
+    ) -> ItemHandle:
+        raise NotImplementedError
+
+    def put_counter(
+            self, counter: int, expiration: int, version: int
+    ) -> ItemHandle:
+        raise NotImplementedError
+
+    # Replaces the counter keeping the expiration,
+    # returns the handle of the updated item
+    def set_counter(
+            self, handle: ItemHandle, counter: int, version: int
+    ) -> ItemHandle:
+        raise NotImplementedError
+
+    def get_value(self, handle: ItemHandle) -> bytes:
+        raise NotImplementedError
+
+    # Returns None if the item isn't a counter
+    def get_counter(self, handle: ItemHandle) -> Optional[int]:
+        raise NotImplementedError
+
+    def get_version(self, handle: ItemHandle) -> int:
+        raise NotImplementedError
+
+    def is_compressed(self, handle: ItemHandle) -> bool:
+        raise NotImplementedError
+
+    def get_expiration(self, handle: ItemHandle) -> int:
+        raise NotImplementedError
+
+    def free(self, handle: ItemHandle) -> None:
+        raise NotImplementedError
+
+    # Returns the number of bytes occupied by the item value and record
+    def get_footprint(self, handle: ItemHandle) -> int:
+        raise NotImplementedError
+
+
+class ObjectValueStore(ValueStore):
+    """
+    Each value is a separate bytes object,
+    the handle is a CachedValue record holding the value
+    """
+
+    def put(
+            self,
+            value: bytes,
+            expiration: int,
+            compressed: bool = False,
+            version: int = 0
+    ) -> ItemHandle:
+        return CachedValue(value, expiration, compressed, version)
+
+    def put_counter(
+            self, counter: int, expiration: int, version: int
+    ) -> ItemHandle:
+        return CachedValue(counter, expiration, False, version)
+
+    def set_counter(
+            self, handle: ItemHandle, counter: int, version: int
+    ) -> ItemHandle:
+        assert isinstance(handle, CachedValue)
+        return handle._replace(value=counter, version=version)
+
+    def get_value(self, handle: ItemHandle) -> bytes:
+        assert isinstance(handle, CachedValue)
+        value = handle.value
+        return value if isinstance(value, bytes) else b'%d' % value
+
+    def get_counter(self, handle: ItemHandle) -> Optional[int]:
+        assert isinstance(handle, CachedValue)
+        value = handle.value
+        return value if isinstance(value, int) else None
+
+    def get_version(self, handle: ItemHandle) -> int:
+        assert isinstance(handle, CachedValue)
+        return handle.version
+
+    def is_compressed(self, handle: ItemHandle) -> bool:
+        assert isinstance(handle, CachedValue)
+        return handle.compressed
+
+    def get_expiration(self, handle: ItemHandle) -> int:
+        assert isinstance(handle, CachedValue)
+        return handle.expiration
+
+    def free(self, handle: ItemHandle) -> None:
+        pass
+
+    def get_footprint(self, handle: ItemHandle) -> int:
+        assert isinstance(handle, CachedValue)
+        return sys.getsizeof(handle) + sys.getsizeof(handle.value)
+
+
+class _SlabPage:
+    __slots__ = ('data', 'expirations', 'versions', 'free_chunks')
+
+    def __init__(self, chunk_size: int, chunks_per_page: int) -> None:
+        self.data = bytearray(chunks_per_page * chunk_size)
+        # expiration timestamps of the items by chunk index in the page
+        self.expirations = array('q', bytes(chunks_per_page * 8))
+        # versions of the items by chunk index in the page
+        self.versions = array('Q', bytes(chunks_per_page * 8))
+        # indexes of the free chunks in the page, handed out from the end
+        self.free_chunks = array('I', range(chunks_per_page - 1, -1, -1))
+
+
+class _SlabClass:
+    """
+    Pages of chunks of the same size. A page left with no items
+    is released, except for one spare empty page, which saves
+    allocating a page again when a single item is stored and freed
+    repeatedly.
+    """
+    __slots__ = (
+        'chunk_size', 'chunks_per_page', 'pages', 'released_pages',
+        'partial_pages', 'spare_page'
+    )
+
+    def __init__(self, chunk_size: int) -> None:
+        self.chunk_size = chunk_size
+        self.chunks_per_page = _PAGE_SIZE // chunk_size
+        # the released pages are None, their indexes are reused
+        self.pages: List[Optional[_SlabPage]] = []
+        self.released_pages: List[int] = []
+        # indexes of the pages which may have free chunks,
+        # the last one is allocated from before allocating new pages
+        self.partial_pages: List[int] = []
+        # index of the empty page which is kept, or -1
+        self.spare_page = -1
+
+    def allocate_chunk(self) -> int:
+        partial_pages = self.partial_pages
+        pages = self.pages
+        while partial_pages:
+            page_index = partial_pages[-1]
+            page = pages[page_index]
+            if page is not None and page.free_chunks:
+                break
+            partial_pages.pop()
+        else:
+            page = _SlabPage(self.chunk_size, self.chunks_per_page)
+            if self.released_pages:
+                page_index = self.released_pages.pop()
+                pages[page_index] = page
+            else:
+                page_index = len(pages)
+                pages.append(page)
+            partial_pages.append(page_index)
+        if page_index == self.spare_page:
+            self.spare_page = -1
+        return page_index * self.chunks_per_page + page.free_chunks.pop()
+
+    def free_chunk(self, chunk: int) -> None:
+        page_index, chunk_in_page = divmod(chunk, self.chunks_per_page)
+        page = self.pages[page_index]
+        assert page is not None
+        free_chunks = page.free_chunks
+        if not free_chunks:
+            self.partial_pages.append(page_index)
+        free_chunks.append(chunk_in_page)
+        if len(free_chunks) < self.chunks_per_page:
+            return
+        if self.spare_page < 0:
+            self.spare_page = page_index
+        else:
+            # the index may stay among the partial pages,
+            # it's skipped there until the index is reused
+            self.pages[page_index] = None
+            self.released_pages.append(page_index)
+
+    # Returns the page holding the chunk and the chunk index in it
+    def locate(self, chunk: int) -> Tuple[_SlabPage, int]:
+        page_index, chunk_in_page = divmod(chunk, self.chunks_per_page)
+        page = self.pages[page_index]
+        assert page is not None
+        return page, chunk_in_page
+
+
+class SlabValueStore(ValueStore):
+    """
+    Values are packed into chunks of preallocated pages.
+    Chunks are grouped into size classes, each value takes
+    the smallest chunk it fits in. Released chunks are reused,
+    and the pages left with no items are released, so the memory moves
+    to the size classes in use. The footprint of an item is the size
+    of its chunk: the free chunks of the partly used pages aren't
+    accounted, pages aren't compacted to keep the handles stable.
+    Expiration timestamps and versions are kept in per-page arrays.
+    The handle is an integer encoding the chunk and the value length,
+    so the only object allocated per item is the handle itself,
+    which is not tracked by the garbage collector.
+    """
+
+    def __init__(self) -> None:
+        self._classes: List[_SlabClass] = []
+        self._chunk_sizes: List[int] = []
+        chunk_size = _MIN_CHUNK_SIZE
+        while chunk_size < _PAGE_SIZE:
+            self._add_class(chunk_size)
+            chunk_size = max(
+                int(chunk_size * _CHUNK_SIZE_FACTOR), chunk_size + 1)
+        self._add_class(_PAGE_SIZE)
+        assert len(self._classes) <= _CLASS_MASK + 1
+
+    def put(
+            self,
+            value: bytes,
+            expiration: int,
+            compressed: bool = False,
+            version: int = 0
+    ) -> ItemHandle:
+        length = len(value)
+        class_index = bisect_left(self._chunk_sizes, length)
+        slab_class = self._classes[class_index]
+        chunk = slab_class.allocate_chunk()
+        page, chunk_in_page = slab_class.locate(chunk)
+        offset = chunk_in_page * slab_class.chunk_size
+        page.data[offset:offset + length] = value
+        page.expirations[chunk_in_page] = expiration
+        page.versions[chunk_in_page] = version
+        handle = (chunk << _CHUNK_SHIFT) | (class_index << _CLASS_SHIFT) |\
+            length
+        return handle | _COMPRESSED_FLAG if compressed else handle
+
+    def put_counter(
+            self, counter: int, expiration: int, version: int
+    ) -> ItemHandle:
+        handle = self.put(
+            _COUNTER.pack(counter), expiration, version=version)
+        assert isinstance(handle, int)
+        return handle | _COUNTER_FLAG
+
+    def set_counter(
+            self, handle: ItemHandle, counter: int, version: int
+    ) -> ItemHandle:
+        assert isinstance(handle, int) and handle & _COUNTER_FLAG
+        slab_class = self._classes[(handle >> _CLASS_SHIFT) & _CLASS_MASK]
+        page, chunk_in_page = slab_class.locate(handle >> _CHUNK_SHIFT)
+        _COUNTER.pack_into(
+            page.data, chunk_in_page * slab_class.chunk_size, counter)
+        page.versions[chunk_in_page] = version
+        return handle
+
+    def get_value(self, handle: ItemHandle) -> bytes:
+        assert isinstance(handle, int)
+        slab_class = self._classes[(handle >> _CLASS_SHIFT) & _CLASS_MASK]
+        page, chunk_in_page = slab_class.locate(handle >> _CHUNK_SHIFT)
+        offset = chunk_in_page * slab_class.chunk_size
+        if handle & _COUNTER_FLAG:
+            return b'%d' % _COUNTER.unpack_from(page.data, offset)[0]
+        return bytes(
+            memoryview(page.data)[offset:offset + (handle & _LENGTH_MASK)])
+
+    def get_counter(self, handle: ItemHandle) -> Optional[int]:
+        assert isinstance(handle, int)
+        if not handle & _COUNTER_FLAG:
+            return None
+        slab_class = self._classes[(handle >> _CLASS_SHIFT) & _CLASS_MASK]
+        page, chunk_in_page = slab_class.locate(handle >> _CHUNK_SHIFT)
+        counter: int = _COUNTER.unpack_from(
+            page.data, chunk_in_page * slab_class.chunk_size)[0]
+        return counter
+
+    def get_version(self, handle: ItemHandle) -> int:
+        assert isinstance(handle, int)
+        slab_class = self._classes[(handle >> _CLASS_SHIFT) & _CLASS_MASK]
+        page, chunk_in_page = slab_class.locate(handle >> _CHUNK_SHIFT)
+        return page.versions[chunk_in_page]
+
+    def is_compressed(self, handle: ItemHandle) -> bool:
+        assert isinstance(handle, int)
+        return bool(handle & _COMPRESSED_FLAG)
+
+    def get_expiration(self, handle: ItemHandle) -> int:
+        assert isinstance(handle, int)
+        slab_class = self._classes[(handle >> _CLASS_SHIFT) & _CLASS_MASK]
+        page, chunk_in_page = slab_class.locate(handle >> _CHUNK_SHIFT)
+        return page.expirations[chunk_in_page]
+
+    def free(self, handle: ItemHandle) -> None:
+        assert isinstance(handle, int)
+        slab_class = self._classes[(handle >> _CLASS_SHIFT) & _CLASS_MASK]
+        slab_class.free_chunk(handle >> _CHUNK_SHIFT)
+
+    def get_footprint(self, handle: ItemHandle) -> int:
+        assert isinstance(handle, int)
+        return self._chunk_sizes[(handle >> _CLASS_SHIFT) & _CLASS_MASK] +\
+            _SLAB_RECORD_BYTES
+
+    def _add_class(self, chunk_size: int) -> None:
+        self._classes.append(_SlabClass(chunk_size))
+        self._chunk_sizes.append(chunk_size)
+
+
+def create_value_store(engine: str) -> ValueStore:
+    if engine == STORAGE_ENGINE_OBJECTS:
+        return ObjectValueStore()
+    if engine == STORAGE_ENGINE_SLAB:
+        return SlabValueStore()
+    raise ValueError(f'Unknown storage engine: {engine}')